@@ -7,12 +7,11 @@ Applies MC normalization factors, styles, etc.
 '''
 
 import copy
-from data_styles import data_styles
-import fnmatch
 import logging
 import os
-import rootpy.io as io
 from rootpy.plotting import views
+from file_registry import registry
+from style_matcher import get_best_style
 
 log = logging.getLogger("data_views")
 
@@ -29,29 +28,10 @@ def extract_sample(filename):
 def read_lumi(filename):
     ''' Read lumi stored in a file
 
-    The lumi is stored as a single float value.
+    The lumi is stored as a single float value.  It is only read again if
+    the file changed (see file_registry).
     '''
-    with open(filename) as lumifile:
-        try:
-            return float(lumifile.readline().strip())
-        except ValueError:
-            print "I couldn't extract a float from %s" % filename
-            raise
-
-def get_best_style(sample):
-    best_pattern = ''
-    for pattern, style_dict in data_styles.iteritems():
-        log.debug("Checking pattern: %s against %s", pattern, sample)
-        if fnmatch.fnmatch(sample, pattern):
-            log.debug("-> it matches!")
-            if len(pattern) > len(best_pattern):
-                best_pattern = pattern
-                log.info("Found new best style for %s: %s",
-                         sample, pattern)
-    if best_pattern:
-        return data_styles[best_pattern]
-    else:
-        return None
+    return registry.read_lumi(filename)
 
 def data_views(files, lumifiles, forceLumi=-1):
     ''' Builds views of files.
@@ -69,8 +49,9 @@ def data_views(files, lumifiles, forceLumi=-1):
 
     log.info("Creating views from %i files", len(files))
 
-    # Map sample_name => root file
-    histo_files = dict((extract_sample(x), io.open(x)) for x in files)
+    # Map sample_name => root file.  The files are shared with the other
+    # views of the same files, see release_views.
+    histo_files = dict((extract_sample(x), registry.open(x)) for x in files)
 
     # Map sample_name => lumi file
     lumi_files = dict((extract_sample(x), read_lumi(x)) for x in lumifiles)
@@ -111,17 +92,8 @@ def data_views(files, lumifiles, forceLumi=-1):
         unweighted_view = raw_file
 
         # Find the longest (i.e. most specific) matching style pattern
-        best_pattern = ''
-        for pattern, style_dict in data_styles.iteritems():
-            log.debug("Checking pattern: %s against %s", pattern, sample)
-            if fnmatch.fnmatch(sample, pattern):
-                log.debug("-> it matches!")
-                if len(pattern) > len(best_pattern):
-                    best_pattern = pattern
-                    log.info("Found new best style for %s: %s",
-                             sample, pattern)
-        if best_pattern:
-            style_dict = data_styles[best_pattern]
+        style_dict = get_best_style(sample)
+        if style_dict:
             log.info("Found style for %s - applying Style View", sample)
 
             # Set style and title
@@ -155,3 +127,12 @@ def data_views(files, lumifiles, forceLumi=-1):
     }
 
     return output
+
+def release_views(sample_views):
+    ''' Release the files opened by data_views
+
+    The files are closed once all the views using them have been released.
+    '''
+    for sample, sample_info in sample_views.iteritems():
+        if 'file' in sample_info:
+            registry.release(sample_info['file'])
@@ -0,0 +1,108 @@
+'''
+
+A process-wide registry of opened sample files and luminosities.
+
+Scripts often build several Plotters (blinded, unblinded, one per channel...)
+over the same samples.  Instead of each of them opening every file again, the
+files are opened once and shared, keyed by their real path.  Each open() adds
+a reference to the file, and it is closed when all of them are released.
+
+The luminosity files are read once, and read again only if they change.
+
+Example:
+
+    from FinalStateAnalysis.MetaData.file_registry import registry
+    file = registry.open('results/Zjets_M50.root')
+    lumi = registry.read_lumi('inputs/Zjets_M50.lumicalc.sum')
+    ...
+    registry.release(file)
+
+The registry is emptied in processes forked from the one which opened the
+files (i.e. the render_batch workers of the Plotter), so they don't share the
+file handles.
+
+'''
+
+import logging
+import os
+import rootpy.io as io
+
+log = logging.getLogger("file_registry")
+
+
+def _parse_lumi(filename):
+    ''' Read lumi stored in a file
+
+    The lumi is stored as a single float value.
+    '''
+    with open(filename) as lumifile:
+        try:
+            return float(lumifile.readline().strip())
+        except ValueError:
+            print "I couldn't extract a float from %s" % filename
+            raise
+
+
+class FileRegistry(object):
+    def __init__(self):
+        self.pid = os.getpid()
+        # real path => [file, number of references]
+        self.files = {}
+        # real path => (mtime, lumi)
+        self.lumis = {}
+
+    def _check_process(self):
+        if os.getpid() != self.pid:
+            # Forked: forget the files of the parent, without closing them.
+            self.pid = os.getpid()
+            self.files = {}
+
+    def open(self, filename):
+        ''' Open a ROOT file (read only), or get it if it is already open '''
+        self._check_process()
+        path = os.path.realpath(filename)
+        entry = self.files.get(path)
+        if entry is None:
+            log.debug("Opening %s", path)
+            entry = self.files[path] = [io.open(filename), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, file):
+        ''' Release a file (or file name) got from open()
+
+        The file is closed once all the references are released.
+        '''
+        self._check_process()
+        if isinstance(file, basestring):
+            path = os.path.realpath(file)
+        else:
+            path = os.path.realpath(file.GetName())
+        entry = self.files.get(path)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            log.debug("Closing %s", path)
+            del self.files[path]
+            entry[0].Close()
+
+    def references(self, filename):
+        ''' Number of references to [filename], 0 if it isn't open '''
+        self._check_process()
+        entry = self.files.get(os.path.realpath(filename))
+        return entry[1] if entry else 0
+
+    def read_lumi(self, filename):
+        ''' Read the lumi stored in a file, if it changed since last time '''
+        path = os.path.realpath(filename)
+        mtime = os.stat(path).st_mtime
+        cached = self.lumis.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        lumi = _parse_lumi(filename)
+        self.lumis[path] = (mtime, lumi)
+        return lumi
+
+# The registry used by data_views and FileView
+registry = FileRegistry()
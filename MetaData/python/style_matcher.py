@@ -0,0 +1,126 @@
+'''
+
+Find the most specific data_styles pattern for a sample.
+
+The styles are keyed by glob patterns like "Zjets*" or "VH*HWW*".  The most
+specific pattern matching a sample is the longest one.  Instead of trying
+each pattern with fnmatch for each sample, the patterns are translated into
+one regular expression, with the alternatives ordered from the longest to the
+shortest pattern - so the first alternative which matches is the best.  The
+result is memoized for each sample name.
+
+    >>> matcher = PatternMatcher(['Zjets*', 'Zjets_M50*', 'data_*'])
+    >>> matcher.best('Zjets_M50_skim')
+    'Zjets_M50*'
+    >>> matcher.best('Zjets_M10')
+    'Zjets*'
+    >>> matcher.best('WZ') is None
+    True
+
+The StyleMatcher gives the style dictionary itself:
+
+    >>> styles = StyleMatcher({'WZ*' : {'name' : 'WZ'}})
+    >>> styles.get('WZJetsTo3LNu')
+    {'name': 'WZ'}
+    >>> styles.get('ZZ') is None
+    True
+
+If the patterns of the dictionary change, the matcher is rebuilt:
+
+    >>> del styles.styles['WZ*']
+    >>> styles.styles['ZZ*'] = {'name' : 'ZZ'}
+    >>> styles.get('WZJetsTo3LNu') is None
+    True
+    >>> styles.get('ZZ')
+    {'name': 'ZZ'}
+
+Use get_best_style(sample) to look up the styles in data_styles.
+
+'''
+
+import fnmatch
+import logging
+import re
+
+log = logging.getLogger("style_matcher")
+
+# Python re only supports 100 groups in a pattern, so the alternatives are
+# split in several regular expressions.
+_MAX_ALTERNATIVES = 90
+
+
+def _translate(pattern):
+    ''' Translate a glob pattern into a regex, without the trailing flags '''
+    regex = fnmatch.translate(pattern)
+    if regex.endswith('(?ms)'):
+        regex = regex[:-len('(?ms)')]
+    return regex
+
+
+class PatternMatcher(object):
+    ''' Find the longest of [patterns] which matches a name '''
+    def __init__(self, patterns):
+        # Longest first.  Patterns of the same length are sorted
+        # alphabetically, so the choice between them is reproducible.
+        self.patterns = sorted(set(patterns), key=lambda x: (-len(x), x))
+        self.regexes = []
+        for start in xrange(0, len(self.patterns), _MAX_ALTERNATIVES):
+            chunk = self.patterns[start:start + _MAX_ALTERNATIVES]
+            regex = '|'.join('(%s)' % _translate(x) for x in chunk)
+            self.regexes.append((start, re.compile(regex, re.S | re.M)))
+        # name => best pattern (or None)
+        self.cache = {}
+
+    def _find(self, name):
+        for start, regex in self.regexes:
+            match = regex.match(name)
+            if match:
+                return self.patterns[start + match.lastindex - 1]
+        return None
+
+    def best(self, name):
+        ''' Get the most specific pattern matching [name], or None '''
+        try:
+            return self.cache[name]
+        except KeyError:
+            pattern = self._find(name)
+            if pattern is not None:
+                log.info("Found best style for %s: %s", name, pattern)
+            self.cache[name] = pattern
+            return pattern
+
+
+class StyleMatcher(object):
+    ''' Get the style for a sample from a {pattern : style} dictionary
+
+    If patterns are added to, removed from or replaced in the dictionary, the
+    matcher is rebuilt.
+
+    '''
+    def __init__(self, styles):
+        self.styles = styles
+        self.matcher = None
+        # The patterns the matcher was built from
+        self.patterns = None
+
+    def get(self, sample):
+        ''' Get the style dictionary of [sample], or None '''
+        patterns = frozenset(self.styles)
+        if self.matcher is None or patterns != self.patterns:
+            self.matcher = PatternMatcher(patterns)
+            self.patterns = patterns
+        pattern = self.matcher.best(sample)
+        if pattern is None:
+            return None
+        return self.styles[pattern]
+
+_data_styles_matcher = None
+
+
+def get_best_style(sample):
+    ''' Get the data_styles entry of [sample], or None '''
+    global _data_styles_matcher
+    if _data_styles_matcher is None:
+        from data_styles import data_styles
+        _data_styles_matcher = StyleMatcher(data_styles)
+    return _data_styles_matcher.get(sample)
@@ -31,6 +31,8 @@ def set_to_zero(histo):
     return histo
 
 class BlindView(views._FolderView):
+    pure = True
+
     def __init__(self, directory, regex, blinding=None):
         super(BlindView, self).__init__(directory)
         self.regex = re.compile(regex)
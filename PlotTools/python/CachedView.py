@@ -0,0 +1,206 @@
+'''
+
+A view which memoizes the histograms it gets from the view below it.
+
+Every Get(path) on a stack of views reads the histogram from the file, and
+most views clone it again.  The CachedView keeps the results in a
+process-wide cache, with a least-recently-used eviction once the histograms
+take more than a given amount of memory.
+
+The cache key is (view chain, path).  The view chain is identified by its
+structure - the class and parameters of each view, down to the ROOT file -
+so two views built the same way (i.e. the RebinView made for each plot by the
+Plotter) share their cached histograms.  The ROOT file is identified by its
+path, inode and modification time, so a file which is written again is not
+served from the cache.
+
+Only chains where all the views are "pure" can be cached: their output must
+only depend on their parameters and on the histogram they get.  Views declare
+this with a class attribute::
+
+    class MyView(views._FolderView):
+        pure = True
+
+The rootpy views in PURE_ROOTPY_VIEWS are pure.  Anything else is passed
+through without caching.
+
+The cache keeps its own copy of each histogram, detached from the file, so
+it stays valid after the file is closed.  A copy of the cached histogram is
+returned each time, since many views (and plotting code) modify the
+histograms they are given.
+
+Example:
+
+    view = CachedView(RebinView(views.ScaleView(file, 0.5), 2))
+    histo = view.Get('mm/m1Pt') # read, scaled and rebinned
+    histo = view.Get('mm/m1Pt') # copied from the cache
+
+'''
+
+from collections import OrderedDict
+import logging
+import os
+from rootpy.plotting import views
+import ROOT
+import histarrays
+
+log = logging.getLogger("CachedView")
+
+# Maximum size of the histograms in the cache
+DEFAULT_CACHE_MB = float(os.environ.get('VIEW_CACHE_MB', 500))
+
+PURE_ROOTPY_VIEWS = tuple(
+    getattr(views, name) for name in [
+        'ScaleView', 'NormalizeView', 'StyleView', 'TitleView', 'SumView',
+        'StackView', 'SubdirectoryView']
+    if hasattr(views, name))
+
+# Attributes which are set by rootpy views during a Get
+_TRANSIENT_ATTRIBUTES = set(['getting'])
+
+
+class _Impure(object):
+    ''' Marks a view parameter which can't be used in a cache key '''
+
+
+def is_pure(view):
+    if isinstance(view, PURE_ROOTPY_VIEWS):
+        return True
+    return getattr(view, 'pure', False)
+
+
+def _freeze(value):
+    ''' Make a view parameter hashable '''
+    if isinstance(value, (ROOT.TDirectory, CachedView)) or (
+            hasattr(value, 'Get') and not isinstance(value, ROOT.TObject)):
+        key = chain_key(value)
+        return _Impure if key is None else key
+    if isinstance(value, (list, tuple)):
+        frozen = tuple(_freeze(x) for x in value)
+    elif isinstance(value, dict):
+        frozen = tuple(sorted(
+            (key, _freeze(item)) for key, item in value.iteritems()))
+    else:
+        try:
+            hash(value)
+        except TypeError:
+            return _Impure
+        return value
+    if any(x is _Impure for x in frozen):
+        return _Impure
+    return frozen
+
+
+def file_identity(directory):
+    ''' Identify the file holding [directory] on disk '''
+    file = directory.GetFile()
+    if not file:
+        return None
+    try:
+        stat = os.stat(file.GetName())
+    except OSError:
+        # i.e. a remote file
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_mtime)
+
+
+def chain_key(view):
+    ''' Get a hashable key describing a chain of views, or None if impure '''
+    if isinstance(view, CachedView):
+        return chain_key(view.dir)
+    if isinstance(view, ROOT.TDirectory):
+        return ('TDirectory', view.GetPath(), file_identity(view))
+    if not is_pure(view):
+        return None
+    params = []
+    for name, value in sorted(vars(view).iteritems()):
+        if name in _TRANSIENT_ATTRIBUTES:
+            continue
+        frozen = _freeze(value)
+        if frozen is _Impure:
+            return None
+        params.append((name, frozen))
+    return (type(view), tuple(params))
+
+
+def object_size(obj):
+    ''' Estimate the memory used by an object, in bytes '''
+    if isinstance(obj, ROOT.TH1):
+        return histarrays.nbytes(obj) + 1024
+    return 1024
+
+
+class HistogramCache(object):
+    ''' A size-limited LRU cache of histograms '''
+    def __init__(self, max_mb=DEFAULT_CACHE_MB):
+        self.max_bytes = int(max_mb * 1e6)
+        self.bytes = 0
+        # key => (object, size).  The most recently used are at the end.
+        self.objects = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        ''' Get the cached object, or None '''
+        try:
+            obj, size = self.objects.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.objects[key] = (obj, size)
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj):
+        size = object_size(obj)
+        if size > self.max_bytes:
+            return
+        if key in self.objects:
+            self.bytes -= self.objects.pop(key)[1]
+        self.objects[key] = (obj, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key, (old_obj, old_size) = self.objects.popitem(last=False)
+            self.bytes -= old_size
+
+    def clear(self):
+        self.objects.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __repr__(self):
+        return '<HistogramCache %i objects, %.1f/%.1f MB, %i hits %i misses>' % (
+            len(self), self.bytes / 1e6, self.max_bytes / 1e6,
+            self.hits, self.misses)
+
+
+# Shared by all the CachedViews, unless they are given their own
+default_cache = HistogramCache()
+
+
+class CachedView(views._FolderView):
+    ''' Memoize the histograms returned by [dir] '''
+    def __init__(self, dir, cache=None):
+        super(CachedView, self).__init__(dir)
+        self.cache = cache if cache is not None else default_cache
+        self.key = chain_key(dir)
+        if self.key is None:
+            log.debug("Not caching impure view %s", dir)
+
+    def Get(self, path):
+        if self.key is None:
+            return self.dir.Get(path)
+        key = (self.key, path)
+        obj = self.cache.get(key)
+        if obj is None:
+            obj = self.dir.Get(path)
+            if not isinstance(obj, ROOT.TH1):
+                return obj
+            if obj.GetDirectory():
+                # Owned by the file, and deleted when it is closed
+                obj = obj.Clone()
+                obj.SetDirectory(0)
+            self.cache.put(key, obj)
+        return obj.Clone()
@@ -6,34 +6,67 @@ Takes Selector like type, a list of input files, and an input tree.
 
 Objects are written to an output file.
 
+If [entry_window] is given as (first_entry, nentries), only that range of the
+chain is processed.  The entry numbers are global to the chain.
+
+If [output_file] is None, the output is kept in memory, and the booked
+histograms are added to [accumulator] (see MegaAccumulator).
+
+The TTreeCache is set up for the branches the selector reads.  If [prefetch] is
+True, the next blocks are read ahead asynchronously, and the next file in the
+chain is opened while the current one is processed (see megaio).  The bytes
+read and number of read calls for each file are logged at the end.
+
 '''
 
 import ROOT
+import megaio
+import keyindex
 
 
 class ChainProcessor(object):
-    def __init__(self, files, treename, selector, output_file, log, **kwargs):
+    def __init__(self, files, treename, selector, output_file, log,
+                 entry_window=None, accumulator=None, prefetch=False,
+                 **kwargs):
         self.log = log
+        if prefetch:
+            megaio.enable_async_prefetching()
         self.tree = ROOT.TChain(treename)
         self.nfiles = len(files)
         for file in files:
             self.tree.Add(file)
         # Setup cache
-        ROOT.TTreeCache.SetLearnEntries(100)
-        self.tree.SetCacheSize(10000000)
+        megaio.configure_cache(
+            self.tree, getattr(selector, 'active_branches', None), self.log)
+        self.io_monitor = megaio.IOMonitor(self.tree, files, prefetch)
         self.outfilename = output_file
-        self.out = ROOT.TFile(output_file, "RECREATE")
+        self.accumulator = accumulator
+        if output_file is None:
+            self.out = ROOT.TMemFile("mega_accumulator.root", "RECREATE")
+        else:
+            self.out = ROOT.TFile(output_file, "RECREATE")
         if not self.out:
             raise IOError("Can't open output ROOT file %s for writing"
                           % output_file)
         self.log.debug("ChainProcessor creating selector")
         # Create our selector instance
         self.selector = selector(self.tree, self.out, **kwargs)
+        self.selector.io_monitor = self.io_monitor
+        if entry_window is not None:
+            self.log.debug("ChainProcessor processing entries %i+%i",
+                           *entry_window)
+            self.selector.set_entry_window(*entry_window)
 
     def process(self):
         self.selector.begin()
         self.selector.process()
         self.selector.finish()
+        if self.accumulator is not None:
+            self.accumulator.add(self.selector.histograms, self.nfiles)
+        self.io_stats = self.io_monitor.finish()
+        megaio.log_stats(self.log, self.io_stats)
         # Cleanup files
         self.out.Close()
+        if self.outfilename and self.selector.key_index is not None:
+            keyindex.write_index(self.outfilename, self.selector.key_index)
         return (self.nfiles, self.outfilename)
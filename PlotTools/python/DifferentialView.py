@@ -13,6 +13,8 @@ except ImportError:
     from rootpy import asrootpy
 import ROOT
 import os
+import numpy
+import histarrays
 
 class DifferentialView(views._FolderView):
     ''' Scales a histogram content by the bin width.
@@ -20,16 +22,19 @@ class DifferentialView(views._FolderView):
     The original histogram is unmodified, a clone is returned.
 
     '''
+    pure = True
+
     def __init__(self, dir):
         super(DifferentialView, self).__init__(dir)
 
     def apply_view(self, object):
         object = object.Clone()
-        for i in range(0, object.GetNbinsX()+2): #scale underflow/overflow too
-            content = object.GetBinContent(i)
-            error   = object.GetBinError(i)
-            width   = object.GetBinWidth(i)  
-            object.SetBinContent(i, content / width)
-            object.SetBinError(i, error / width)  
-
+        widths = numpy.diff(histarrays.axis_edges(object.GetXaxis()))
+        #scale underflow/overflow too, using the width of the first/last bin
+        widths = numpy.concatenate([widths[:1], widths, widths[-1:]])
+        shape = histarrays.shape(object)
+        contents = histarrays.get_contents(object).reshape(shape) / widths
+        sumw2 = histarrays.get_sumw2(object).reshape(shape) / widths**2
+        histarrays.set_contents(object, contents.ravel())
+        histarrays.set_sumw2(object, sumw2.ravel())
         return object
@@ -7,6 +7,11 @@ Process dispatcher function for Mega framework
 import multiprocessing
 from MegaWorker import MegaWorker
 from MegaMerger import MegaMerger
+from MegaTreeMerger import MegaTreeMerger
+from MegaShard import make_shards
+from MegaAccumulator import MegaAccumulatorMerger
+from megaprofile import ProfileCollector, write_collapsed_stacks
+import os
 import sys
 import errno
 
@@ -29,7 +34,9 @@ def group_list(files, n=1):
 class MegaDispatcher(object):
     log = multiprocessing.get_logger()
     def __init__(self, files, treename, output_file, selector, nworkers,
-                 nchain=1):
+                 nchain=1, shard_size=0, merge_fanin=0, nmergers=1,
+                 histos_only=False, accumulate=False, prefetch=False,
+                 profile=False, profile_json=None, sample_interval=0):
         self.files = files
         self.treename = treename
         self.output_file = output_file
@@ -37,27 +44,88 @@ class MegaDispatcher(object):
         self.nworkers = nworkers
         # Figure out how many inputs to chain together
         self.nchain=nchain
+        # If non-zero, split the files into ranges of [shard_size] entries
+        self.shard_size = shard_size
+        if self.shard_size and not getattr(selector, 'shardable', False):
+            self.log.warning(
+                "Selector %s does not loop over entry_range(), "
+                "processing whole files instead of shards", selector)
+            self.shard_size = 0
+        # If non-zero, merge the outputs as a tree with this fan-in, using
+        # [nmergers] processes.  Otherwise use the serial merger.
+        self.merge_fanin = merge_fanin
+        self.nmergers = nmergers
+        self.histos_only = histos_only
+        # If true, the workers sum their histograms in memory and send them
+        # when they are done, instead of writing a file for each input.
+        self.accumulate = accumulate
+        # Read ahead asynchronously in the workers (see megaio)
+        self.prefetch = prefetch
+        # If true, the workers measure each input and the dispatcher prints a
+        # summary at the end (see megaprofile).
+        self.profile = profile or bool(profile_json) or bool(sample_interval)
+        self.profile_json = profile_json
+        self.sample_interval = sample_interval
+        self.profile_q = None
 
     def build_workers(self, input_q, result_q):
         workers = [
-            MegaWorker(input_q, result_q, self.treename, self.selector)
+            MegaWorker(input_q, result_q, self.treename, self.selector,
+                       accumulate=self.accumulate, prefetch=self.prefetch,
+                       profile_queue=self.profile_q,
+                       sample_interval=self.sample_interval)
             for x in range(self.nworkers)
         ]
         return workers
 
-    def run(self):
-        input_q = multiprocessing.Queue()
-        # add the files to be processed
+    def build_inputs(self):
+        ''' Get the list of work units to put in the process queue
+
+        Returns a list of either file names, lists of file names (chains) or
+        Shards, and the number of units each one counts for in the merger
+        progress bar.
+
+        '''
+        if self.shard_size:
+            shards = list(make_shards(self.files, self.treename,
+                                      self.shard_size))
+            self.log.info(
+                "Putting %i files into the process queue, split into %i "
+                "shards of <= %i entries",
+                len(self.files), len(shards), self.shard_size)
+            return shards, len(shards)
         self.log.info(
             "Putting %i files into the process queue, grouped into %i file chunks",
                       len(self.files), self.nchain)
-        for file in group_list(self.files, self.nchain):
-            input_q.put(file)
+        return list(group_list(self.files, self.nchain)), len(self.files)
+
+    def build_merger(self, result_q, ninputs):
+        if self.accumulate:
+            return MegaAccumulatorMerger(result_q, self.output_file, ninputs)
+        if self.merge_fanin:
+            return MegaTreeMerger(result_q, self.output_file, ninputs,
+                                  fanin=self.merge_fanin,
+                                  nmergers=self.nmergers,
+                                  histos_only=self.histos_only)
+        return MegaMerger(result_q, self.output_file, ninputs)
+
+    def run(self):
+        input_q = multiprocessing.Queue()
+        # add the files to be processed
+        inputs, ninputs = self.build_inputs()
+        for input in inputs:
+            input_q.put(input)
 
         result_q = multiprocessing.Queue()
 
         everything_will_turn_out_okay = True
 
+        collector = None
+        if self.profile:
+            self.profile_q = multiprocessing.Queue()
+            collector = ProfileCollector(self.profile_q, self.log)
+            collector.start()
+
         try:
             workers = self.build_workers(input_q, result_q)
 
@@ -71,7 +139,7 @@ class MegaDispatcher(object):
             self.log.info("Started %i workers", len(workers))
 
             # Start the merger
-            merger = MegaMerger(result_q, self.output_file, len(self.files))
+            merger = self.build_merger(result_q, ninputs)
             merger.start()
 
             self.log.info("Started the merger process")
@@ -103,6 +171,9 @@ class MegaDispatcher(object):
 
             self.log.info("All process jobs have completed.")
 
+            if collector is not None:
+                self.report_profile(collector)
+
             # Add a poison pill at the end of the results
             result_q.put(None)
             result_q.close()
@@ -122,3 +193,19 @@ class MegaDispatcher(object):
             sys.exit(1)
 
         self.log.info("All merge jobs have completed.")
+
+    def report_profile(self, collector):
+        ''' Wait for all the measurements, and summarize them '''
+        self.profile_q.put(None)
+        collector.join()
+        print collector.table()
+        samples = collector.sample_table()
+        if samples:
+            print samples
+        if self.profile_json:
+            self.log.info("Writing profile to %s", self.profile_json)
+            collector.write_json(self.profile_json)
+            if collector.stacks:
+                stacks_file = os.path.splitext(self.profile_json)[0] + '.stacks'
+                self.log.info("Writing sampled stacks to %s", stacks_file)
+                write_collapsed_stacks(collector.stacks, stacks_file)
@@ -8,14 +8,30 @@ Takes Selector like type, an input file, and an input tree.
 
 Objects are written to an output file.
 
+If [entry_window] is given as (first_entry, nentries), only that range of the
+tree is processed (see MegaShard).
+
+If [output_file] is None, the output is kept in memory, and the booked
+histograms are added to [accumulator] (see MegaAccumulator).
+
+The TTreeCache is set up for the branches the selector reads, and if
+[prefetch] is True, the next blocks are read ahead asynchronously (see megaio).
+The bytes read and number of read calls are logged when the file is done.
+
 '''
 
 
 import ROOT
+import megaio
+import keyindex
 
 class FileProcessor(object):
-    def __init__(self, filename, treename, selector, output_file, log, **kwargs):
+    def __init__(self, filename, treename, selector, output_file, log,
+                 entry_window=None, accumulator=None, prefetch=False,
+                 **kwargs):
         self.log = log
+        if prefetch:
+            megaio.enable_async_prefetching()
         self.log.debug("FileProcessor opening %s", filename)
         self.file = ROOT.TFile.Open(filename, "READ")
         if not self.file:
@@ -26,22 +42,39 @@ class FileProcessor(object):
                           (treename, filename))
         self.log.debug("FileProcessor got tree: %s", self.tree)
         # Setup cache
-        ROOT.TTreeCache.SetLearnEntries(200)
-        self.tree.SetCacheSize(10000000)
+        megaio.configure_cache(
+            self.tree, getattr(selector, 'active_branches', None), self.log,
+            learn_entries=200)
+        self.io_monitor = megaio.IOMonitor(self.tree, [filename], False)
         self.outfilename = output_file
-        self.out = ROOT.TFile(output_file, "RECREATE")
+        self.accumulator = accumulator
+        if output_file is None:
+            self.out = ROOT.TMemFile("mega_accumulator.root", "RECREATE")
+        else:
+            self.out = ROOT.TFile(output_file, "RECREATE")
         if not self.file:
             raise IOError("Can't open output ROOT file %s for writing"
                           % output_file)
         self.log.debug("FileProcessor creating selector")
         # Create our selector instance
         self.selector = selector(self.tree, self.out, **kwargs)
+        self.selector.io_monitor = self.io_monitor
+        if entry_window is not None:
+            self.log.debug("FileProcessor processing entries %i+%i",
+                           *entry_window)
+            self.selector.set_entry_window(*entry_window)
 
     def process(self):
         self.selector.begin()
         self.selector.process()
         self.selector.finish()
+        if self.accumulator is not None:
+            self.accumulator.add(self.selector.histograms, 1)
+        self.io_stats = self.io_monitor.finish()
+        megaio.log_stats(self.log, self.io_stats)
         # Cleanup files
         self.file.Close()
         self.out.Close()
+        if self.outfilename and self.selector.key_index is not None:
+            keyindex.write_index(self.outfilename, self.selector.key_index)
         return (1, self.outfilename)
@@ -8,11 +8,14 @@ Example:
 
     FileView("path/to/file1.root", "path/to/file2.root", "path/to/files*.root")
 
+The files are opened through the file_registry, so views of the same files
+share them.
+
 '''
 
 import glob
-from rootpy import io
 from rootpy.plotting import views
+from FinalStateAnalysis.MetaData.file_registry import registry
 
 class FileView(views.SumView):
     def __init__(self, *paths):
@@ -21,6 +24,12 @@ class FileView(views.SumView):
             self.filenames.extend(glob.glob(path))
         self.files = []
         for filename in self.filenames:
-            self.files.append(io.open(filename, 'read'))
+            self.files.append(registry.open(filename))
         # Sum them together.
-        super(FileView, self).__init__(**self.files)
+        super(FileView, self).__init__(*self.files)
+
+    def close(self):
+        ''' Release the files, which are shared with the other views '''
+        for file in self.files:
+            registry.release(file)
+        self.files = []
@@ -1,16 +1,21 @@
 import rootpy.plotting.views as views
-from THBin import zipBins
+import histarrays
 
 class InflateErrorView(views._FolderView):
     ''' 
     Inflates the errors in a histograms, useful for introducing systematics
     '''
+    pure = True
+
     def __init__(self, dir, inflation):
         self.inflation = 1+inflation
         super(InflateErrorView, self).__init__(dir)
 
     def apply_view(self, object):
         object = object.Clone()
-        for hbin in zipBins(object):
-            hbin.error *= self.inflation 
+        shape = histarrays.shape(object)
+        sumw2 = histarrays.get_sumw2(object).reshape(shape)
+        # Under/overflows are left as they are
+        sumw2[histarrays.in_range(object)] *= self.inflation**2
+        histarrays.set_sumw2(object, sumw2.ravel())
         return object
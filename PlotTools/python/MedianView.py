@@ -5,6 +5,8 @@ def quad(*xs):
 
 class MedianView(object):
     ''' Takes high and low, returns median assigning half the diff as error. '''
+    pure = True
+
     def __init__(self, highv=None, lowv=None, centv=None):
         self.highv = highv
         self.lowv  = lowv
@@ -0,0 +1,128 @@
+'''
+
+Accumulate the booked histograms of a selector in memory, across many jobs.
+
+In the "accumulate" mode, each MegaWorker writes its selectors' output into a
+TMemFile instead of a temporary file on disk.  After each job the histograms
+booked with MegaBase.book are added into the worker's HistogramAccumulator as
+flat bin content/sumw2 arrays.  When the worker shuts down, the summed arrays
+are sent to the MegaAccumulatorMerger, which adds up the workers and writes a
+single output file.  Only histograms made with MegaBase.book are kept.
+
+Histograms which can't be converted to arrays (profiles, or histograms with
+bin labels, see histarrays.check_arrays_type) are kept as detached clones
+instead, and summed with TH1::Add.  They are pickled by PyROOT to be sent to
+the merger.
+
+'''
+
+import errno
+import multiprocessing
+import ROOT
+import signal
+import histarrays
+import keyindex
+from MegaTreeMerger import write_histograms
+
+log = multiprocessing.get_logger()
+
+
+class HistogramAccumulator(object):
+    def __init__(self):
+        # path => output of histarrays.to_arrays, or a detached histogram
+        # for those which can't be converted (see _add_one)
+        self.histograms = {}
+        # Number of input units (files or shards) accumulated
+        self.processed = 0
+
+    def add(self, histograms, processed=1):
+        ''' Add a dictionary of {path : histogram}, as in MegaBase '''
+        for path, histo in histograms.iteritems():
+            if not isinstance(histo, ROOT.TH1):
+                log.warning("Can't accumulate %s of type %s, skipping",
+                            path, histo.ClassName())
+                continue
+            try:
+                histarrays.check_arrays_type(histo)
+            except TypeError:
+                # i.e. a TProfile: keep a copy of the histogram itself
+                histo = histo.Clone()
+                histo.SetDirectory(0)
+                self._add_one(path, histo)
+            else:
+                self._add_one(path, histarrays.to_arrays(histo))
+        self.processed += processed
+
+    def _add_one(self, path, item):
+        ''' Add the arrays (or detached histogram) [item] at [path] '''
+        if path not in self.histograms:
+            self.histograms[path] = item
+        elif isinstance(item, dict):
+            histarrays.add_arrays(self.histograms[path], item)
+        else:
+            self.histograms[path].Add(item)
+
+    def update(self, state):
+        ''' Add the state() of another accumulator into this one '''
+        processed, histograms = state
+        for path, item in histograms.iteritems():
+            self._add_one(path, item)
+        self.processed += processed
+
+    def state(self):
+        ''' Get a picklable representation to send to the dispatcher '''
+        return (self.processed, self.histograms)
+
+    def write(self, output_file_name):
+        ''' Write the accumulated histograms into a new file '''
+        add_directory = ROOT.TH1.AddDirectoryStatus()
+        ROOT.TH1.AddDirectory(False)
+        try:
+            histos = dict(
+                (path, histarrays.from_arrays(item)
+                 if isinstance(item, dict) else item)
+                for path, item in self.histograms.iteritems())
+        finally:
+            ROOT.TH1.AddDirectory(add_directory)
+        write_histograms(histos, output_file_name)
+        # The histograms are still in memory, so this only walks the keys
+        output = ROOT.TFile.Open(output_file_name, 'READ')
+        index = keyindex.build_index(output, known=histos)
+        output.Close()
+        keyindex.write_index(output_file_name, index)
+
+
+class MegaAccumulatorMerger(multiprocessing.Process):
+    ''' Takes the place of the MegaMerger for accumulating workers.
+
+    Sums the accumulator states sent by each worker, and writes the output
+    file once the poison pill is received.
+
+    '''
+    log = multiprocessing.get_logger()
+    def __init__(self, input_queue, output_file, ninputs):
+        super(MegaAccumulatorMerger, self).__init__()
+        self.input = input_queue
+        self.output = output_file
+        self.ninputs = ninputs
+
+    def run(self):
+        # ignore sigterm signal and let parent take care of this
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        total = HistogramAccumulator()
+        while True:
+            try:
+                state = self.input.get()
+            except IOError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if state is None:
+                self.log.info("Got poison pill - shutting down")
+                break
+            total.update(state)
+            self.log.info("Received results for %i/%i inputs",
+                          total.processed, self.ninputs)
+        self.log.info("Writing %i histograms to %s",
+                      len(total.histograms), self.output)
+        total.write(self.output)
@@ -8,6 +8,7 @@ import json
 import os
 import multiprocessing
 import ROOT
+import keyindex
 
 def make_dirs(base_dir, subdirs):
     ''' Make the directory structure.  Subdirs is a list. '''
@@ -22,6 +23,25 @@ def make_dirs(base_dir, subdirs):
 
 class MegaBase(object):
     log = multiprocessing.get_logger()
+    # The window of entries this selector should process.  These are set by
+    # the File/ChainProcessor when the job is split into shards.  A negative
+    # number of entries means "until the end of the tree".
+    first_entry = 0
+    nentries = -1
+    # Selectors which loop over entry_range() (instead of the whole tree)
+    # must set this to True, otherwise the dispatcher won't split the files.
+    shardable = False
+    # The branches read by the selector (i.e. MetaTree.active_branches()).
+    # If given, the TTreeCache is set up to read only these (see megaio).
+    active_branches = None
+    # Set by the File/ChainProcessor to follow the files being read
+    io_monitor = None
+    # Set by write_histos
+    key_index = None
+    # Set when profiling, to time the Fill calls of booked histograms
+    # (see megaprofile)
+    fill_timer = None
+
     def __init__(self, tree, output, **kwargs):
         self.tree = tree
         self.output = output
@@ -57,10 +77,49 @@ class MegaBase(object):
             # Check if we've specified an xaxis, otherwise use the title.
             xaxis = kwargs.get('xaxis', args[1])
             object.GetXaxis().SetTitle(xaxis)
+        if self.fill_timer is not None and hasattr(object, 'Fill'):
+            object.Fill = self.fill_timer.wrap(object.Fill)
         directory.Append(object)
         self.histograms[os.path.join(location, name)] = object
         return object
 
+    def set_entry_window(self, first_entry, nentries):
+        ''' Restrict processing to [nentries] entries starting at [first_entry]
+        '''
+        self.first_entry = first_entry
+        self.nentries = nentries
+
+    def entry_range(self):
+        ''' Get the entries to process in this job
+
+        Selectors which want to support sharded processing should loop
+        over this, instead of the whole tree::
+
+            for i in self.entry_range():
+                self.tree.GetEntry(i)
+
+        '''
+        entries = self._entry_window()
+        if self.io_monitor is None:
+            return entries
+        return self._monitored_entries(entries)
+
+    def entries_to_process(self):
+        ''' Get the number of entries to process in this job '''
+        return len(self._entry_window())
+
+    def _entry_window(self):
+        last_entry = self.tree.GetEntries()
+        if self.nentries >= 0:
+            last_entry = min(last_entry, self.first_entry + self.nentries)
+        return xrange(self.first_entry, max(self.first_entry, last_entry))
+
+    def _monitored_entries(self, entries):
+        ''' Let the io_monitor know when the chain moves to the next file '''
+        for entry in entries:
+            yield entry
+            self.io_monitor.check()
+
     def enable_branch(self, branch):
         ''' Set the branch to read on TTree::GetEntry '''
         self.tree.SetBranchStatus(branch, 1)
@@ -76,5 +135,12 @@ class MegaBase(object):
         self.output.WriteTObject(text, name)
 
     def write_histos(self):
-        ''' Write all histograms to the file. '''
+        ''' Write all histograms to the file.
+
+        The index of the file contents is kept in self.key_index, to be
+        written by the processor when the file is closed (see keyindex).
+        '''
         self.output.Write()
+        known = dict((os.path.normpath(path), histo)
+                     for path, histo in self.histograms.iteritems())
+        self.key_index = keyindex.build_index(self.output, known=known)
@@ -16,6 +16,7 @@ import shutil
 import signal
 import tempfile
 import errno
+import keyindex
 
 class MegaMerger(multiprocessing.Process):
     log = multiprocessing.get_logger()
@@ -58,11 +59,13 @@ class MegaMerger(multiprocessing.Process):
         for file in to_merge:
             merger.AddFile(file, False)
         result = merger.Merge()
+        keyindex.merge_index(to_merge, output_file_name)
 
         self.log.info("Merge completed with result: %s" % result)
         self.log.info("Output file is: %s, moving to %s", output_file_name,
                       self.output)
         shutil.move(output_file_name, self.output)
+        keyindex.move_index(output_file_name, self.output)
 
         # Cleanup.  We don't need to cleanup the temporary output, since it
         # is moved.
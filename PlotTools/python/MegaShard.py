@@ -0,0 +1,75 @@
+'''
+
+Split mega inputs into entry-range "shards" of roughly equal size.
+
+Dispatching whole files means that a single huge file can keep one worker busy
+long after all the others have gone idle.  A Shard is a window of entries in a
+single file::
+
+    Shard(filename, first_entry, nentries)
+
+The dispatcher puts all the shards into the shared input queue, so idle workers
+keep pulling (stealing) the remaining ranges until the queue is drained.
+
+'''
+
+from collections import namedtuple
+import multiprocessing
+import ROOT
+
+log = multiprocessing.get_logger()
+
+Shard = namedtuple('Shard', ['filename', 'first_entry', 'nentries'])
+
+
+def count_entries(filename, treename):
+    ''' Get the number of entries in [treename] in [filename] '''
+    file = ROOT.TFile.Open(filename, "READ")
+    if not file:
+        raise IOError("Can't open ROOT file: %s" % filename)
+    tree = file.Get(treename)
+    if not tree:
+        raise IOError("Can't get tree: %s from file: %s" %
+                      (treename, filename))
+    entries = tree.GetEntries()
+    file.Close()
+    return entries
+
+
+def split_entries(nentries, shard_size):
+    ''' Split [nentries] into (first_entry, nentries) windows
+
+    >>> list(split_entries(10, 4))
+    [(0, 4), (4, 4), (8, 2)]
+    >>> list(split_entries(0, 4))
+    []
+
+    '''
+    first = 0
+    while first < nentries:
+        yield first, min(shard_size, nentries - first)
+        first += shard_size
+
+
+def make_shards(files, treename, shard_size):
+    ''' Generate Shards of at most [shard_size] entries for all [files]
+
+    The shards are ordered so the biggest files come first, so the long
+    tail of the job is made up of small ranges.
+
+    '''
+    if shard_size < 1:
+        raise ValueError("Shard size must be positive, got: %i" % shard_size)
+    sizes = []
+    for filename in files:
+        entries = count_entries(filename, treename)
+        log.debug("File %s has %i entries", filename, entries)
+        sizes.append((entries, filename))
+    sizes.sort(key=lambda x: x[0], reverse=True)
+    for entries, filename in sizes:
+        for first, nentries in split_entries(entries, shard_size):
+            yield Shard(filename, first, nentries)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
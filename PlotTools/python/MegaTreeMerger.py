@@ -0,0 +1,281 @@
+'''
+
+A Process object which merges the worker outputs as a k-ary tree.
+
+The serial MegaMerger merges each batch of new outputs into the accumulated
+output file, so the whole output is re-read and re-written for every batch.
+The MegaTreeMerger instead groups outputs [fanin] at a time, and merges each
+group in a pool of [nmergers] processes.  The merged files are grouped again at
+the next level of the tree, until a single file remains.  Every input is
+therefore only rewritten ~log_fanin(N) times.
+
+If the outputs contain only histograms, the [histos_only] option sums them in
+memory, instead of going through TFileMerger.
+
+'''
+
+import hashlib
+import multiprocessing
+import os
+from progressbar import ETA, ProgressBar, FormatLabel, Bar
+from Queue import Empty
+import ROOT
+import shutil
+import signal
+import tempfile
+import errno
+import keyindex
+
+log = multiprocessing.get_logger()
+
+
+def make_merged_filename(inputs, output_dir=None):
+    ''' Make an output file name from the hash of the input files '''
+    if output_dir is None:
+        output_dir = tempfile.gettempdir()
+    hash = hashlib.md5()
+    for input_file in inputs:
+        hash.update(input_file)
+    return os.path.join(output_dir, hash.hexdigest() + '.root')
+
+
+def read_histograms(directory, histos, path=''):
+    ''' Add all the histograms in [directory] into the [histos] dictionary
+
+    The dictionary is keyed by the path of the histogram.  If there is already
+    a histogram at that path, the new one is added to it.
+
+    Only the highest cycle of each key is used, as in TFileMerger.
+
+    Returns False if the directory contains something which can't be summed
+    (i.e. a TTree), True otherwise.
+
+    '''
+    seen = set()
+    for key in directory.GetListOfKeys():
+        name = key.GetName()
+        # The keys are sorted by decreasing cycle
+        if name in seen:
+            continue
+        seen.add(name)
+        full_path = os.path.join(path, name)
+        object = key.ReadObj()
+        if isinstance(object, ROOT.TDirectory):
+            if not read_histograms(object, histos, full_path):
+                return False
+        elif isinstance(object, ROOT.TH1):
+            # Deleted by python once it is not needed anymore
+            ROOT.SetOwnership(object, True)
+            if full_path in histos:
+                histos[full_path].Add(object)
+                del object
+            else:
+                object.SetDirectory(0)
+                histos[full_path] = object
+        else:
+            log.debug("Object %s (%s) is not a histogram", full_path,
+                      object.ClassName())
+            return False
+    return True
+
+
+def write_histograms(histos, output_file_name):
+    ''' Write a dictionary of {path : histogram} into a new file '''
+    output = ROOT.TFile(output_file_name, 'RECREATE')
+    if not output:
+        raise IOError("Can't open output ROOT file %s for writing"
+                      % output_file_name)
+    for path in sorted(histos.keys()):
+        dirname, name = os.path.split(path)
+        directory = output
+        if dirname:
+            directory = output.GetDirectory(dirname)
+            if not directory:
+                output.mkdir(dirname)
+                directory = output.GetDirectory(dirname)
+        directory.WriteTObject(histos[path], name)
+    output.Close()
+
+
+def sum_histograms(files):
+    ''' Sum the histograms in [files] in memory.
+
+    Returns the dictionary of {path : histogram}, or None if any of the files
+    contains something which is not a histogram.
+
+    '''
+    # Don't attach the histograms to the files we are reading
+    add_directory = ROOT.TH1.AddDirectoryStatus()
+    ROOT.TH1.AddDirectory(False)
+    histos = {}
+    try:
+        for file_name in files:
+            file = ROOT.TFile.Open(file_name, 'READ')
+            if not file:
+                raise IOError("Can't open ROOT file: %s" % file_name)
+            ok = read_histograms(file, histos)
+            file.Close()
+            if not ok:
+                return None
+    finally:
+        ROOT.TH1.AddDirectory(add_directory)
+    return histos
+
+
+def merge_files(inputs, output_file_name, histos_only=False):
+    ''' Merge [inputs] into [output_file_name] and delete the inputs.
+
+    If [histos_only] is True, the histograms are summed in memory.  If an
+    input turns out to contain something else, the files are merged with
+    TFileMerger instead.
+
+    Returns the output file name.
+
+    '''
+    merged = False
+    if histos_only:
+        histos = sum_histograms(inputs)
+        if histos is None:
+            log.warning("Non-histogram objects found in inputs, "
+                        "falling back to TFileMerger")
+        else:
+            write_histograms(histos, output_file_name)
+            merged = True
+    if not merged:
+        merger = ROOT.TFileMerger()
+        merger.OutputFile(output_file_name)
+        for file in inputs:
+            merger.AddFile(file, False)
+        if not merger.Merge():
+            raise IOError("Merging into %s failed" % output_file_name)
+    keyindex.merge_index(inputs, output_file_name)
+    for file in inputs:
+        os.remove(file)
+    return output_file_name
+
+
+def _merge_job(args):
+    ''' Wrapper around merge_files for use in a Pool '''
+    # Let the parent take care of Ctrl-c
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    inputs, output_file_name, histos_only = args
+    log.info("Merging %i files into %s", len(inputs), output_file_name)
+    return merge_files(inputs, output_file_name, histos_only)
+
+
+class MegaTreeMerger(multiprocessing.Process):
+    log = multiprocessing.get_logger()
+    def __init__(self, input_file_queue, output_file, ninputs, fanin=8,
+                 nmergers=2, histos_only=False):
+        super(MegaTreeMerger, self).__init__()
+        if fanin < 2:
+            raise ValueError("Merge fan-in must be at least 2, got: %i"
+                             % fanin)
+        self.input = input_file_queue
+        self.output = output_file
+        self.ninputs = ninputs
+        self.fanin = fanin
+        self.nmergers = nmergers
+        self.histos_only = histos_only
+        self.processed = 0
+        self.pbar = ProgressBar(widgets=[
+            FormatLabel('Processed %(value)i/' + str(ninputs) + ' files. '),
+            ETA(), Bar('>')], maxval=ninputs).start()
+        self.pbar.update(0)
+        # Files waiting to be merged, at each level of the tree
+        self.levels = [[]]
+        # (level, AsyncResult) of running merge jobs
+        self.running = []
+
+    def submit(self, pool, level, inputs):
+        ''' Merge [inputs] in the pool, the output goes to [level] + 1 '''
+        output_file_name = make_merged_filename(inputs)
+        self.log.info("Submitting merge of %i files at level %i",
+                      len(inputs), level)
+        self.running.append((level + 1, pool.apply_async(
+            _merge_job, [(inputs, output_file_name, self.histos_only)])))
+
+    def collect(self, wait=False):
+        ''' Move the outputs of finished merge jobs to the next level '''
+        still_running = []
+        for level, result in self.running:
+            if wait or result.ready():
+                # Raises if the merge job raised.
+                output_file_name = result.get()
+                while len(self.levels) <= level:
+                    self.levels.append([])
+                self.levels[level].append(output_file_name)
+            else:
+                still_running.append((level, result))
+        self.running = still_running
+
+    def schedule(self, pool):
+        ''' Submit merge jobs for any level with enough waiting files '''
+        for level, waiting in enumerate(self.levels):
+            while len(waiting) >= self.fanin:
+                self.submit(pool, level, waiting[:self.fanin])
+                del waiting[:self.fanin]
+
+    def finalize(self, pool):
+        ''' Merge whatever is left at all levels into the final output '''
+        self.collect(wait=True)
+        remaining = []
+        for waiting in self.levels:
+            remaining.extend(waiting)
+        self.levels = [[]]
+        # Keep reducing the leftovers in parallel until only one is left.
+        while len(remaining) > 1:
+            jobs = []
+            for i in range(0, len(remaining), self.fanin):
+                group = remaining[i:i + self.fanin]
+                if len(group) == 1:
+                    jobs.append(None)
+                    continue
+                jobs.append((group, pool.apply_async(
+                    _merge_job, [(group, make_merged_filename(group),
+                                  self.histos_only)])))
+            next_remaining = []
+            for i, job in enumerate(jobs):
+                if job is None:
+                    next_remaining.append(remaining[i * self.fanin])
+                else:
+                    next_remaining.append(job[1].get())
+            remaining = next_remaining
+        if remaining:
+            self.log.info("Moving final merge output %s to %s",
+                          remaining[0], self.output)
+            shutil.move(remaining[0], self.output)
+            keyindex.move_index(remaining[0], self.output)
+
+    def run(self):
+        # ignore sigterm signal and let parent take care of this
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        pool = multiprocessing.Pool(self.nmergers)
+        try:
+            while True:
+                done = False
+                try:
+                    to_merge = self.input.get(timeout=1)
+                    if to_merge is None:
+                        self.log.info("Got poison pill - shutting down")
+                        done = True
+                    else:
+                        entries, file = to_merge
+                        self.levels[0].append(file)
+                        self.processed += entries
+                        self.pbar.update(self.processed)
+                except Empty:
+                    pass
+                except IOError, e:
+                    if e.errno == errno.EINTR:
+                        self.log.debug("Interrupted by IOError, probably because user's system setting changed in a weird way")
+                    else:
+                        raise
+                self.collect()
+                self.schedule(pool)
+                if done:
+                    self.finalize(pool)
+                    return
+        finally:
+            pool.close()
+            pool.join()
@@ -3,10 +3,21 @@
 A multiprocessor Process object which takes an input list of files,
 analyzes, them, and stores the results in output ROOT files.
 
+If [accumulate] is True, no output files are written.  The booked histograms
+are summed in memory over all the inputs, and sent to the results queue
+when the worker shuts down (see MegaAccumulator).
+
+If a [profile_queue] is given, the measurements of each input are put in it
+(see megaprofile).  If [sample_interval] is non-zero, the worker also runs a
+sampling profiler, and sends its samples when it shuts down.
+
 '''
 
 from FileProcessor import FileProcessor
 from ChainProcessor import ChainProcessor
+from MegaShard import Shard
+from MegaAccumulator import HistogramAccumulator
+import megaprofile
 import hashlib
 import multiprocessing
 import os
@@ -16,7 +27,10 @@ import tempfile
 def make_hashed_filename(to_process):
     ''' Make an output file from the hash of the file(s) to process '''
     hash = hashlib.md5(os.environ['LOGNAME']) # so users don't collide
-    if isinstance(to_process, basestring):
+    if isinstance(to_process, Shard):
+        hash.update('%s:%i:%i' % to_process)
+        return hash.hexdigest() + '.root'
+    elif isinstance(to_process, basestring):
         hash.update(to_process)
         return hash.hexdigest() + '.root'
     else:
@@ -27,7 +41,8 @@ def make_hashed_filename(to_process):
 class MegaWorker(multiprocessing.Process):
     log = multiprocessing.get_logger()
     def __init__(self, input_file_queue, results_queue, treename, selector,
-                 output_dir=None, **kwargs):
+                 output_dir=None, accumulate=False, profile_queue=None,
+                 sample_interval=0, **kwargs):
         super(MegaWorker, self).__init__()
         self.input = input_file_queue
         self.output = results_queue
@@ -36,26 +51,55 @@ class MegaWorker(multiprocessing.Process):
         self.output_dir = output_dir
         if self.output_dir is None:
             self.output_dir = tempfile.gettempdir()
+        self.accumulator = None
+        if accumulate:
+            self.accumulator = HistogramAccumulator()
+        self.profile_queue = profile_queue
+        self.sample_interval = sample_interval
         # Passed to selector
         self.options = kwargs
 
     def run(self):
         # ignore sigterm signal and let parent take care of this
         signal.signal(signal.SIGINT, signal.SIG_IGN)
+        sampler = None
+        if self.profile_queue is not None and self.sample_interval:
+            sampler = megaprofile.StackSampler(self.sample_interval)
+            sampler.start()
         while True:
             to_process = self.input.get()
             # Poison pill
             if to_process is None:
                 self.log.info("Got poison pill - shutting down")
+                if self.accumulator is not None:
+                    self.log.info("Sending %i accumulated histograms",
+                                  len(self.accumulator.histograms))
+                    self.output.put(self.accumulator.state())
+                if sampler is not None:
+                    sampler.stop()
+                    self.profile_queue.put(sampler.message(self.name))
                 break
 
             # Make a unique output file name
             output_file_name = os.path.join(
                 self.output_dir, make_hashed_filename(to_process))
 
+            options = self.options
+            if self.accumulator is not None:
+                output_file_name = None
+                options = dict(options, accumulator=self.accumulator)
+
             # Do we need to chain the files or not?
             processor_class = FileProcessor
-            if isinstance(to_process, basestring):
+            processor_input = to_process
+            if isinstance(to_process, Shard):
+                self.log.info("Processing entries %i+%i of file %s => %s",
+                              to_process.first_entry, to_process.nentries,
+                              to_process.filename, output_file_name)
+                processor_input = to_process.filename
+                options = dict(options, entry_window=(
+                    to_process.first_entry, to_process.nentries))
+            elif isinstance(to_process, basestring):
                 self.log.info("Processing file %s => %s",
                               to_process, output_file_name)
             else:
@@ -65,14 +109,24 @@ class MegaWorker(multiprocessing.Process):
 
             try:
                 processor = processor_class(
-                    to_process, self.tree, self.selector,
-                    output_file_name, self.log, **self.options)
+                    processor_input, self.tree, self.selector,
+                    output_file_name, self.log, **options)
+
+                # Check if we want to instrument the job
+                job_profiler = None
+                if self.profile_queue is not None:
+                    job_profiler = megaprofile.JobProfiler(
+                        processor, megaprofile.describe_input(to_process),
+                        self.name)
+                    process = job_profiler.run
+                else:
+                    process = processor.process
 
                 # Check if we want to profile the script
                 profile_dir_base = os.environ.get('megaprofile', None)
                 result = None
                 if profile_dir_base is None:
-                    result = processor.process()
+                    result = process()
                 else:
                     import cProfile
                     profile_dir = os.path.join(
@@ -85,11 +139,13 @@ class MegaWorker(multiprocessing.Process):
                         profile_dir,
                         make_hashed_filename(to_process).replace('.root', '.prf')
                     )
-                    cProfile.runctx('result = processor.process()',
-                                    globals(), locals(), profile_output)
-                    # Fake this.
-                    result = (len(to_process), output_file_name)
-                self.output.put(result)
+                    profiler = cProfile.Profile()
+                    result = profiler.runcall(process)
+                    profiler.dump_stats(profile_output)
+                if job_profiler is not None:
+                    self.profile_queue.put(job_profiler.summary)
+                if self.accumulator is None:
+                    self.output.put(result)
             except:
                 # If we fail, put a poison pill to stop the merge job.
                 self.log.error("Caught exception in worker, killing merger")
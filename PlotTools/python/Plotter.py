@@ -7,12 +7,19 @@ Author: Evan K. Friis, UW
 '''
 
 import fnmatch
+import logging
+import multiprocessing
 import re
 import os
+import time
+import traceback
 import rootpy.plotting.views as views
 import rootpy.plotting as plotting
-from FinalStateAnalysis.MetaData.data_views import data_views
+from FinalStateAnalysis.MetaData.data_views import data_views, release_views
 from FinalStateAnalysis.PlotTools.RebinView import RebinView
+from FinalStateAnalysis.PlotTools.CachedView import CachedView
+from FinalStateAnalysis.PlotTools import keyindex
+from FinalStateAnalysis.PlotTools import plotexport
 from FinalStateAnalysis.Utilities.struct import struct
 import FinalStateAnalysis.Utilities.prettyjson as prettyjson
 import ROOT
@@ -25,8 +32,49 @@ def _monkey_patch_legend_draw(self, *args, **kwargs):
     _original_draw(self, *args, **kwargs)
 plotting.Legend.Draw = _monkey_patch_legend_draw
 
+log = logging.getLogger("Plotter")
+
+# The options of a plot spec for Plotter.render_batch, and their defaults.
+PLOT_DEFAULTS = {
+    'folder': '',
+    'variable': None,
+    # Output name, by default folder-variable
+    'filename': None,
+    'rebin': 1,
+    'xaxis': '',
+    'xrange': None,
+    'preprocess': None,
+    'logx': False,
+    'logy': False,
+    'leftside': True,
+    'show_ratio': False,
+    'ratio_range': 0.2,
+    'sort': False,
+    # Options passed to Plotter.save
+    'save_options': {},
+    # A function (plotter, spec) which draws the plot, instead of
+    # plot_mc_vs_data.
+    'plot': None,
+}
+
+# The Plotter and specs of the current render_batch, in the pool workers.
+_batch_plotter = None
+_batch_specs = None
+
+def _init_batch_worker(plotter, specs):
+    ''' Give the forked copy of the plotter its own files and canvas '''
+    global _batch_plotter, _batch_specs
+    _batch_plotter = plotter
+    _batch_specs = specs
+    plotter.build_views()
+    plotter.reset()
+
+def _render_batch_spec(index):
+    return _batch_plotter.timed_render(_batch_specs[index])
+
 class Plotter(object):
-    def __init__(self, files, lumifiles, outputdir, blinder=None, forceLumi=-1):
+    def __init__(self, files, lumifiles, outputdir, blinder=None, forceLumi=-1,
+                 cache=True):
         ''' Initialize the Plotter object
 
         Files should be a list of SAMPLE_NAME.root files.
@@ -34,21 +82,23 @@ class Plotter(object):
         each of the files.
 
         If [blinder] is not None, it will be applied to the data view.
+
+        If [cache] is True, the histograms of each sample are memoized (see
+        CachedView), as well as the rebinned ones.
         '''
         self.outputdir = outputdir
-        self.views = data_views(files, lumifiles, forceLumi)
+        self.files = list(files)
+        self.lumifiles = list(lumifiles)
+        self.blinder = blinder
+        self.forceLumi = forceLumi
+        self.cache = cache
+        self.build_views()
         self.canvas = plotting.Canvas(name='adsf', title='asdf')
         self.canvas.cd()
         self.pad    = plotting.Pad('up', 'up', 0., 0., 1., 1.) #ful-size pad
         self.pad.Draw()
         self.pad.cd()
         self.lower_pad = None
-        if blinder:
-            # Keep the unblinded data around if desired.
-            self.views['data']['unblinded_view'] = self.views['data']['view']
-            # Apply a blinding function
-            self.views['data']['view'] = blinder(self.views['data']['view'])
-        self.data = self.views['data']['view']
         self.keep = []
         # List of MC sample names to use.  Can be overridden.
         self.mc_samples = [
@@ -63,7 +113,43 @@ class Plotter(object):
         if not file_to_map: #no data here!
             file_to_map = self.views.keys()[0]
         #from pdb import set_trace; set_trace()
-        self.file_dir_structure = Plotter.map_dir_structure( self.views[file_to_map]['file'] )
+        # Use the key index of the file if it has one, instead of walking it
+        # (see keyindex)
+        map_file = self.views[file_to_map]['file']
+        index = keyindex.read_index(map_file.GetName())
+        if index is not None:
+            self.file_dir_structure = index['directories']
+        else:
+            self.file_dir_structure = Plotter.map_dir_structure(map_file)
+
+    def build_views(self):
+        ''' Open the files and build the views of each sample
+
+        This is called again in each worker of render_batch, so the workers
+        don't share the file handles.  Subclasses which add their own views
+        should do it here.
+        '''
+        self.views = data_views(self.files, self.lumifiles, self.forceLumi)
+        if self.cache:
+            for sample_info in self.views.itervalues():
+                for key in ['view', 'unweighted_view']:
+                    if key in sample_info:
+                        sample_info[key] = CachedView(sample_info[key])
+        if self.blinder:
+            # Keep the unblinded data around if desired.
+            self.views['data']['unblinded_view'] = self.views['data']['view']
+            # Apply a blinding function
+            self.views['data']['view'] = self.blinder(self.views['data']['view'])
+        self.data = self.views['data']['view']
+
+    def close(self):
+        ''' Release the sample files
+
+        The files are shared by all the Plotters (see file_registry), and
+        closed when none of them uses them anymore.
+        '''
+        release_views(self.views)
+        self.views = {}
 
     @staticmethod
     def map_dir_structure(directory, dirName=''):
@@ -76,10 +162,11 @@ class Plotter(object):
                 ret.extend(Plotter.map_dir_structure(directory.Get(keyname), subdirName))
         return ret
 
-    @staticmethod
-    def rebin_view(x, rebin):
+    def rebin_view(self, x, rebin):
         ''' Make a view which rebins histograms '''
         output = RebinView(x, rebin)
+        if self.cache:
+            output = CachedView(output)
         return output
 
     @staticmethod
@@ -190,6 +277,7 @@ class Plotter(object):
         else:
             mc_hist = mc_stack
         data_clone = data_hist.Clone()
+        data_clone.SetName(data_hist.GetName() + '_ratio')
         data_clone.Divide(mc_hist)
         if not x_range:
             nbins = data_clone.GetNbinsX()
@@ -274,16 +362,28 @@ class Plotter(object):
         self.pad.cd()
         self.lower_pad = None
 
-    def save(self, filename, dotc=False, dotroot=False, json=False, verbose=False):
-        ''' Save the current canvas contents to [filename] '''
-        self.pad.Draw()
-        self.canvas.Update()
+    def save(self, filename, dotc=False, dotroot=False, json=False, verbose=False,
+             export=None, images=True):
+        ''' Save the current canvas contents to [filename]
+
+        If [export] is 'json' or 'npz', the histograms, stacks and graphs
+        of the plot are also written with their contents to
+        [filename].plot.json/npz (see plotexport).  If [images] is False, the
+        png and pdf are not made.
+        '''
         if not os.path.exists(self.outputdir):
             os.makedirs(self.outputdir)
+        if export:
+            plotexport.write_plot(
+                plotexport.export_objects(self.keep),
+                os.path.join(self.outputdir, filename) + '.plot.' + export)
+        self.pad.Draw()
+        self.canvas.Update()
         if verbose:
             print 'saving '+os.path.join(self.outputdir, filename) + '.png'
-        self.canvas.SaveAs(os.path.join(self.outputdir, filename) + '.png')
-        self.canvas.SaveAs(os.path.join(self.outputdir, filename) + '.pdf')
+        if images:
+            self.canvas.SaveAs(os.path.join(self.outputdir, filename) + '.png')
+            self.canvas.SaveAs(os.path.join(self.outputdir, filename) + '.pdf')
         if dotc:
             self.canvas.SaveAs(os.path.join(self.outputdir, filename) + '.C')
         if json:
@@ -409,3 +509,78 @@ class Plotter(object):
         self.add_legend([data, mc_stack], leftside, entries=len(mc_stack.GetHists())+1)
         if show_ratio:
             self.add_ratio_plot(data, mc_stack, xrange, ratio_range=0.2)
+
+    def render(self, spec):
+        ''' Draw and save a plot described by [spec] (see PLOT_DEFAULTS) '''
+        spec = dict(PLOT_DEFAULTS, **spec)
+        if spec['plot'] is not None:
+            spec['plot'](self, spec)
+        else:
+            self.plot_mc_vs_data(
+                spec['folder'], spec['variable'], rebin=spec['rebin'],
+                xaxis=spec['xaxis'], leftside=spec['leftside'],
+                xrange=spec['xrange'], preprocess=spec['preprocess'],
+                show_ratio=spec['show_ratio'],
+                ratio_range=spec['ratio_range'], sort=spec['sort'])
+        self.pad.SetLogx(spec['logx'])
+        self.pad.SetLogy(spec['logy'])
+        filename = spec['filename']
+        if filename is None:
+            filename = '-'.join(
+                x for x in [spec['folder'], spec['variable']] if x
+            ).replace('/', '-').replace('*', '')
+        self.save(filename, **spec['save_options'])
+        self.pad.SetLogx(False)
+        self.pad.SetLogy(False)
+        return filename
+
+    def timed_render(self, spec):
+        ''' Render a spec, returning (filename, seconds, error or None) '''
+        start = time.time()
+        filename = spec.get('filename') or spec.get('variable')
+        try:
+            filename = self.render(spec)
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+            # Start the next plot from a clean canvas
+            self.reset()
+        return (filename, time.time() - start, error)
+
+    def render_batch(self, specs, nworkers=None):
+        ''' Render a list of plot specs, across [nworkers] processes
+
+        Each spec is a dictionary with the options in PLOT_DEFAULTS.  The
+        workers are forked from this plotter, and each reopens the files and
+        makes its own canvas.  The specs are not pickled, so the
+        preprocess/plot functions can be lambdas.
+
+        Returns a list of (filename, seconds, error) in the order of [specs],
+        where error is the traceback of a failed plot, or None.
+        '''
+        specs = list(specs)
+        if nworkers is None:
+            nworkers = multiprocessing.cpu_count()
+        nworkers = min(nworkers, len(specs))
+        start = time.time()
+        if nworkers <= 1:
+            results = [self.timed_render(spec) for spec in specs]
+        else:
+            pool = multiprocessing.Pool(
+                nworkers, _init_batch_worker, (self, specs))
+            try:
+                results = pool.map(_render_batch_spec, range(len(specs)), 1)
+            finally:
+                pool.close()
+                pool.join()
+        failed = 0
+        for filename, seconds, error in results:
+            if error is None:
+                log.info("Rendered %s in %.2fs", filename, seconds)
+            else:
+                failed += 1
+                log.error("Failed to render %s:\n%s", filename, error)
+        log.warning("Rendered %i plots (%i failed) in %.1fs with %i workers",
+                    len(results), failed, time.time() - start,
+                    max(nworkers, 1))
+        return results
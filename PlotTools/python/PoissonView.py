@@ -17,6 +17,8 @@ except ImportError:
 import FinalStateAnalysis.StatTools.poisson as poisson
 
 class PoissonView(views._FolderView):
+    pure = True
+
     def __init__(self, dir, x_err=True, set_zero_bins=None, marker_size=1, is_scaled=False):
         super(PoissonView, self).__init__(dir)
         self.x_err = x_err
@@ -25,6 +27,6 @@ class PoissonView(views._FolderView):
         self.is_scaled = is_scaled
 
     def apply_view(self, histo):
-        graph = poisson.convert(histo, self.x_err, self.set_zero_bins, self.is_scaled)
+        graph = poisson.convert_bulk(histo, self.x_err, self.set_zero_bins, self.is_scaled)
         graph.SetMarkerSize(self.marker_size)
         return asrootpy(graph)
@@ -5,6 +5,8 @@ except ImportError:
     from rootpy import asrootpy
 
 class ProjectionView(object):
+    pure = True
+
     def __init__(self, input_view, axis, proj_range):
         self.input = input_view
         self.axis  = axis
@@ -15,6 +15,7 @@ except ImportError:
     from rootpy import asrootpy
 import ROOT
 import os
+import histarrays
 
 class RebinView(views._FolderView):
     ''' Rebin a histogram.
@@ -22,6 +23,8 @@ class RebinView(views._FolderView):
     The original histogram is unmodified, a rebinned clone is returned.
 
     '''
+    pure = True
+
     def __init__(self, dir, binning):
         self.binning = binning
         super(RebinView, self).__init__(dir)
@@ -41,32 +44,15 @@ class RebinView(views._FolderView):
         )
 
         #check that new bins don't overlap on old edges
-        oldbinx = [float(histogram.GetXaxis().GetBinLowEdge(1))]
-        oldbiny = [float(histogram.GetYaxis().GetBinLowEdge(1))]
-        oldbinx.extend(float(histogram.GetXaxis().GetBinUpEdge(x)) for x in xrange(1, histogram.GetNbinsX()+1))
-        oldbiny.extend(float(histogram.GetYaxis().GetBinUpEdge(y)) for y in xrange(1, histogram.GetNbinsY()+1))
-        for x in bin_arrayx:
-            if x==0:
-                if not any( abs((oldx)) < 10**-8 for oldx in oldbinx ):
-                    raise Exception('New bin edge in x axis %s does not match any old bin edge, operation not permitted' % x)
-            else:
-                if not any( abs((oldx / x)-1.) < 10**-8 for oldx in oldbinx ):
-                    raise Exception('New bin edge in x axis %s does not match any old bin edge, operation not permitted' % x)
-        for y in bin_arrayy:
-            if y ==0:
-                if not any( abs((oldy) )< 10**-8 for oldy in oldbiny ):
-                    raise Exception('New bin edge in y axis %s does not match any old bin edge, operation not permitted' % y)
-            else:
-                if not any( abs((oldy / y)-1.) < 10**-8 for oldy in oldbiny ):
-                    raise Exception('New bin edge in y axis %s does not match any old bin edge, operation not permitted' % y)
-        
-        #fill the new histogram
-        for x in xrange(1, histogram.GetNbinsX()+1 ):
-            for y in xrange(1, histogram.GetNbinsY()+1 ):
-                new_histo.Fill(histogram.GetXaxis().GetBinCenter(x), histogram.GetYaxis().GetBinCenter(y), histogram.GetBinContent(x,y))
+        old_edges = histarrays.all_edges(histogram)
+        for axis, new_edges, old in [('x', bin_arrayx, old_edges[0]),
+                                     ('y', bin_arrayy, old_edges[1])]:
+            unmatched = histarrays.unmatched_edges(new_edges, old)
+            if len(unmatched):
+                raise Exception('New bin edge in %s axis %s does not match any old bin edge, operation not permitted' % (axis, unmatched[0]))
 
-        new_histo.SetEntries( histogram.GetEntries() )
-        return new_histo
+        #sum the old bins into the new ones
+        return histarrays.rebin_into(histogram, new_histo)
                               
     def rebin(self, histogram, binning):
         ''' Rebin a histogram
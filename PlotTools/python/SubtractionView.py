@@ -14,6 +14,7 @@ Author: Evan K. Friis, UW Madison
 '''
 
 from rootpy.plotting import views
+import histarrays
 
 class PositiveView(views._FolderView):
     ''' Restrict a histogram to non-negative entries
@@ -21,15 +22,17 @@ class PositiveView(views._FolderView):
     Negative bins are set to zero.
 
     '''
+    pure = True
+
     def __init__(self, dir):
         super(PositiveView, self).__init__(dir)
 
     @staticmethod
     def positivize(histogram):
         output = histogram.Clone()
-        for i in range(output.GetSize()):
-            if output.GetArray()[i] < 0:
-                output.AddAt(0, i)
+        contents = histarrays.get_contents(output)
+        if (contents < 0).any():
+            histarrays.set_contents(output, contents.clip(min=0))
         return output
 
     def apply_view(self, histogram):
@@ -45,6 +48,8 @@ class SubtractionView(views.SumView):
     negative bins.
 
     '''
+    pure = True
+
     def __init__(self, main_view, *to_subtract, **kwargs):
         # Make all the subtracted ones negative
         negated = [views.ScaleView(x, -1) for x in to_subtract]
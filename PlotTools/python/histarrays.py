@@ -0,0 +1,294 @@
+'''
+
+Tools to move histogram bin contents in and out of NumPy arrays.
+
+All the bins (including under/overflows) are transferred at once, using the
+global bin numbering of ROOT, instead of calling Get/SetBinContent for each
+bin through PyROOT.
+
+'''
+
+import array
+import numpy
+import ROOT
+
+# The storage type of each flavor of histogram
+_dtypes = [
+    (ROOT.TArrayD, numpy.float64),
+    (ROOT.TArrayF, numpy.float32),
+    (ROOT.TArrayI, numpy.int32),
+    (ROOT.TArrayS, numpy.int16),
+    (ROOT.TArrayC, numpy.int8),
+]
+
+
+def _storage_dtype(histo):
+    for array_type, dtype in _dtypes:
+        if isinstance(histo, array_type):
+            return dtype
+    raise TypeError("I don't know how %s stores its bins" % histo.ClassName())
+
+
+def _read_buffer(buffer, size, dtype):
+    ''' Copy a PyROOT buffer of [size] elements into a float64 array '''
+    if not size:
+        return numpy.zeros(0)
+    buffer.SetSize(size)
+    return numpy.frombuffer(buffer, dtype=dtype, count=size).astype(
+        numpy.float64)
+
+
+def ncells(histo):
+    ''' Total number of bins, including under/overflows '''
+    return histo.GetSize()
+
+
+def shape(histo):
+    ''' The shape of the bin arrays, as (nz + 2, ny + 2, nx + 2)
+
+    The bins arrays can be reshaped to this to get a multi-dimensional view,
+    which is indexed by [z, y, x] in the ROOT global bin numbering.
+    '''
+    dim = histo.GetDimension()
+    dims = [histo.GetNbinsX() + 2]
+    if dim > 1:
+        dims.append(histo.GetNbinsY() + 2)
+    if dim > 2:
+        dims.append(histo.GetNbinsZ() + 2)
+    return tuple(reversed(dims))
+
+
+def nbytes(histo):
+    ''' Memory used by the bin contents and sum of weights squared '''
+    contents = ncells(histo) * numpy.dtype(_storage_dtype(histo)).itemsize
+    return contents + histo.GetSumw2().GetSize() * 8
+
+
+def get_contents(histo):
+    ''' Get the bin contents as a flat float64 array '''
+    return _read_buffer(histo.GetArray(), ncells(histo),
+                        _storage_dtype(histo))
+
+
+def get_sumw2(histo):
+    ''' Get the sum of weights squared as a flat float64 array
+
+    If the histogram doesn't store the sum of weights squared, the contents
+    are returned, as is done by TH1::GetBinError.
+    '''
+    sumw2 = histo.GetSumw2()
+    if not sumw2.GetSize():
+        return numpy.abs(get_contents(histo))
+    return _read_buffer(sumw2.GetArray(), sumw2.GetSize(), numpy.float64)
+
+
+def get_errors(histo):
+    ''' Get the bin errors as a flat float64 array '''
+    return numpy.sqrt(get_sumw2(histo))
+
+
+def set_contents(histo, contents):
+    ''' Set all bin contents from a flat array '''
+    contents = numpy.ascontiguousarray(contents, dtype=numpy.float64)
+    if len(contents) != ncells(histo):
+        raise ValueError("Expected %i bins for %s, got %i" % (
+            ncells(histo), histo.GetName(), len(contents)))
+    entries = histo.GetEntries()
+    histo.SetContent(contents)
+    # SetContent resets the number of entries.
+    histo.SetEntries(entries)
+
+
+def set_sumw2(histo, sumw2):
+    ''' Set the sum of weights squared from a flat array '''
+    sumw2 = numpy.ascontiguousarray(sumw2, dtype=numpy.float64)
+    if len(sumw2) != ncells(histo):
+        raise ValueError("Expected %i bins for %s, got %i" % (
+            ncells(histo), histo.GetName(), len(sumw2)))
+    if not histo.GetSumw2().GetSize():
+        histo.Sumw2()
+    histo.GetSumw2().Set(len(sumw2), sumw2)
+
+
+def set_errors(histo, errors):
+    ''' Set the bin errors from a flat array '''
+    errors = numpy.asarray(errors, dtype=numpy.float64)
+    set_sumw2(histo, errors * errors)
+
+
+def axis_edges(axis):
+    ''' Get the bin edges of a TAxis as an array '''
+    nbins = axis.GetNbins()
+    edges = numpy.empty(nbins + 1)
+    for i in xrange(nbins):
+        edges[i] = axis.GetBinLowEdge(i + 1)
+    edges[nbins] = axis.GetBinUpEdge(nbins)
+    return edges
+
+
+def all_edges(histo):
+    ''' Get the bin edges of all the axes of [histo] '''
+    axes = [histo.GetXaxis(), histo.GetYaxis(), histo.GetZaxis()]
+    return [axis_edges(axis) for axis in axes[:histo.GetDimension()]]
+
+
+def graph_arrays(graph):
+    ''' Get copies of the points and errors of a TGraph
+
+    Returns a dictionary of arrays with the keys x, y, exl, exh, eyl and eyh.
+    The errors are zero for a plain TGraph.
+    '''
+    n = graph.GetN()
+    buffers = [('x', graph.GetX), ('y', graph.GetY)]
+    if isinstance(graph, (ROOT.TGraphErrors, ROOT.TGraphAsymmErrors)):
+        buffers.extend([
+            ('exl', graph.GetEXlow), ('exh', graph.GetEXhigh),
+            ('eyl', graph.GetEYlow), ('eyh', graph.GetEYhigh)])
+    output = dict((key, numpy.zeros(n)) for key in [
+        'x', 'y', 'exl', 'exh', 'eyl', 'eyh'])
+    for key, getter in buffers:
+        output[key] = _read_buffer(getter(), n, numpy.float64)
+    return output
+
+
+def in_range(histo):
+    ''' Index of the bins which are not under/overflows, in the shape() view
+
+    >>> import numpy
+    >>> bins = numpy.arange(12).reshape((3, 4))
+    >>> bins[(slice(1, -1), slice(1, -1))].tolist()
+    [[5, 6]]
+    '''
+    return tuple(slice(1, -1) for dim in shape(histo))
+
+
+def bin_centers(edges):
+    ''' Centers of the bins defined by [edges] '''
+    edges = numpy.asarray(edges, dtype=numpy.float64)
+    return 0.5 * (edges[1:] + edges[:-1])
+
+
+def find_bins(edges, values):
+    ''' Find the bin of each of [values], as TAxis::FindFixBin
+
+    Values below the first edge are in bin 0 (underflow), values at or above
+    the last edge are in bin len(edges) (overflow).
+
+    >>> find_bins([0, 1, 2], [-1, 0, 0.5, 1, 2, 3]).tolist()
+    [0, 1, 1, 2, 3, 3]
+    '''
+    return numpy.searchsorted(
+        numpy.asarray(edges, dtype=numpy.float64), values, side='right')
+
+
+def unmatched_edges(new_edges, old_edges, tolerance=1e-8):
+    ''' Get the [new_edges] which don't match any of [old_edges]
+
+    Edges match if their relative difference (or absolute for 0) is less
+    than [tolerance].
+
+    >>> unmatched_edges([0, 1, 2.5], [0, 0.5, 1, 1.5, 2, 3]).tolist()
+    [2.5]
+    '''
+    new_edges = numpy.asarray(new_edges, dtype=numpy.float64)
+    old_edges = numpy.sort(numpy.asarray(old_edges, dtype=numpy.float64))
+    # The nearest old edge is either just below or just above
+    above = numpy.clip(numpy.searchsorted(old_edges, new_edges),
+                       0, len(old_edges) - 1)
+    below = numpy.clip(above - 1, 0, len(old_edges) - 1)
+    distance = numpy.minimum(numpy.abs(old_edges[above] - new_edges),
+                             numpy.abs(old_edges[below] - new_edges))
+    scale = numpy.where(new_edges == 0, 1., numpy.abs(new_edges))
+    return new_edges[distance >= tolerance * scale]
+
+
+def rebin_into(histo, new_histo):
+    ''' Sum the bins of [histo] into the (coarser) bins of [new_histo]
+
+    Each bin goes into the bin of [new_histo] containing its center.  The
+    under/overflows of [histo] are dropped.  The contents, sum of weights
+    squared and number of entries of [new_histo] are replaced.
+    '''
+    old_shape = shape(histo)
+    new_shape = shape(new_histo)
+    if len(old_shape) != len(new_shape):
+        raise ValueError("Can't rebin a %iD histogram into a %iD one" % (
+            len(old_shape), len(new_shape)))
+    # Index of the new bin, along each axis (in the [z, y, x] order)
+    indices = []
+    for old_edges, new_edges in zip(reversed(all_edges(histo)),
+                                    reversed(all_edges(new_histo))):
+        indices.append(find_bins(new_edges, bin_centers(old_edges)))
+    grid = numpy.meshgrid(*indices, indexing='ij')
+    new_index = numpy.ravel_multi_index(grid, new_shape).ravel()
+    inner = in_range(histo)
+    contents = get_contents(histo).reshape(old_shape)[inner].ravel()
+    sumw2 = get_sumw2(histo).reshape(old_shape)[inner].ravel()
+    ncells = int(numpy.prod(new_shape))
+    set_contents(new_histo, numpy.bincount(
+        new_index, weights=contents, minlength=ncells))
+    set_sumw2(new_histo, numpy.bincount(
+        new_index, weights=sumw2, minlength=ncells))
+    new_histo.SetEntries(histo.GetEntries())
+    return new_histo
+
+
+# The histograms which are completely described by their bins.  Profiles
+# also need their bin entries, and histograms with bin labels their labels.
+ARRAY_TYPES = set(
+    'TH%i%s' % (dim, storage) for dim in (1, 2, 3) for storage in 'DFISC')
+
+
+def check_arrays_type(histo):
+    ''' Raise a TypeError if [histo] can't be transferred with to_arrays '''
+    if histo.ClassName() not in ARRAY_TYPES:
+        raise TypeError("Can't convert %s of type %s to arrays" % (
+            histo.GetName(), histo.ClassName()))
+    axes = [histo.GetXaxis(), histo.GetYaxis(), histo.GetZaxis()]
+    for axis in axes[:histo.GetDimension()]:
+        if axis.GetLabels():
+            raise TypeError("Can't convert %s to arrays: it has bin labels" %
+                            histo.GetName())
+
+
+def to_arrays(histo):
+    ''' Get a picklable dictionary with everything needed to rebuild [histo]
+
+    Only plain TH1/TH2/TH3 histograms without bin labels are supported (see
+    check_arrays_type).
+    '''
+    check_arrays_type(histo)
+    return {
+        'type': histo.ClassName(),
+        'name': histo.GetName(),
+        'title': histo.GetTitle(),
+        'edges': all_edges(histo),
+        'contents': get_contents(histo),
+        'sumw2': get_sumw2(histo),
+        'entries': histo.GetEntries(),
+    }
+
+
+def from_arrays(spec):
+    ''' Rebuild a histogram from the output of to_arrays '''
+    the_type = getattr(ROOT, spec['type'])
+    args = [spec['name'], spec['title']]
+    for edges in spec['edges']:
+        args.extend([len(edges) - 1, array.array('d', edges)])
+    histo = the_type(*args)
+    set_contents(histo, spec['contents'])
+    set_sumw2(histo, spec['sumw2'])
+    histo.SetEntries(spec['entries'])
+    return histo
+
+
+def add_arrays(spec, other):
+    ''' Add the bins of [other] into [spec] (both from to_arrays) '''
+    if len(spec['contents']) != len(other['contents']):
+        raise ValueError("Can't add %s (%i bins) and %s (%i bins)" % (
+            spec['name'], len(spec['contents']),
+            other['name'], len(other['contents'])))
+    spec['contents'] += other['contents']
+    spec['sumw2'] += other['sumw2']
+    spec['entries'] += other['entries']
+    return spec
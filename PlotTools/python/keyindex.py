@@ -0,0 +1,179 @@
+'''
+
+A persistent index of the contents of a ROOT file.
+
+Walking all the directories of a big output file (i.e. to find the folders to
+plot, or to print the yields) reads every directory header, which takes a
+long time for files with thousands of directories.  The index lists the
+directories and, for each object, its class and (for histograms) its
+integral and error.  It is stored in a JSON sidecar next to the file::
+
+    file.root.keys.json
+
+along with the modification time and size of the file.  If they don't match
+the file anymore, the index is ignored.
+
+MegaBase.write_histos makes the index of its output, and it is written by the
+File/ChainProcessor once the output is closed.  The mega mergers merge the
+indices of their inputs, so the final output has an index without having to
+be walked.  Only the mega outputs get an index: for other files (i.e. made by
+plain hadd) get_index() builds it in memory, without writing the sidecar
+next to the file, and the Plotter walks the directories as before.
+
+Example::
+
+    from FinalStateAnalysis.PlotTools import keyindex
+    index = keyindex.get_index('output.root')
+    print index['directories']
+    for path, info in index['objects'].iteritems():
+        print path, info['class'], info.get('integral')
+
+'''
+
+import json
+import logging
+import math
+import os
+import shutil
+
+log = logging.getLogger(__name__)
+
+SUFFIX = '.keys.json'
+
+
+def index_file(filename):
+    ''' The name of the index of [filename] '''
+    return filename + SUFFIX
+
+
+def _file_stat(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime, stat.st_size
+
+
+def describe(object):
+    ''' Get the index entry of an object '''
+    import ROOT
+    entry = {'class': object.ClassName()}
+    if isinstance(object, ROOT.TH1):
+        import histarrays
+        entry['integral'] = float(histarrays.get_contents(object).sum())
+        entry['error'] = math.sqrt(histarrays.get_sumw2(object).sum())
+    return entry
+
+
+def build_index(directory, path='', index=None, known=None):
+    ''' Walk a ROOT directory to build its index
+
+    [known] is an optional dictionary of {path : histogram} which are already
+    in memory (i.e. MegaBase.histograms), so they don't need to be read back.
+    '''
+    import ROOT
+    if index is None:
+        index = {'directories': [], 'objects': {}}
+    if known is None:
+        known = {}
+    for key in directory.GetListOfKeys():
+        name = key.GetName()
+        full_path = os.path.join(path, name)
+        class_name = key.GetClassName()
+        the_class = ROOT.TClass.GetClass(class_name)
+        if the_class and the_class.InheritsFrom('TDirectory'):
+            index['directories'].append(full_path)
+            build_index(directory.Get(name), full_path, index, known)
+        elif full_path in known:
+            index['objects'][full_path] = describe(known[full_path])
+        elif the_class and the_class.InheritsFrom('TH1'):
+            index['objects'][full_path] = describe(key.ReadObj())
+        else:
+            index['objects'][full_path] = {'class': class_name}
+    return index
+
+
+def write_index(filename, index):
+    ''' Write the index of [filename], which must be closed '''
+    data = dict(index)
+    data['mtime'], data['size'] = _file_stat(filename)
+    try:
+        with open(index_file(filename), 'w') as output:
+            json.dump(data, output)
+    except IOError, e:
+        log.warning("Can't write the key index of %s: %s", filename, e)
+
+
+def read_index(filename):
+    ''' Read the index of [filename], or None if it is missing or stale '''
+    try:
+        with open(index_file(filename)) as input:
+            data = json.load(input)
+    except (IOError, ValueError):
+        return None
+    if (data.get('mtime'), data.get('size')) != _file_stat(filename):
+        log.info("Key index of %s is out of date", filename)
+        return None
+    return data
+
+
+def get_index(filename, save=False):
+    ''' Get the index of [filename], building it if needed
+
+    The index is only written next to the file if [save] is True.
+    '''
+    index = read_index(filename)
+    if index is not None:
+        return index
+    import ROOT
+    log.info("Building key index of %s", filename)
+    file = ROOT.TFile.Open(filename, 'READ')
+    if not file:
+        raise IOError("Can't open ROOT file: %s" % filename)
+    index = build_index(file)
+    file.Close()
+    if save:
+        write_index(filename, index)
+    return index
+
+
+def merge_indices(indices):
+    ''' Merge indices, as the files would be merged by hadd
+
+    The histogram integrals are summed, and the errors added in quadrature.
+    '''
+    directories = set()
+    objects = {}
+    for index in indices:
+        directories.update(index['directories'])
+        for path, entry in index['objects'].iteritems():
+            if path not in objects:
+                objects[path] = dict(entry)
+            elif 'integral' in entry:
+                merged = objects[path]
+                merged['integral'] += entry['integral']
+                merged['error'] = math.hypot(merged['error'], entry['error'])
+    return {'directories': sorted(directories), 'objects': objects}
+
+
+def remove_index(filename):
+    if os.path.exists(index_file(filename)):
+        os.remove(index_file(filename))
+
+
+def merge_index(inputs, output):
+    ''' Write the index of [output] from the indices of the merged [inputs]
+
+    The indices of the inputs are removed.  If any of them is missing, no
+    index is written for the output.
+    '''
+    indices = [read_index(input) for input in inputs]
+    for input in inputs:
+        remove_index(input)
+    if all(index is not None for index in indices):
+        write_index(output, merge_indices(indices))
+
+
+def move_index(source, destination):
+    ''' Move the index along with a file moved from [source] '''
+    if os.path.exists(index_file(source)):
+        shutil.move(index_file(source), index_file(destination))
+    else:
+        remove_index(destination)
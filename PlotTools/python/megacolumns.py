@@ -0,0 +1,100 @@
+'''
+
+Read blocks of TTree entries into NumPy arrays, for columnar evaluation of
+megautil selections.
+
+Only the requested branches are read, using TTree::Draw in "goff" mode, so the
+loop over entries runs in C++.  Typically you will want to read the branches
+touched by a MetaTree::
+
+    from FinalStateAnalysis.PlotTools.megautil import MetaTree
+    from FinalStateAnalysis.PlotTools.megacolumns import select_blocks
+
+    meta = MetaTree()
+    signal = (meta.muPt > 20) & (abs(meta.muEta) < 2.1)
+
+    for first_entry, mask in select_blocks(signal, tree, meta.active_branches()):
+        # mask[i] is True if entry first_entry + i passes
+        ...
+
+'''
+
+import numpy
+
+# TTree::Draw only fills 4 buffers (GetV1...GetV4) per call.
+_MAX_DRAW_VARIABLES = 4
+
+
+def _group(items, n):
+    ''' Split a list into chunks of at most n items '''
+    for i in range(0, len(items), n):
+        yield items[i:i + n]
+
+
+def read_columns(tree, branches, first_entry=0, nentries=None):
+    ''' Read [nentries] entries of [branches], starting at [first_entry]
+
+    Returns a dictionary of {branch : float64 array}.  If [nentries] is None,
+    read until the end of the tree.
+
+    '''
+    if nentries is None:
+        nentries = tree.GetEntries() - first_entry
+    nentries = max(0, min(nentries, tree.GetEntries() - first_entry))
+    columns = {}
+    if not nentries:
+        for branch in branches:
+            columns[branch] = numpy.zeros(0)
+        return columns
+    # Make sure the buffers are big enough to hold the whole block
+    if tree.GetEstimate() < nentries + 1:
+        tree.SetEstimate(nentries + 1)
+    getters = [tree.GetV1, tree.GetV2, tree.GetV3, tree.GetV4]
+    for group in _group(list(branches), _MAX_DRAW_VARIABLES):
+        tree.Draw(':'.join(group), '', 'goff', nentries, first_entry)
+        nrows = tree.GetSelectedRows()
+        if nrows != nentries:
+            raise IOError("Read %i rows of %s, expected %i" % (
+                nrows, ', '.join(group), nentries))
+        for branch, getter in zip(group, getters):
+            buffer = getter()
+            buffer.SetSize(nrows)
+            columns[branch] = numpy.array(
+                numpy.frombuffer(buffer, dtype=numpy.float64, count=nrows))
+    return columns
+
+
+def iter_blocks(tree, branches, blocksize=10000, first_entry=0,
+                nentries=None):
+    ''' Generate (first_entry, columns) for blocks of [blocksize] entries '''
+    last_entry = tree.GetEntries()
+    if nentries is not None:
+        last_entry = min(last_entry, first_entry + nentries)
+    start = first_entry
+    while start < last_entry:
+        size = min(blocksize, last_entry - start)
+        yield start, read_columns(tree, branches, start, size)
+        start += size
+
+
+def select_blocks(selection, tree, branches, blocksize=10000, first_entry=0,
+                  nentries=None):
+    ''' Generate (first_entry, mask) of [selection] for blocks of entries
+
+    The branches should include everything used by the selection, i.e.
+    MetaTree.active_branches().
+
+    '''
+    for start, columns in iter_blocks(tree, branches, blocksize,
+                                      first_entry, nentries):
+        yield start, selection.select_block(columns)
+
+
+def count_passing(selection, tree, branches, blocksize=10000, first_entry=0,
+                  nentries=None):
+    ''' Count the number of entries passing [selection] '''
+    total = 0
+    for start, mask in select_blocks(selection, tree, branches, blocksize,
+                                     first_entry, nentries):
+        total += int(numpy.count_nonzero(mask))
+    return total
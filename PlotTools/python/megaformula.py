@@ -0,0 +1,84 @@
+'''
+
+Evaluate megautil selections natively, as TTreeFormulas.
+
+Each selection is translated to its C++ expression (Selection.to_cpp()) and
+compiled once into a TTreeFormula.  All the entries are then evaluated in a
+single loop in C++ (see Utilities/interface/TreeFormulaCutFlow.h), instead of
+calling the python closures for every row.
+
+Example::
+
+    from FinalStateAnalysis.PlotTools.megautil import MetaTree, And
+    from FinalStateAnalysis.PlotTools import megaformula
+
+    meta = MetaTree()
+    cuts = And(meta.m1Pt > 20, meta.m2Pt > 10, abs(meta.m1Eta) < 2.1)
+
+    # numpy boolean array with one entry per tree entry
+    mask = megaformula.compiled_mask(cuts, tree)
+
+    # [(cut, number of entries passing this and all previous cuts), ...]
+    for cut, npassed in megaformula.cut_flow(cuts, tree):
+        print cut, npassed
+
+'''
+
+import numpy
+from FinalStateAnalysis.Utilities.rootbindings import ROOT
+
+
+def _make_cut_flow(cuts, tree):
+    ''' Build the native evaluator for a list of selections '''
+    cpp_cuts = ROOT.std.vector('string')()
+    for cut in cuts:
+        cpp_cuts.push_back(cut.to_cpp())
+    return ROOT.TreeFormulaCutFlow(tree, cpp_cuts)
+
+
+def compiled_mask(selection, tree, first_entry=0, nentries=-1):
+    ''' Get the boolean mask of entries passing [selection]
+
+    The mask covers [nentries] entries starting at [first_entry].  A
+    negative number of entries means "until the end of the tree".
+
+    '''
+    evaluator = _make_cut_flow([selection], tree)
+    evaluator.process(first_entry, nentries)
+    return _get_mask(evaluator)
+
+
+def _get_mask(evaluator):
+    ''' Get the mask of entries passing all cuts in the last process() '''
+    mask = numpy.zeros(evaluator.nProcessed(), dtype=numpy.int32)
+    if len(mask):
+        evaluator.fillMask(mask)
+    return mask.astype(bool)
+
+
+def cut_flow(selections, tree, first_entry=0, nentries=-1,
+             individually=False, with_mask=False):
+    ''' Count the entries passing a sequence of cuts, in one pass
+
+    [selections] can be a list of selections, or an And(...) selection, in
+    which case the sub-selections are used.  Returns a list of
+    (selection, npassed) where npassed is the number of entries passing this
+    and all previous cuts.  If [individually] is True, npassed is the number
+    passing each cut on its own.
+
+    If [with_mask] is True, (cut flow, mask of entries passing all cuts) is
+    returned.
+
+    '''
+    cuts = list(selections)
+    evaluator = _make_cut_flow(cuts, tree)
+    evaluator.process(first_entry, nentries)
+    output = []
+    for i, cut in enumerate(cuts):
+        if individually:
+            output.append((cut, evaluator.passedIndividually(i)))
+        else:
+            output.append((cut, evaluator.passed(i)))
+    if with_mask:
+        return output, _get_mask(evaluator)
+    return output
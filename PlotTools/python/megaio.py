@@ -0,0 +1,187 @@
+'''
+
+I/O tuning for the File/ChainProcessor, for reading over xrootd.
+
+The TTreeCache is sized to hold one cluster (the entries written between two
+AutoFlushes) of the branches the selector actually reads, and those branches
+are registered explicitly, so there is no learning phase reading everything.
+Selectors declare what they read with the active_branches class attribute::
+
+    class MySelector(MegaBase):
+        active_branches = ['muPt', 'muEta', 'run', 'evt']
+
+Typically this is MetaTree.active_branches().  If it isn't set, the cache
+learns the branches from the first entries, as before.
+
+IOMonitor records the bytes read and number of read calls for each file.  If
+prefetching is turned on (mega.py --prefetch), it also asynchronously opens
+the next file of a chain, and the TTreeCache reads ahead in a separate thread.
+It is off by default until its effect on real jobs has been measured.
+
+To test the tuning without a remote server, local files can be read through a
+LatencyFile (see Utilities/interface/LatencyFile.h), which sleeps on each read
+call::
+
+    files = simulate_latency(files, 20) # 20 ms per read call
+
+'''
+
+import os
+from FinalStateAnalysis.Utilities.rootbindings import ROOT
+
+# Bounds on the TTreeCache size, in bytes
+MIN_CACHE_SIZE = 1000000
+MAX_CACHE_SIZE = 200000000
+# Used when the selector doesn't say which branches it reads
+DEFAULT_CACHE_SIZE = 10000000
+# Extra room, as the clusters are not all the same size
+CACHE_HEADROOM = 1.2
+
+
+def cache_size(tree, branches):
+    ''' Estimate the cache needed for one cluster of [branches] in [tree]
+
+    If [tree] is a TChain, the estimate is done with the first file.
+
+    '''
+    tree.LoadTree(0)
+    the_tree = tree.GetTree()
+    if not the_tree or not the_tree.GetEntries():
+        return MIN_CACHE_SIZE
+    active_bytes = 0
+    for name in branches:
+        branch = the_tree.GetBranch(name)
+        if branch:
+            # Include the sub-branches
+            active_bytes += branch.GetZipBytes('*')
+    autoflush = the_tree.GetAutoFlush()
+    if autoflush > 0:
+        # AutoFlush every [autoflush] entries
+        size = active_bytes * float(autoflush) / the_tree.GetEntries()
+    elif autoflush < 0 and the_tree.GetZipBytes():
+        # AutoFlush every -[autoflush] bytes (of all the branches)
+        size = -autoflush * float(active_bytes) / the_tree.GetZipBytes()
+    else:
+        size = active_bytes
+    size *= CACHE_HEADROOM
+    return int(max(MIN_CACHE_SIZE, min(MAX_CACHE_SIZE, size)))
+
+
+def configure_cache(tree, branches, log=None, learn_entries=100):
+    ''' Set up the TTreeCache of [tree] to read [branches]
+
+    If [branches] is None, the cache learns the branches from the first
+    [learn_entries] entries.  Returns the cache size.
+
+    '''
+    if not branches:
+        ROOT.TTreeCache.SetLearnEntries(learn_entries)
+        tree.SetCacheSize(DEFAULT_CACHE_SIZE)
+        if log:
+            log.debug("TTreeCache learning branches, size %i",
+                      DEFAULT_CACHE_SIZE)
+        return DEFAULT_CACHE_SIZE
+    size = cache_size(tree, branches)
+    tree.SetCacheSize(size)
+    for name in branches:
+        tree.AddBranchToCache(name, True)
+    tree.StopCacheLearningPhase()
+    if log:
+        log.debug("TTreeCache size %i for %i branches", size, len(branches))
+    return size
+
+
+def enable_async_prefetching():
+    ''' Let the TTreeCache prefetch the next blocks in a separate thread
+
+    This must be called before the files are opened.
+
+    '''
+    ROOT.gEnv.SetValue("TFile.AsyncPrefetching", 1)
+
+
+class IOMonitor(object):
+    ''' Keep track of the file being read by a tree or chain
+
+    Call check() as the entries are processed (MegaBase.entry_range does it).
+    When the chain moves to a new file, the bytes read and number of read calls
+    for the previous file are recorded, and the file after the new one is
+    opened asynchronously, so it is ready when the chain gets there.
+    TFile::Open picks up the pending asynchronous open requests by name.
+
+    The counts are taken from the global TFile counters, so they include
+    everything read by the process in the meantime.  The reads made before
+    the first check() (i.e. the first fill of the TTreeCache) are counted for
+    the first file checked.  If check() is never called (i.e. a selector
+    looping over the tree itself), finish() counts all the reads for the file
+    the tree is at.
+
+    '''
+    def __init__(self, tree, files, prefetch=False):
+        self.tree = tree
+        self.files = list(files)
+        self.prefetch = prefetch
+        self.current = -1
+        # List of dictionaries with the file, bytes_read and read_calls
+        self.stats = []
+        self.start_bytes = ROOT.TFile.GetFileBytesRead()
+        self.start_calls = ROOT.TFile.GetFileReadCalls()
+        self.prefetched = set()
+
+    def check(self):
+        ''' Check if the tree has moved to a new file '''
+        number = self.tree.GetTreeNumber()
+        if number == self.current:
+            return
+        if self.current >= 0:
+            self.record()
+        # Otherwise this is the first file, and the reads so far are its own
+        self.current = number
+        self.prefetch_file(number + 1)
+
+    def prefetch_file(self, index):
+        ''' Start opening the file at [index] in the background '''
+        if not self.prefetch or index < 0 or index >= len(self.files):
+            return
+        if index in self.prefetched:
+            return
+        self.prefetched.add(index)
+        ROOT.TFile.AsyncOpen(self.files[index])
+
+    def record(self):
+        ''' Record the reads since the last call, for the current file '''
+        bytes_read = ROOT.TFile.GetFileBytesRead()
+        read_calls = ROOT.TFile.GetFileReadCalls()
+        if 0 <= self.current < len(self.files):
+            self.stats.append({
+                'file': self.files[self.current],
+                'bytes_read': bytes_read - self.start_bytes,
+                'read_calls': read_calls - self.start_calls,
+            })
+        self.start_bytes = bytes_read
+        self.start_calls = read_calls
+
+    def finish(self):
+        ''' Record the last file and return the statistics for all files '''
+        self.check()
+        self.record()
+        self.current = -1
+        return self.stats
+
+
+def log_stats(log, stats):
+    ''' Log the output of IOMonitor.finish() '''
+    for stat in stats:
+        log.info("Read %i bytes in %i calls from %s",
+                 stat['bytes_read'], stat['read_calls'], stat['file'])
+
+
+def simulate_latency(files, latency_ms):
+    ''' Read local [files] through a LatencyFile with [latency_ms] per call
+
+    Returns the list of file names to use instead of [files].
+
+    '''
+    ROOT.LatencyFile.SetLatency(int(latency_ms * 1000))
+    ROOT.LatencyFile.RegisterPlugin()
+    return ['latency://' + os.path.abspath(file) for file in files]
@@ -0,0 +1,271 @@
+'''
+
+Instrumentation of mega jobs.
+
+When profiling is enabled (mega --profile), each worker measures every input
+(file, chain or shard) it processes:
+
+    * the number of events and events/s
+    * the time spent reading entries (calls to tree.GetEntry)
+    * the time spent filling histograms (calls to Fill on booked histograms)
+    * the rest of the time, spent in the selector
+    * the bytes read and number of read calls (see megaio)
+    * the peak RSS of the worker
+
+The measurements are streamed to the dispatcher, where a ProfileCollector
+summarizes them at the end of the job, as a table and optionally as JSON.
+
+The time spent in GetEntry and Fill is only seen if they are called from
+python - i.e. a Cython proxy reading the tree counts as selector time.  The
+bytes read and read calls cover all the reads of the input, including the
+first fill of the TTreeCache, and selectors looping over the tree themselves
+(for row in self.tree).
+
+Optionally, the workers also run a StackSampler, a statistical profiler
+which records the python stack at fixed intervals of CPU time.  The samples of
+all the workers are merged into one report, and can be written in the
+"collapsed stack" format used by flamegraph.pl.
+
+'''
+
+import json
+import resource
+import signal
+import threading
+import time
+from MegaShard import Shard
+
+
+def peak_rss():
+    ''' Peak resident set size of this process, in kB '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def describe_input(to_process):
+    ''' A readable label for a worker input '''
+    if isinstance(to_process, Shard):
+        return '%s[%i+%i]' % to_process
+    elif isinstance(to_process, basestring):
+        return to_process
+    if len(to_process) == 1:
+        return to_process[0]
+    return '%s (+%i files)' % (to_process[0], len(to_process) - 1)
+
+
+class CallTimer(object):
+    ''' Accumulate the time spent in the functions wrapped by it '''
+    def __init__(self):
+        self.time = 0.
+        self.calls = 0
+
+    def wrap(self, function):
+        def timed(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                self.time += time.time() - start
+                self.calls += 1
+        return timed
+
+
+class JobProfiler(object):
+    ''' Measure processor.process() of a File/ChainProcessor
+
+    Must be created before process() is called, as the histograms booked by
+    the selector in begin() are instrumented.
+
+    '''
+    def __init__(self, processor, label, worker=''):
+        self.processor = processor
+        self.label = label
+        self.worker = worker
+        self.read_timer = CallTimer()
+        self.fill_timer = CallTimer()
+        tree = processor.tree
+        tree.GetEntry = self.read_timer.wrap(tree.GetEntry)
+        processor.selector.fill_timer = self.fill_timer
+        self.summary = None
+
+    def run(self):
+        ''' Run the processor, returning its result '''
+        selector = self.processor.selector
+        nevents = selector.entries_to_process()
+        start = time.time()
+        result = self.processor.process()
+        wall = time.time() - start
+        io_stats = getattr(self.processor, 'io_stats', [])
+        self.summary = {
+            'type': 'job',
+            'worker': self.worker,
+            'input': self.label,
+            'events': nevents,
+            'wall_time': wall,
+            'events_per_sec': nevents / wall if wall > 0 else 0.,
+            'read_time': self.read_timer.time,
+            'read_calls': self.read_timer.calls,
+            'fill_time': self.fill_timer.time,
+            'fills': self.fill_timer.calls,
+            'selector_time': max(
+                0., wall - self.read_timer.time - self.fill_timer.time),
+            'bytes_read': sum(stat['bytes_read'] for stat in io_stats),
+            'io_calls': sum(stat['read_calls'] for stat in io_stats),
+            'peak_rss_kb': peak_rss(),
+        }
+        return result
+
+
+class StackSampler(object):
+    ''' Statistical profiler, sampling the python stack every [interval] s
+
+    The interval is in CPU time of the process (ITIMER_PROF), so time spent
+    in C++ (i.e. ROOT) is attributed to the python function calling it.
+
+    '''
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        # "outer;...;inner" => number of samples
+        self.stacks = {}
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%i)' % (
+                code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        # Don't interrupt the system calls (i.e. reading the queues)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def message(self, worker):
+        ''' The samples to send to the ProfileCollector '''
+        return {'type': 'samples', 'worker': worker, 'stacks': self.stacks}
+
+
+def merge_stacks(total, stacks):
+    ''' Add the {stack : count} of [stacks] into [total] '''
+    for stack, count in stacks.iteritems():
+        total[stack] = total.get(stack, 0) + count
+    return total
+
+
+def function_counts(stacks):
+    ''' Get {function : (self samples, cumulative samples)} from the stacks '''
+    counts = {}
+    for stack, count in stacks.iteritems():
+        functions = stack.split(';')
+        for function in set(functions):
+            own, cumulative = counts.get(function, (0, 0))
+            counts[function] = (own, cumulative + count)
+        own, cumulative = counts[functions[-1]]
+        counts[functions[-1]] = (own + count, cumulative)
+    return counts
+
+
+def write_collapsed_stacks(stacks, filename):
+    ''' Write the samples in the format used by flamegraph.pl '''
+    with open(filename, 'w') as output:
+        for stack, count in sorted(stacks.iteritems()):
+            output.write('%s %i\n' % (stack, count))
+
+
+class ProfileCollector(threading.Thread):
+    ''' Collect the profiles streamed by the workers, until a None is received
+
+    Runs as a thread in the dispatcher, so the queue is drained while the
+    dispatcher waits for the workers.
+
+    '''
+    def __init__(self, queue, log):
+        super(ProfileCollector, self).__init__()
+        self.queue = queue
+        self.log = log
+        self.jobs = []
+        self.stacks = {}
+        self.daemon = True
+
+    def run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            if message['type'] == 'job':
+                self.jobs.append(message)
+                self.log.info(
+                    "%s: %i events in %.1fs (%.0f/s) %s",
+                    message['worker'], message['events'],
+                    message['wall_time'], message['events_per_sec'],
+                    message['input'])
+            elif message['type'] == 'samples':
+                merge_stacks(self.stacks, message['stacks'])
+
+    def worker_totals(self):
+        ''' Sum the jobs of each worker '''
+        totals = {}
+        for job in self.jobs:
+            total = totals.setdefault(job['worker'], {
+                'type': 'worker', 'worker': job['worker'], 'input': 'TOTAL',
+                'events': 0, 'wall_time': 0., 'read_time': 0.,
+                'read_calls': 0, 'fill_time': 0., 'fills': 0,
+                'selector_time': 0., 'bytes_read': 0, 'io_calls': 0,
+                'peak_rss_kb': 0})
+            for key, value in job.iteritems():
+                if key == 'peak_rss_kb':
+                    total[key] = max(total[key], value)
+                elif key in total and key not in ('type', 'worker', 'input'):
+                    total[key] += value
+        for total in totals.itervalues():
+            total['events_per_sec'] = (
+                total['events'] / total['wall_time']
+                if total['wall_time'] > 0 else 0.)
+        return [totals[worker] for worker in sorted(totals.keys())]
+
+    def table(self):
+        ''' Format a summary table of all the jobs and workers '''
+        header = ('%-20s %10s %8s %10s %8s %8s %8s %10s %8s %8s  %s' % (
+            'worker', 'events', 'wall/s', 'events/s', 'read/s', 'fill/s',
+            'sel/s', 'MB read', 'calls', 'RSS/MB', 'input'))
+        lines = [header, '-' * len(header)]
+        rows = list(self.jobs) + self.worker_totals()
+        for row in rows:
+            lines.append(
+                '%-20s %10i %8.1f %10.0f %8.1f %8.1f %8.1f %10.1f %8i %8.0f  %s'
+                % (row['worker'], row['events'], row['wall_time'],
+                   row['events_per_sec'], row['read_time'], row['fill_time'],
+                   row['selector_time'], row['bytes_read'] / 1e6,
+                   row['io_calls'], row['peak_rss_kb'] / 1024.,
+                   row['input']))
+        return '\n'.join(lines)
+
+    def sample_table(self, nfunctions=25):
+        ''' Format the functions with the most samples '''
+        if not self.stacks:
+            return ''
+        nsamples = sum(self.stacks.itervalues())
+        counts = function_counts(self.stacks)
+        lines = ['%8s %8s  %s' % ('self %', 'cumul %', 'function')]
+        ranked = sorted(counts.iteritems(), key=lambda x: x[1], reverse=True)
+        for function, (own, cumulative) in ranked[:nfunctions]:
+            lines.append('%8.1f %8.1f  %s' % (
+                100. * own / nsamples, 100. * cumulative / nsamples,
+                function))
+        return '\n'.join(lines)
+
+    def write_json(self, filename):
+        ''' Write all the measurements into [filename] '''
+        with open(filename, 'w') as output:
+            json.dump({
+                'jobs': self.jobs,
+                'workers': self.worker_totals(),
+                'samples': self.stacks,
+            }, output, indent=2)
@@ -159,21 +159,95 @@ The MetaTree object also keeps track of which branches are accessed:
 >>> tree.active_branches()
 ['elecId', 'elecPt', 'muPt', 'negativeNumber']
 
+Columnar evaluation
+-------------------
+
+Selections and values can also be evaluated on a whole block of entries at
+once.  The block is a dictionary of NumPy arrays, keyed by branch name
+(see megacolumns.read_columns).  The result is an array, with one element per
+entry.
+
+>>> import numpy
+>>> block = {
+...     'muPt' : numpy.array([25., 15., 35.]),
+...     'elecPt' : numpy.array([10., 20., 50.]),
+...     'elecId' : numpy.array([10, 2, 8]),
+...     'negativeNumber' : numpy.array([-50., 10., -20.]),
+... }
+>>> mu_cut = (tree.muPt > 20) & ~(tree.elecPt > 40)
+>>> mu_cut.select_block(block).tolist()
+[True, False, False]
+>>> (abs(tree.negativeNumber) > 15).select_block(block).tolist()
+[True, False, True]
+>>> bit_or_diff = (tree.elecId.bit(2) > 0) | (tree.muPt - tree.elecPt > 10)
+>>> bit_or_diff.select_block(block).tolist()
+[True, True, False]
+>>> (tree.elecId + 6).evaluate_block(block).tolist()
+[16, 8, 14]
+
+Selections built from arbitrary python functions can not be evaluated in
+blocks:
+
+>>> Selection(lambda x: True).select_block(block)
+Traceback (most recent call last):
+    ...
+TypeError: Selection can not be evaluated on columns
+
+C++ expressions
+---------------
+
+Selections and values can be translated to an equivalent C++ expression,
+which can be used in a TTreeFormula (see megaformula).
+
+>>> print ((tree.muPt > 20) & ~(abs(tree.muEta) > 2.1)).to_cpp()
+((muPt > 20) && !((TMath::Abs(muEta) > 2.1)))
+>>> print ((tree.elecId.bit(4) > 0) | (tree.elecPt <= tree.muPt - 5)).to_cpp()
+(((int(elecId) & 8) > 0) || (elecPt <= (muPt - 5)))
+
 '''
 
 
+import numpy
 import operator
 
 class Selection(object):
-    def __init__(self, selection, repr="Selection"):
+    # The sub-expressions this one is built from, and a function to compute
+    # our result from their results.  Used by the SelectionDAG.  Selections
+    # built from arbitrary python functions have no operands.  The signature
+    # identifies the operation (and its constants) applied to the operands.
+    operands = ()
+    combine = None
+    signature = None
+
+    def __init__(self, selection, repr="Selection", columnar=None, cpp=None):
         self.functor = selection
         self.repr = repr
+        # Same as functor, but for a dictionary of branch value arrays
+        self.columnar = columnar
+        # Equivalent C++ expression string
+        self.cpp = cpp
         self.last_result = None
         self.last_entry = None
 
     def __call__(self, x):
         return self.functor(x)
 
+    def select_block(self, columns):
+        ''' Get the boolean mask of entries in [columns] passing the cut
+
+        [columns] is a dictionary of {branch : array of values}.
+
+        '''
+        if self.columnar is None:
+            raise TypeError("%s can not be evaluated on columns" % self)
+        return numpy.asarray(self.columnar(columns), dtype=bool)
+
+    def to_cpp(self):
+        ''' Get the equivalent C++ expression of this cut '''
+        if self.cpp is None:
+            raise TypeError("%s can not be converted to C++" % self)
+        return self.cpp
+
     def cached_select(self, tree, entry):
         ''' Same as call, but caches the result from the last entry '''
         if entry == self.last_entry:
@@ -202,12 +276,42 @@ class Selection(object):
         ''' Bitwise ~ operator - invert the cuts '''
         def invert_cut(tree):
             return not self(tree)
-        return Selection(invert_cut, "!%s" % self)
+        columnar = None
+        if self.columnar is not None:
+            def columnar(columns):
+                return numpy.logical_not(self.columnar(columns))
+        cpp = None
+        if self.cpp is not None:
+            cpp = "!(%s)" % self.cpp
+        inverted = Selection(invert_cut, "!%s" % self, columnar, cpp)
+        inverted.operands = (self,)
+        inverted.combine = operator.not_
+        inverted.signature = ('not',)
+        return inverted
 
     def explain(self, tree):
         ''' Explain what this cut does, given the TTree '''
         return "NotImplemented"
 
+def _reduce_columnar(reducer, selections):
+    ''' Combine the columnar functors of [selections] using [reducer] '''
+    columnars = [x.columnar for x in selections]
+    if any(x is None for x in columnars):
+        return None
+    def columnar(columns):
+        result = numpy.asarray(columnars[0](columns), dtype=bool)
+        for other in columnars[1:]:
+            result = reducer(result, other(columns))
+        return result
+    return columnar
+
+def _join_cpp(cpp_op, selections):
+    ''' Join the C++ expressions of [selections] using [cpp_op] '''
+    cpps = [x.cpp for x in selections]
+    if any(x is None for x in cpps):
+        return None
+    return "(%s)" % (" %s " % cpp_op).join(cpps)
+
 class And(Selection):
     def __init__(self, *selections):
         self.selections = selections
@@ -217,7 +321,11 @@ class And(Selection):
                     return False
             return True
         super(And, self).__init__(functor, "AND[%s]" % ' '.join(
-            [str(x) for x in selections]))
+            [str(x) for x in selections]),
+            _reduce_columnar(numpy.logical_and, selections),
+            _join_cpp('&&', selections))
+        self.operands = selections
+        self.signature = ('and',)
 
     def explain(self, tree):
         ''' Figure out which cut caused the And to fail '''
@@ -252,7 +360,11 @@ class Or(Selection):
                     return True
             return False
         super(Or, self).__init__(functor, "OR[%s]" % ' '.join(
-            [str(x) for x in selections]))
+            [str(x) for x in selections]),
+            _reduce_columnar(numpy.logical_or, selections),
+            _join_cpp('||', selections))
+        self.operands = selections
+        self.signature = ('or',)
 
 _operator_names = {
     operator.lt : '<',
@@ -270,8 +382,20 @@ class TwoValueOp(Selection):
         self.op = op
         def functor(tree):
             return op(getter1(tree), getter2(tree))
+        columnar = None
+        if val1.columnar is not None and val2.columnar is not None:
+            columnar1 = val1.columnar
+            columnar2 = val2.columnar
+            def columnar(columns):
+                return op(columnar1(columns), columnar2(columns))
+        cpp = None
+        if val1.cpp is not None and val2.cpp is not None:
+            cpp = "(%s %s %s)" % (val1.cpp, _operator_names[op], val2.cpp)
         repr = "%s %s %s" % (val1, _operator_names[op], val2)
-        super(TwoValueOp, self).__init__(functor, repr)
+        super(TwoValueOp, self).__init__(functor, repr, columnar, cpp)
+        self.operands = (val1, val2)
+        self.combine = op
+        self.signature = ('compare', op)
 
     def explain(self, tree):
         ''' Explain the result of this cut '''
@@ -287,8 +411,19 @@ class OneValueOp(Selection):
         self.op = op
         def functor(tree):
             return op(getter(tree), val2)
+        columnar = None
+        if val1.columnar is not None:
+            columnar1 = val1.columnar
+            def columnar(columns):
+                return op(columnar1(columns), val2)
+        cpp = None
+        if val1.cpp is not None:
+            cpp = "(%s %s %r)" % (val1.cpp, _operator_names[op], val2)
         repr = "%s %s %s" % (val1, _operator_names[op], str(val2))
-        super(OneValueOp, self).__init__(functor, repr)
+        super(OneValueOp, self).__init__(functor, repr, columnar, cpp)
+        self.operands = (val1,)
+        self.combine = lambda x: op(x, val2)
+        self.signature = ('compare', op, val2)
 
     def explain(self, tree):
         ''' Explain the result of this cut '''
@@ -297,10 +432,51 @@ class OneValueOp(Selection):
 
 class Value(object):
     ''' An object which can get a real value from a tree '''
-    def __init__(self, getter, repr=""):
+    # See Selection
+    operands = ()
+    combine = None
+    signature = None
+
+    def __init__(self, getter, repr="", columnar=None, cpp=None):
         # Initialize w/ functor to get value
         self.getter = getter
         self.repr = repr
+        # Functor to get an array of values from a dictionary of branch arrays
+        self.columnar = columnar
+        # Equivalent C++ expression string
+        self.cpp = cpp
+
+    def _derived_cpp(self, template):
+        ''' Make a C++ expression by formatting [template] with our own '''
+        if self.cpp is None:
+            return None
+        return template % self.cpp
+
+    def _combined_cpp(self, other, cpp_op):
+        ''' Make a C++ expression applying [cpp_op] to ours and [other]'s '''
+        if self.cpp is None:
+            return None
+        if isinstance(other, Value):
+            if other.cpp is None:
+                return None
+            return "(%s %s %s)" % (self.cpp, cpp_op, other.cpp)
+        return "(%s %s %r)" % (self.cpp, cpp_op, other)
+
+    def _derived_columnar(self, function):
+        ''' Make a columnar functor applying [function] to our own '''
+        if self.columnar is None:
+            return None
+        columnar = self.columnar
+        def derived(columns):
+            return function(columnar(columns))
+        return derived
+
+    def _derived(self, value, operands, combine, signature):
+        ''' Set the structure of a new [value] built from [operands] '''
+        value.operands = operands
+        value.combine = combine
+        value.signature = signature
+        return value
 
     def handle_op(self, other, the_op):
         if isinstance(other, Value):
@@ -325,13 +501,24 @@ class Value(object):
         def bit_getter(tree):
             value = int(self.getter(tree))
             return value & (1 << (n-1))
-        return Value(bit_getter, "%s.bit(%i)" % (repr(self), n))
+        def bit_columnar(values):
+            return numpy.bitwise_and(
+                numpy.asarray(values).astype(numpy.int64), 1 << (n-1))
+        return self._derived(
+            Value(bit_getter, "%s.bit(%i)" % (repr(self), n),
+                  self._derived_columnar(bit_columnar),
+                  self._derived_cpp("(int(%%s) & %i)" % (1 << (n-1)))),
+            (self,), lambda x: int(x) & (1 << (n-1)), ('bit', n))
 
     def __abs__(self):
         # Apply absolute value
         def abs_applyer(tree):
             return abs(self.getter(tree))
-        return Value(abs_applyer, "|%s|" % repr(self))
+        return self._derived(
+            Value(abs_applyer, "|%s|" % repr(self),
+                  self._derived_columnar(numpy.abs),
+                  self._derived_cpp("TMath::Abs(%s)")),
+            (self,), abs, ('abs',))
 
     def __sub__(self, other):
         # Subtract some other value
@@ -341,11 +528,19 @@ class Value(object):
         def subtractor_plain(tree):
             return self.getter(tree) - other
         if isinstance(other, Value):
-            return Value(subtractor_value,
-                         "%s - %s" % (repr(self), repr(other)))
+            return self._derived(
+                Value(subtractor_value,
+                      "%s - %s" % (repr(self), repr(other)),
+                      self._combined_columnar(other, operator.sub),
+                      self._combined_cpp(other, '-')),
+                (self, other), operator.sub, ('sub',))
         else:
-            return Value(subtractor_plain,
-                         "%s - %s" % (repr(self), repr(other)))
+            return self._derived(
+                Value(subtractor_plain,
+                      "%s - %s" % (repr(self), repr(other)),
+                      self._derived_columnar(lambda x: x - other),
+                      self._combined_cpp(other, '-')),
+                (self,), lambda x: x - other, ('sub', other))
 
     def __add__(self, other):
         # Subtract some other value
@@ -355,13 +550,44 @@ class Value(object):
         def adder_plain(tree):
             return self.getter(tree) + other
         if isinstance(other, Value):
-            return Value(adder_value, "%s + %s" % (repr(self), repr(other)))
+            return self._derived(
+                Value(adder_value, "%s + %s" % (repr(self), repr(other)),
+                      self._combined_columnar(other, operator.add),
+                      self._combined_cpp(other, '+')),
+                (self, other), operator.add, ('add',))
         else:
-            return Value(adder_plain, "%s + %s" % (repr(self), repr(other)))
+            return self._derived(
+                Value(adder_plain, "%s + %s" % (repr(self), repr(other)),
+                      self._derived_columnar(lambda x: x + other),
+                      self._combined_cpp(other, '+')),
+                (self,), lambda x: x + other, ('add', other))
+
+    def _combined_columnar(self, other, function):
+        ''' Make a columnar functor applying [function] to ours and [other]'s
+        '''
+        if self.columnar is None or other.columnar is None:
+            return None
+        columnar1 = self.columnar
+        columnar2 = other.columnar
+        def combined(columns):
+            return function(columnar1(columns), columnar2(columns))
+        return combined
 
     def __call__(self, tree):
         return self.getter(tree)
 
+    def evaluate_block(self, columns):
+        ''' Get the array of values for a dictionary of branch arrays '''
+        if self.columnar is None:
+            raise TypeError("%s can not be evaluated on columns" % repr(self))
+        return self.columnar(columns)
+
+    def to_cpp(self):
+        ''' Get the equivalent C++ expression of this value '''
+        if self.cpp is None:
+            raise TypeError("%s can not be converted to C++" % repr(self))
+        return self.cpp
+
     def __repr__(self):
         return self.repr
 
@@ -374,7 +600,10 @@ class Branch(Value):
         self.branch = branch
         def getter(tree):
             return getattr(tree, branch)
-        super(Branch, self).__init__(getter, repr="Branch('%s')" % self.branch)
+        def columnar(columns):
+            return columns[branch]
+        super(Branch, self).__init__(getter, repr="Branch('%s')" % self.branch,
+                                     columnar=columnar, cpp=branch)
 
 class MetaTree(object):
     def __init__(self):
@@ -387,6 +616,163 @@ class MetaTree(object):
         self.touched_branches.add(attr)
         return Branch(attr)
 
+_UNSET = object()
+
+class SelectionDAG(object):
+    ''' Evaluate many selections, sharing their common sub-expressions
+
+    Values and selections with the same structure (the same operations
+    applied to the same branches and constants) are merged into a single node,
+    which is evaluated at most once per entry.
+
+    '''
+    def __init__(self):
+        # List of (kind, payload, operand node indices)
+        self.nodes = []
+        self.node_index = {}
+        self.cache = []
+        self.current_entry = None
+
+    def _key(self, thing):
+        # The repr is ambiguous (it has no parentheses), so nodes are keyed
+        # by their structure.  Opaque selections (built from python
+        # functions) are only merged if they are the same object.
+        if isinstance(thing, Branch):
+            return ('branch', thing.branch)
+        if thing.operands:
+            return (type(thing).__name__, thing.signature,
+                    tuple(self._key(x) for x in thing.operands))
+        return ('opaque', id(thing))
+
+    def add(self, thing):
+        ''' Add a Value or Selection, and return its node index '''
+        key = self._key(thing)
+        if key in self.node_index:
+            return self.node_index[key]
+        operands = tuple(self.add(x) for x in thing.operands)
+        if isinstance(thing, And):
+            node = ('and', None, operands)
+        elif isinstance(thing, Or):
+            node = ('or', None, operands)
+        elif thing.operands:
+            node = ('combine', thing.combine, operands)
+        elif isinstance(thing, Value):
+            node = ('leaf', thing.getter, operands)
+        else:
+            node = ('leaf', thing.functor, operands)
+        self.nodes.append(node)
+        self.cache.append(_UNSET)
+        index = len(self.nodes) - 1
+        self.node_index[key] = index
+        return index
+
+    def start_entry(self, entry=None):
+        ''' Forget all cached results, unless [entry] is the current entry '''
+        if entry is None or entry != self.current_entry:
+            self.cache = [_UNSET] * len(self.nodes)
+            self.current_entry = entry
+
+    def evaluate(self, index, tree):
+        ''' Get the result of node [index], evaluating it if needed '''
+        result = self.cache[index]
+        if result is not _UNSET:
+            return result
+        kind, payload, operands = self.nodes[index]
+        if kind == 'and':
+            result = True
+            for operand in operands:
+                if not self.evaluate(operand, tree):
+                    result = False
+                    break
+        elif kind == 'or':
+            result = False
+            for operand in operands:
+                if self.evaluate(operand, tree):
+                    result = True
+                    break
+        elif kind == 'combine':
+            result = payload(*[self.evaluate(x, tree) for x in operands])
+        else:
+            result = payload(tree)
+        self.cache[index] = result
+        return result
+
+class RegionSet(object):
+    ''' Evaluate a set of (overlapping) region selections at once
+
+    >>> tree = MetaTree()
+    >>> iso = tree.muIso < 0.1
+    >>> vbf = tree.mjj > 500
+    >>> regions = RegionSet([
+    ...     ('os_iso_vbf', (tree.charge < 0) & iso & vbf),
+    ...     ('ss_iso_vbf', ~(tree.charge < 0) & iso & vbf),
+    ...     ('ss_iso', ~(tree.charge < 0) & (tree.muIso < 0.1)),
+    ... ])
+    >>> regions.names
+    ['os_iso_vbf', 'ss_iso_vbf', 'ss_iso']
+
+    The shared cuts are only evaluated once:
+
+    >>> len(regions.dag.nodes)
+    11
+
+    >>> class Row:
+    ...    pass
+    >>> row = Row()
+    >>> row.charge, row.muIso, row.mjj = 1, 0.05, 600
+    >>> regions(row)
+    [False, True, True]
+    >>> regions.passed(row)
+    ['ss_iso_vbf', 'ss_iso']
+
+    If the entry number is given, the results are cached until it changes.
+
+    >>> regions(row, entry=0)
+    [False, True, True]
+    >>> row.mjj = 100
+    >>> regions(row, entry=0)
+    [False, True, True]
+    >>> regions(row, entry=1)
+    [False, False, True]
+
+    Expressions which only differ by their grouping are kept apart:
+
+    >>> row.a, row.b, row.c = 10, 4, 3
+    >>> regions = RegionSet([
+    ...     ('left', (tree.a - tree.b) - tree.c > 5),
+    ...     ('right', tree.a - (tree.b - tree.c) > 5),
+    ... ])
+    >>> regions(row)
+    [False, True]
+    >>> regions = RegionSet([
+    ...     ('left', (tree.a - tree.b).bit(3) > 5),
+    ...     ('right', tree.a - tree.b.bit(3) > 5),
+    ... ])
+    >>> regions(row)
+    [False, True]
+
+    '''
+    def __init__(self, regions):
+        ''' [regions] is a list of (name, selection) or a dictionary '''
+        if isinstance(regions, dict):
+            regions = sorted(regions.items())
+        self.dag = SelectionDAG()
+        self.names = []
+        self.roots = []
+        for name, selection in regions:
+            self.names.append(name)
+            self.roots.append(self.dag.add(selection))
+
+    def __call__(self, tree, entry=None):
+        ''' Get the list of pass/fail results of each region '''
+        self.dag.start_entry(entry)
+        return [bool(self.dag.evaluate(root, tree)) for root in self.roots]
+
+    def passed(self, tree, entry=None):
+        ''' Get the names of the regions which pass '''
+        return [name for name, result in zip(self.names,
+                                             self(tree, entry)) if result]
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
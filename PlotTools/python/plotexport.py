@@ -0,0 +1,284 @@
+'''
+
+Export the contents of plots as numbers, for fast regression checks.
+
+Comparing two versions of an analysis by looking at (or diffing) thousands of
+PNGs is slow, and misses small changes.  Instead, the objects making up a plot
+- histograms, stacks, ratios and graphs (i.e. the limit bands) - can be
+exported with their bin edges, contents, errors and styles, and compared
+numerically.
+
+A plot is exported as an ordered dictionary of named entries.  Each entry is a
+flat dictionary with its 'type', 'title' and 'style', and arrays:
+
+    * histograms: 'edges' (one array per axis), 'contents' and 'errors',
+      including the under/overflows, in the ROOT global bin numbering.
+    * graphs: 'x', 'y', 'exl', 'exh', 'eyl' and 'eyh'.
+    * stacks: 'hists', the names of the histogram entries in the stack,
+      which are exported as <stack>/<hist>.
+
+Plots can be written as JSON (.json) or as compressed numpy arrays (.npz),
+which is faster to read for big plots.  Reading and comparing exports does
+not need ROOT.
+
+Example:
+
+    plot = export_objects([mc_stack, data, ratio])
+    write_plot(plot, 'mm-m1Pt.plot.json')
+
+    differences = compare_plots(read_plot('old/mm-m1Pt.plot.json'),
+                                read_plot('new/mm-m1Pt.plot.json'))
+
+The Plotter writes the exports with save(filename, export='json'), and
+compare_plot_exports.py compares two directories of them.
+
+'''
+
+from collections import OrderedDict
+import json
+import numpy
+
+# The entries of the export of a histogram or graph which are arrays
+ARRAY_FIELDS = set([
+    'contents', 'errors', 'x', 'y', 'exl', 'exh', 'eyl', 'eyh'])
+
+# Suffix of the exported files
+SUFFIXES = ('.plot.json', '.plot.npz')
+
+# Getter => style name, for the ROOT attributes
+_ROOT_STYLE = [
+    ('GetLineColor', 'linecolor'),
+    ('GetLineStyle', 'linestyle'),
+    ('GetLineWidth', 'linewidth'),
+    ('GetFillColor', 'fillcolor'),
+    ('GetFillStyle', 'fillstyle'),
+    ('GetMarkerColor', 'markercolor'),
+    ('GetMarkerStyle', 'markerstyle'),
+    ('GetMarkerSize', 'markersize'),
+]
+
+# Styles only known to rootpy
+_ROOTPY_STYLE = ['drawstyle', 'legendstyle']
+
+
+def get_style(obj):
+    ''' Get the drawing style of a ROOT object as a dictionary '''
+    style = {}
+    for getter, name in _ROOT_STYLE:
+        if hasattr(obj, getter):
+            style[name] = getattr(obj, getter)()
+    for name in _ROOTPY_STYLE:
+        value = getattr(obj, name, None)
+        if isinstance(value, basestring):
+            style[name] = value
+    return style
+
+
+def export_histogram(histo):
+    ''' Export a TH1 (or TH2/TH3) '''
+    import histarrays
+    return {
+        'type': histo.ClassName(),
+        'title': histo.GetTitle(),
+        'style': get_style(histo),
+        'edges': histarrays.all_edges(histo),
+        'contents': histarrays.get_contents(histo),
+        'errors': histarrays.get_errors(histo),
+    }
+
+
+def export_graph(graph):
+    ''' Export a TGraph, TGraphErrors or TGraphAsymmErrors '''
+    import histarrays
+    entry = {
+        'type': graph.ClassName(),
+        'title': graph.GetTitle(),
+        'style': get_style(graph),
+    }
+    entry.update(histarrays.graph_arrays(graph))
+    return entry
+
+
+def _unique_name(name, plot):
+    unique = name
+    copy = 1
+    while unique in plot:
+        copy += 1
+        unique = '%s#%i' % (name, copy)
+    return unique
+
+
+def add_object(plot, obj, name=None):
+    ''' Add the export of [obj] to [plot], if it is something we export
+
+    Returns the name of the entry, or None if [obj] was ignored.
+    '''
+    import ROOT
+    if name is None:
+        name = obj.GetName()
+    if isinstance(obj, ROOT.THStack):
+        name = _unique_name(name, plot)
+        entry = {'type': 'THStack', 'title': obj.GetTitle(), 'style': {},
+                 'hists': []}
+        plot[name] = entry
+        for histo in obj.GetHists():
+            entry['hists'].append(add_object(
+                plot, histo, '%s/%s' % (name, histo.GetName())))
+        return name
+    if isinstance(obj, ROOT.TH1):
+        entry = export_histogram(obj)
+    elif isinstance(obj, ROOT.TGraph):
+        entry = export_graph(obj)
+    else:
+        return None
+    name = _unique_name(name, plot)
+    plot[name] = entry
+    return name
+
+
+def export_objects(objects):
+    ''' Export a list of objects (or of tuples of objects) as a plot
+
+    Objects which aren't histograms, stacks or graphs (legends, text, lines
+    and functions) are skipped.
+    '''
+    plot = OrderedDict()
+    for obj in objects:
+        if isinstance(obj, (tuple, list)):
+            for item in obj:
+                add_object(plot, item)
+        else:
+            add_object(plot, obj)
+    return plot
+
+
+def _to_lists(value):
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_to_lists(x) for x in value]
+    return value
+
+
+def write_plot(plot, filename):
+    ''' Write an exported plot, as JSON or .npz depending on [filename] '''
+    if filename.endswith('.npz'):
+        # The arrays are stored flat as <entry>:<field>, and everything else
+        # as JSON in __meta__.
+        arrays = {}
+        meta = []
+        for name, entry in plot.iteritems():
+            fields = {}
+            for field, value in entry.iteritems():
+                if field in ARRAY_FIELDS:
+                    arrays['%s:%s' % (name, field)] = value
+                elif field == 'edges':
+                    fields['naxes'] = len(value)
+                    for i, edges in enumerate(value):
+                        arrays['%s:edges%i' % (name, i)] = edges
+                else:
+                    fields[field] = value
+            meta.append((name, fields))
+        arrays['__meta__'] = numpy.array(json.dumps(meta))
+        with open(filename, 'wb') as output:
+            numpy.savez_compressed(output, **arrays)
+    else:
+        with open(filename, 'w') as output:
+            json.dump([(name, dict(
+                (field, _to_lists(value)) for field, value in entry.iteritems()
+            )) for name, entry in plot.iteritems()], output)
+
+
+def read_plot(filename):
+    ''' Read a plot written by write_plot, with the arrays as numpy arrays '''
+    plot = OrderedDict()
+    if filename.endswith('.npz'):
+        arrays = numpy.load(filename)
+        for name, fields in json.loads(str(arrays['__meta__'])):
+            entry = dict(fields)
+            naxes = entry.pop('naxes', None)
+            if naxes is not None:
+                entry['edges'] = [arrays['%s:edges%i' % (name, i)]
+                                  for i in xrange(naxes)]
+            for field in ARRAY_FIELDS:
+                key = '%s:%s' % (name, field)
+                if key in arrays.files:
+                    entry[field] = arrays[key]
+            plot[name] = entry
+        arrays.close()
+    else:
+        with open(filename) as input:
+            for name, entry in json.load(input):
+                for field in ARRAY_FIELDS:
+                    if field in entry:
+                        entry[field] = numpy.array(entry[field], dtype=float)
+                if 'edges' in entry:
+                    entry['edges'] = [numpy.array(x, dtype=float)
+                                      for x in entry['edges']]
+                plot[name] = entry
+    return plot
+
+
+def _compare_arrays(what, reference, other, rtol, atol):
+    if reference.shape != other.shape:
+        return ['%s: %i values -> %i' % (what, reference.size, other.size)]
+    # NaNs (i.e. empty ratio bins) match each other
+    differ = ~numpy.isclose(other, reference, rtol=rtol, atol=atol,
+                            equal_nan=True)
+    if not differ.any():
+        return []
+    with numpy.errstate(invalid='ignore'):
+        difference = numpy.abs(other - reference)
+    # A NaN on one side only is the worst difference
+    difference[numpy.isnan(difference)] = numpy.inf
+    difference[~differ] = 0.
+    worst = numpy.argmax(difference)
+    return ['%s: %i values differ, worst [%i] %g -> %g' % (
+        what, numpy.count_nonzero(differ),
+        worst, reference.flat[worst], other.flat[worst])]
+
+
+def compare_plots(reference, other, rtol=1e-6, atol=1e-12, styles=True):
+    ''' Compare two exported plots
+
+    Returns a list of the differences as strings - empty if they match
+    within the tolerances.
+    '''
+    differences = []
+    for name in reference:
+        if name not in other:
+            differences.append('%s: missing' % name)
+    for name in other:
+        if name not in reference:
+            differences.append('%s: new' % name)
+    for name, ref_entry in reference.iteritems():
+        entry = other.get(name)
+        if entry is None:
+            continue
+        for field in ['type', 'title', 'hists']:
+            if ref_entry.get(field) != entry.get(field):
+                differences.append('%s: %s %r -> %r' % (
+                    name, field, ref_entry.get(field), entry.get(field)))
+        if styles and ref_entry.get('style') != entry.get('style'):
+            differences.append('%s: style %r -> %r' % (
+                name, ref_entry.get('style'), entry.get('style')))
+        ref_edges = ref_entry.get('edges', [])
+        edges = entry.get('edges', [])
+        if len(ref_edges) != len(edges):
+            differences.append('%s: %i axes -> %i' % (
+                name, len(ref_edges), len(edges)))
+            continue
+        for i, (ref_axis, axis) in enumerate(zip(ref_edges, edges)):
+            differences.extend(_compare_arrays(
+                '%s: edges of axis %i' % (name, i), ref_axis, axis,
+                rtol, atol))
+        for field in sorted(ARRAY_FIELDS):
+            if field in ref_entry and field in entry:
+                differences.extend(_compare_arrays(
+                    '%s: %s' % (name, field), ref_entry[field], entry[field],
+                    rtol, atol))
+    return differences
+
+
+def is_export(filename):
+    return filename.endswith(SUFFIXES)
@@ -0,0 +1,121 @@
+'''
+
+Build Cython tree proxies on demand, in a cache keyed by the tree schema.
+
+The proxy built by make_cython_proxy.py is only valid for the tree schema
+(branch names and types) it was generated from.  Here the schema of a template
+file is hashed (along with the proxy generator itself), and the compiled proxy
+is stored in::
+
+    $MEGA_PROXY_CACHE/<ClassName>-<hash>/ClassName.so
+
+If it doesn't exist yet, it is generated and compiled.  The build is protected
+by a file lock, so concurrent jobs wait for the first one to finish instead of
+building it again.  A successful build is marked by a build.done file, which is
+written last (under the lock), so a half written or failed build is never used.
+
+Example::
+
+    from FinalStateAnalysis.PlotTools.proxycache import use_proxy
+    use_proxy('MuMuTree', 'some_file.root', 'mm/final/Ntuple')
+    # The proxy matching the file is now first in sys.path
+    from MuMuTree import MuMuTree
+
+'''
+
+from distutils.spawn import find_executable
+import fcntl
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE = os.environ.get(
+    'MEGA_PROXY_CACHE', os.path.expanduser('~/.mega_proxy_cache'))
+
+GENERATOR = 'make_cython_proxy.py'
+
+
+def tree_schema(file_name, tree_path):
+    ''' Get the list of (name, type, class) of the branches of a tree '''
+    import ROOT
+    file = ROOT.TFile.Open(file_name, 'READ')
+    if not file:
+        raise IOError("Can't open ROOT file: %s" % file_name)
+    tree = file.Get(tree_path)
+    if not tree:
+        raise IOError("Can't get tree: %s from file: %s" %
+                      (tree_path, file_name))
+    schema = [(branch.GetName(), branch.GetTitle(), branch.GetClassName())
+              for branch in tree.GetListOfBranches()]
+    file.Close()
+    return schema
+
+
+def schema_hash(class_name, schema):
+    ''' Hash the schema, the class name, and the proxy generator '''
+    hash = hashlib.md5(class_name)
+    for name, title, branch_class in schema:
+        hash.update('%s:%s:%s;' % (name, title, branch_class))
+    # Rebuild if the generator changes
+    generator = find_executable(GENERATOR)
+    if generator:
+        with open(generator) as generator_file:
+            hash.update(generator_file.read())
+    return hash.hexdigest()
+
+
+def build_proxy(class_name, template_file, tree_path, build_dir):
+    ''' Generate and compile the proxy in [build_dir] '''
+    log.info("Building proxy %s in %s", class_name, build_dir)
+    subprocess.check_call(
+        [GENERATOR, template_file, tree_path, class_name], cwd=build_dir)
+    subprocess.check_call(
+        [sys.executable, '%s_setup.py' % class_name, 'build_ext', '--inplace'],
+        cwd=build_dir)
+
+
+def get_proxy_dir(class_name, template_file, tree_path,
+                  cache_dir=DEFAULT_CACHE):
+    ''' Get the directory holding the proxy for this schema
+
+    The proxy is built if it is not in the cache yet.
+
+    '''
+    key = schema_hash(class_name, tree_schema(template_file, tree_path))
+    proxy_dir = os.path.join(cache_dir, '%s-%s' % (class_name, key))
+    # build_ext writes the library in place, so only trust it once the build
+    # is marked as done.
+    done = os.path.join(proxy_dir, 'build.done')
+    if os.path.exists(done):
+        log.info("Found cached proxy in %s", proxy_dir)
+        return proxy_dir
+    if not os.path.exists(proxy_dir):
+        try:
+            os.makedirs(proxy_dir)
+        except OSError:
+            # Someone else made it in the meantime
+            if not os.path.isdir(proxy_dir):
+                raise
+    with open(os.path.join(proxy_dir, 'build.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Check if someone else built it while we were waiting
+            if not os.path.exists(done):
+                build_proxy(class_name, template_file, tree_path, proxy_dir)
+                open(done, 'w').close()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return proxy_dir
+
+
+def use_proxy(class_name, template_file, tree_path, cache_dir=DEFAULT_CACHE):
+    ''' Make the proxy matching [template_file] importable as [class_name]
+    '''
+    proxy_dir = get_proxy_dir(class_name, template_file, tree_path, cache_dir)
+    if proxy_dir not in sys.path:
+        sys.path.insert(0, proxy_dir)
+    return proxy_dir
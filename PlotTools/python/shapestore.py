@@ -0,0 +1,220 @@
+'''
+
+A persistent, incrementally updated copy of the histograms in a shape file.
+
+Shape files (as used by the datacards) contain one directory per category,
+with histograms named <process><mass>[_<systematic>] - i.e. "ggH125",
+"ggH125_CMS_scale_tUp", "Ztt_CMS_scale_tDown" or "data_obs".
+
+The ShapeStore keeps the histograms of each category in its own small ROOT
+file, with an index giving the (process, systematic, mass) and a hash of the
+bin contents of each histogram.  When the shape file changes (by mtime and
+size), update() reads it again, but only the categories whose histograms
+actually changed are rewritten, and returned, so that only they need to be
+processed again downstream.
+
+The store can be used in place of the shape file by rootpy views, as it has
+a Get(path) method::
+
+    store = ShapeStore('shapes.root')
+    changed = store.update()
+    histo = store.Get('mmt_high/ggH125')
+    view = views.SubdirectoryView(store, 'mmt_high')
+
+By default the store is kept in the shapes.root.store directory.
+
+'''
+
+import hashlib
+import json
+import logging
+import os
+import re
+import ROOT
+try:
+    from rootpy.utils import asrootpy
+except ImportError:
+    from rootpy import asrootpy
+import histarrays
+
+log = logging.getLogger(__name__)
+
+_shape_name = re.compile(
+    r'^(?P<process>.+?)(?P<mass>\d+(\.\d+)?)?'
+    r'(_(?P<systematic>CMS_.*))?$')
+
+
+def parse_shape_name(name):
+    ''' Get the (process, systematic, mass) of a shape histogram name
+
+    >>> parse_shape_name('ggH125_CMS_scale_tUp')
+    ('ggH', 'CMS_scale_tUp', '125')
+    >>> parse_shape_name('Ztt')
+    ('Ztt', None, None)
+    >>> parse_shape_name('ZZ_CMS_fake_tDown')
+    ('ZZ', 'CMS_fake_tDown', None)
+    >>> parse_shape_name('data_obs')
+    ('data_obs', None, None)
+    '''
+    match = _shape_name.match(name)
+    return match.group('process'), match.group('systematic'), \
+        match.group('mass')
+
+
+def content_hash(histo):
+    ''' Hash of the binning and bin contents of a histogram '''
+    hash = hashlib.md5(histo.ClassName())
+    for edges in histarrays.all_edges(histo):
+        hash.update(edges.data)
+    hash.update(histarrays.get_contents(histo).data)
+    hash.update(histarrays.get_sumw2(histo).data)
+    return hash.hexdigest()
+
+
+class _CategoryView(object):
+    ''' What ShapeStore.Get returns for a category '''
+    def __init__(self, store, category):
+        self.store = store
+        self.category = category
+
+    def Get(self, name):
+        return self.store.Get(os.path.join(self.category, name))
+
+
+class ShapeStore(object):
+    def __init__(self, shape_file, store_dir=None):
+        self.shape_file = shape_file
+        self.store_dir = store_dir or shape_file + '.store'
+        self.index_file = os.path.join(self.store_dir, 'index.json')
+        self.index = {'source': None, 'categories': {}}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as index:
+                self.index = json.load(index)
+        # Opened category files
+        self.files = {}
+
+    def _source_stat(self):
+        stat = os.stat(self.shape_file)
+        return [stat.st_mtime, stat.st_size]
+
+    def _category_file(self, category):
+        return os.path.join(
+            self.store_dir, category.replace('/', '_') + '.root')
+
+    def up_to_date(self):
+        return self.index['source'] == self._source_stat()
+
+    def update(self):
+        ''' Bring the store up to date with the shape file
+
+        Returns the list of categories which changed.
+        '''
+        if self.up_to_date():
+            return []
+        log.info("Updating shape store %s", self.store_dir)
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        self.close()
+        source = ROOT.TFile.Open(self.shape_file, 'READ')
+        if not source:
+            raise IOError("Can't open ROOT file: %s" % self.shape_file)
+        changed = []
+        found = set()
+        for key in source.GetListOfKeys():
+            category = key.GetName()
+            directory = key.ReadObj()
+            if not isinstance(directory, ROOT.TDirectory):
+                continue
+            found.add(category)
+            if self._update_category(category, directory):
+                changed.append(category)
+        source.Close()
+        # Categories which were removed from the shape file
+        for category in set(self.index['categories'].keys()) - found:
+            del self.index['categories'][category]
+            if os.path.exists(self._category_file(category)):
+                os.remove(self._category_file(category))
+            changed.append(category)
+        self.index['source'] = self._source_stat()
+        with open(self.index_file, 'w') as index:
+            json.dump(self.index, index, indent=2)
+        log.info("Changed categories: %s", ', '.join(changed))
+        return changed
+
+    def _update_category(self, category, directory):
+        ''' Rewrite the category if needed, returns True if it changed '''
+        histos = {}
+        entries = {}
+        for key in directory.GetListOfKeys():
+            histo = key.ReadObj()
+            if not isinstance(histo, ROOT.TH1):
+                continue
+            histo.SetDirectory(0)
+            name = key.GetName()
+            process, systematic, mass = parse_shape_name(name)
+            histos[name] = histo
+            entries[name] = {
+                'process': process,
+                'systematic': systematic,
+                'mass': mass,
+                'hash': content_hash(histo),
+            }
+        old_entries = self.index['categories'].get(category, {}).get(
+            'entries', {})
+        if old_entries == entries and os.path.exists(
+                self._category_file(category)):
+            return False
+        log.info("Rewriting category %s", category)
+        output = ROOT.TFile(self._category_file(category), 'RECREATE')
+        for name, histo in histos.iteritems():
+            output.WriteTObject(histo, name)
+        output.Close()
+        self.index['categories'][category] = {'entries': entries}
+        return True
+
+    def categories(self):
+        return sorted(self.index['categories'].keys())
+
+    def entries(self, category):
+        ''' Get {name : {process, systematic, mass, hash}} for a category '''
+        return self.index['categories'][category]['entries']
+
+    def keys(self, category):
+        return sorted(self.entries(category).keys())
+
+    def find(self, category, process, systematic=None, mass=None):
+        ''' Get the name of the histogram for a (process, systematic, mass) '''
+        for name, entry in self.entries(category).iteritems():
+            if (entry['process'], entry['systematic'], entry['mass']) == (
+                    process, systematic, mass):
+                return name
+        return None
+
+    def category_hash(self, category):
+        ''' A hash of all the histograms in a category '''
+        hash = hashlib.md5(category)
+        for name, entry in sorted(self.entries(category).iteritems()):
+            hash.update('%s:%s;' % (name, entry['hash']))
+        return hash.hexdigest()
+
+    def Get(self, path):
+        ''' Get a histogram as category/name, or a category
+
+        Returns None if it doesn't exist, like TDirectory::Get
+        '''
+        if path in self.index['categories']:
+            return _CategoryView(self, path)
+        category, name = os.path.split(path)
+        if category not in self.index['categories']:
+            return None
+        if name not in self.entries(category):
+            return None
+        if category not in self.files:
+            self.files[category] = ROOT.TFile.Open(
+                self._category_file(category), 'READ')
+        return asrootpy(self.files[category].Get(name))
+
+    def close(self):
+        for file in self.files.itervalues():
+            file.Close()
+        self.files = {}
@@ -0,0 +1,73 @@
+#! /bin/env python
+
+'''
+
+Compare two directories of plot exports (see PlotTools/python/plotexport.py)
+
+Every .plot.json/.plot.npz file in the reference directory is compared to the
+file with the same relative path in the other one.  The differences are
+printed, and the exit code is 1 if there are any.
+
+'''
+
+import logging
+import os
+import sys
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+from RecoLuminosity.LumiDB import argparse
+from FinalStateAnalysis.PlotTools import plotexport
+
+log = logging.getLogger("compare_plot_exports")
+
+
+def find_exports(directory):
+    ''' Get the paths of all the exports in [directory], relative to it '''
+    found = set()
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            if plotexport.is_export(filename):
+                found.add(os.path.relpath(
+                    os.path.join(dirpath, filename), directory))
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('reference', help='Directory of reference exports')
+    parser.add_argument('other', help='Directory of exports to check')
+    parser.add_argument('--rtol', type=float, default=1e-6,
+                        help='Relative tolerance. Default: %(default)g')
+    parser.add_argument('--atol', type=float, default=1e-12,
+                        help='Absolute tolerance. Default: %(default)g')
+    parser.add_argument('--no-styles', dest='styles', action='store_false',
+                        help="Don't compare the styles")
+    parser.add_argument('--max-lines', type=int, default=10,
+                        help='Maximum differences shown for each plot.'
+                        ' Default: %(default)i')
+    args = parser.parse_args()
+
+    reference = find_exports(args.reference)
+    other = find_exports(args.other)
+
+    failed = 0
+    for path in sorted(reference - other):
+        log.error("%s: missing", path)
+        failed += 1
+    for path in sorted(other - reference):
+        log.warning("%s: new plot", path)
+
+    for path in sorted(reference & other):
+        differences = plotexport.compare_plots(
+            plotexport.read_plot(os.path.join(args.reference, path)),
+            plotexport.read_plot(os.path.join(args.other, path)),
+            rtol=args.rtol, atol=args.atol, styles=args.styles)
+        if not differences:
+            continue
+        failed += 1
+        log.error("%s: %i differences", path, len(differences))
+        for difference in differences[:args.max_lines]:
+            log.error("    %s", difference)
+        if len(differences) > args.max_lines:
+            log.error("    ...")
+
+    log.info("Compared %i plots, %i differ", len(reference), failed)
+    sys.exit(1 if failed else 0)
@@ -4,7 +4,24 @@
 Generate a Cython .pyx TTree proxy and its associated
 setup.py build file.
 
-Currently only simple, single types (I, F) are supported.
+Simple, single types (I, F, D, i), fixed and variable length arrays of them,
+and std::vector<float/int/double> branches are supported.  Array branches are
+returned as python lists.
+
+For bulk reads, the proxy has a fill_arrays(start, stop, branches) method
+which reads the scalar [branches] for entries [start, stop) into numpy arrays,
+looping over the entries in C.
+
+If the proxy is built with autodisable=N, after iterating over the first N
+entries all branches which were not accessed are disabled, and the accessed
+ones are registered in the TTreeCache::
+
+    proxy = ClassName(tree, autodisable=100)
+
+A disabled branch can't be read (TBranch::GetEntry leaves the old value), so a
+branch which is first accessed after entry N is enabled again, and added to
+the TTreeCache, before it is read.  This costs a cache miss for the rest of
+the cluster, so N should cover all the branches the selector reads.
 
 usage::
     make_cython_proxy.py [-h] template_file.root tree_path ClassName
@@ -35,10 +52,18 @@ cdef extern from "TObject.h":
     cdef cppclass TObject:
         pass
 
+cdef extern from "TLeaf.h":
+    cdef cppclass TLeaf:
+        int GetLen()
+        int GetLenStatic()
+        int GetMaximum()
+        TLeaf* GetLeafCount()
+
 cdef extern from "TBranch.h":
     cdef cppclass TBranch:
         int GetEntry(long, int)
         void SetAddress(void*)
+        TLeaf* GetLeaf(char*)
 
 cdef extern from "TTree.h":
     cdef cppclass TTree:
@@ -49,6 +74,9 @@ cdef extern from "TTree.h":
         TTree* GetTree()
         int GetTreeNumber()
         TBranch* GetBranch(char*)
+        void SetBranchStatus(char*, bint, unsigned int*)
+        int AddBranchToCache(char*, bint)
+        int StopCacheLearningPhase()
 
 cdef extern from "TFile.h":
     cdef cppclass TFile:
@@ -64,6 +92,9 @@ cdef extern from "TTreeFormula.h":
         void SetTree(TTree*)
 
 from cpython cimport PyCObject_AsVoidPtr
+from libc.stdlib cimport malloc, free
+from libcpp.vector cimport vector
+import numpy
 import warnings
 def my_warning_format(message, category, filename, lineno, line=""):
     return "%s:%s\\n" % (category.__name__, message)
@@ -79,20 +110,31 @@ cdef class {TreeName}:
     cdef long localentry
     # Keep track of missing branches we have complained about.
     cdef public set complained
+    # Disable untouched branches after this many entries (if non-zero)
+    cdef long autodisable
+    # True once the untouched branches have been disabled
+    cdef bint disabled
 
     # Branches and address for all
 {branchblock}
 
-    def __cinit__(self, ttree):
+    def __cinit__(self, ttree, long autodisable=0):
         #print "cinit"
         # Constructor from a ROOT.TTree
         from ROOT import AsCObject
         self.tree = <TTree*>PyCObject_AsVoidPtr(AsCObject(ttree))
         self.ientry = 0
         self.currentTreeNumber = -1
+        self.autodisable = autodisable
+        self.disabled = False
         #print self.tree.GetEntries()
         #self.load_entry(0)
         self.complained = set([])
+{initblock}
+
+    def __dealloc__(self):
+{deallocblock}
+        pass
 
     cdef load_entry(self, long i):
         #print "load", i
@@ -111,6 +153,7 @@ cdef class {TreeName}:
 
     cdef setup_branches(self, TTree* the_tree):
         #print "setup"
+        cdef int maxlen
 {setbranchesblock}
 
     # Iterating over the tree
@@ -120,6 +163,63 @@ cdef class {TreeName}:
             self.load_entry(self.ientry)
             yield self
             self.ientry += 1
+            if self.autodisable and self.ientry == self.autodisable:
+                self.disable_untouched()
+
+    # Branches which have been accessed so far
+    def touched_branches(self):
+        touched = []
+{touchedblock}
+        return touched
+
+    # Turn off all the branches which haven't been accessed, and add the
+    # ones which have to the TTreeCache.
+    def disable_untouched(self):
+        touched = self.touched_branches()
+        self.tree.SetBranchStatus("*", 0, NULL)
+        for name in touched:
+            self.tree.SetBranchStatus(name, 1, NULL)
+            self.tree.AddBranchToCache(name, True)
+        self.tree.StopCacheLearningPhase()
+        self.disabled = True
+        return touched
+
+    # Turn a branch disabled by disable_untouched back on
+    cdef enable_branch(self, char* name):
+        self.tree.SetBranchStatus(name, 1, NULL)
+        self.tree.AddBranchToCache(name, True)
+
+    # Read a scalar branch by index, for the current entry
+    cdef double read_scalar(self, int index):
+{readscalarblock}
+        return 0
+
+    # Read the scalar [branches] for the entries [start, stop) into numpy
+    # arrays.  Returns a dictionary of {{branch : array}}.
+    def fill_arrays(self, long start, long stop, branches):
+        cdef long i
+        cdef int index
+        cdef double[:] view
+        stop = min(stop, self.tree.GetEntries())
+        stop = max(start, stop)
+        output = {{}}
+        # Loop over one branch at a time, so the reads stay within the same
+        # baskets.
+        for branch in branches:
+            if branch not in _scalar_indices:
+                raise KeyError(
+                    "fill_arrays only supports scalar branches, not %s" % branch)
+            index = _scalar_indices[branch]
+            array = numpy.empty(stop - start, dtype=numpy.float64)
+            view = array
+            for i in range(start, stop):
+                self.load_entry(i)
+                view[i - start] = self.read_scalar(index)
+            output[branch] = array
+        # Go back to where we were
+        if stop > start and self.ientry < self.tree.GetEntries():
+            self.load_entry(self.ientry)
+        return output
 
     # Iterate over rows which pass the filter
     def where(self, filter):
@@ -151,6 +251,9 @@ cdef class {TreeName}:
     # Access to the current branch values
 {getbranchesblock}
 
+# Index of each scalar branch, used by fill_arrays
+_scalar_indices = {scalarindices}
+
 '''
 
 _setup_template = '''
@@ -175,9 +278,15 @@ def get_branches(tree):
 
     Returns a generator of tuples with format:
 
-        [ (branchname, type), ... ]
+        [ (branchname, kind, type, size), ... ]
 
-    Where type is 'F' for float, 'I' for int, etc.
+    Where type is the C++ type ('float', 'int', etc), and kind is one of:
+
+        'scalar':   a single value, size is None
+        'fixed':    a fixed length array, size is the length
+        'variable': a variable length array, size is the name of the branch
+                    holding the length
+        'vector':   a std::vector<type>, size is None
 
     '''
     type_map = {
@@ -186,17 +295,145 @@ def get_branches(tree):
         'D': 'double',
         'i': 'long',
     }
+    vector_type_map = {
+        'vector<float>': 'float',
+        'vector<int>': 'int',
+        'vector<double>': 'double',
+    }
 
     for branch in tree.GetListOfBranches():
         name = branch.GetName()
+        class_name = branch.GetClassName()
+        if class_name:
+            if class_name not in vector_type_map:
+                raise TypeError(
+                    "I don't understand branch class: %s" % class_name)
+            yield name, 'vector', vector_type_map[class_name], None
+            continue
         type = branch.GetTitle()
         # Clean out the leaflist syntax
-        type = type.replace(name, '')
+        type = type.replace(name, '', 1)
         type = type.replace('/', '')
+        kind = 'scalar'
+        size = None
+        # Array leaves look like name[N]/F or name[nCounter]/F
+        if type.startswith('['):
+            size, type = type[1:].split(']', 1)
+            if size.isdigit():
+                kind = 'fixed'
+                size = int(size)
+            else:
+                kind = 'variable'
         if type not in type_map:
             raise TypeError(
                 "I don't understand branch type: %s" % type)
-        yield name, type_map[type]
+        yield name, kind, type_map[type], size
+
+
+_missing_branch_template = '''
+        #print "making {branchname}"
+        self.{branchname}_branch = the_tree.GetBranch("{branchname}")
+        #if not self.{branchname}_branch and "{branchname}" not in self.complained:
+        if not self.{branchname}_branch and "{branchname}":
+            warnings.warn( "{TreeName}: Expected branch {branchname} does not exist!" \\
+               " It will crash if you try and use it!",Warning)
+            #self.complained.add("{branchname}")
+        else:
+'''
+
+# Mark a branch as accessed.  If it was disabled by disable_untouched, it
+# must be enabled again to be read.
+_touch_template = '''
+            if not self.{branchname}_touched:
+                self.{branchname}_touched = True
+                if self.disabled:
+                    self.enable_branch("{branchname}")
+'''[1:]
+
+# The branch with the size of a variable length array is needed as well
+_touch_size_template = '''
+                    self.enable_branch("{size}")
+'''[1:]
+
+# Declaration of the data members, setting of the branch address, and the
+# property returning the value for each kind of branch.
+_branch_templates = {
+    'scalar': (
+'''
+    cdef TBranch* {branchname}_branch
+    cdef {branchtype} {branchname}_value
+    cdef bint {branchname}_touched
+''',
+'''
+            self.{branchname}_branch.SetAddress(<void*>&self.{branchname}_value)
+''',
+'''
+    property {branchname}:
+        def __get__(self):
+{touch}            self.{branchname}_branch.GetEntry(self.localentry, 0)
+            return self.{branchname}_value
+'''),
+    'fixed': (
+'''
+    cdef TBranch* {branchname}_branch
+    cdef {branchtype} {branchname}_value[{size}]
+    cdef bint {branchname}_touched
+''',
+'''
+            self.{branchname}_branch.SetAddress(<void*>self.{branchname}_value)
+''',
+'''
+    property {branchname}:
+        def __get__(self):
+{touch}            self.{branchname}_branch.GetEntry(self.localentry, 0)
+            cdef int i
+            return [self.{branchname}_value[i] for i in range({size})]
+'''),
+    # The buffer is resized for each new tree, to fit the biggest array
+    # seen when the tree was written.
+    'variable': (
+'''
+    cdef TBranch* {branchname}_branch
+    cdef TLeaf* {branchname}_leaf
+    cdef {branchtype}* {branchname}_value
+    cdef int {branchname}_size
+    cdef bint {branchname}_touched
+''',
+'''
+            self.{branchname}_leaf = self.{branchname}_branch.GetLeaf("{branchname}")
+            maxlen = self.{branchname}_leaf.GetLeafCount().GetMaximum() * \\
+                self.{branchname}_leaf.GetLenStatic()
+            if maxlen > self.{branchname}_size:
+                free(self.{branchname}_value)
+                self.{branchname}_value = <{branchtype}*>malloc(
+                    maxlen * sizeof({branchtype}))
+                self.{branchname}_size = maxlen
+            self.{branchname}_branch.SetAddress(<void*>self.{branchname}_value)
+''',
+'''
+    property {branchname}:
+        def __get__(self):
+{touch}            self.{branchname}_branch.GetEntry(self.localentry, 0)
+            cdef int i
+            cdef int n = self.{branchname}_leaf.GetLen()
+            return [self.{branchname}_value[i] for i in range(n)]
+'''),
+    'vector': (
+'''
+    cdef TBranch* {branchname}_branch
+    cdef vector[{branchtype}]* {branchname}_value
+    cdef bint {branchname}_touched
+''',
+'''
+            self.{branchname}_branch.SetAddress(<void*>&self.{branchname}_value)
+''',
+'''
+    property {branchname}:
+        def __get__(self):
+{touch}            self.{branchname}_branch.GetEntry(self.localentry, 0)
+            return self.{branchname}_value[0]
+'''),
+}
 
 
 def make_pyx(name, tree):
@@ -204,54 +441,90 @@ def make_pyx(name, tree):
     branchblock = cStringIO.StringIO()
     setbranchesblock = cStringIO.StringIO()
     getbranchesblock = cStringIO.StringIO()
+    initblock = cStringIO.StringIO()
+    deallocblock = cStringIO.StringIO()
+    touchedblock = cStringIO.StringIO()
+    readscalarblock = cStringIO.StringIO()
+    scalar_indices = {}
 
     # Declare data members & methods for each branch.
-    for branch_name, branch_type in get_branches(tree):
+    for branch_name, kind, branch_type, size in get_branches(tree):
+        format_args = dict(branchname=branch_name, branchtype=branch_type,
+                           size=size, TreeName=name)
+        touch = _touch_template.format(**format_args)
+        if kind == 'variable':
+            touch += _touch_size_template.format(**format_args)
+        format_args['touch'] = touch
+        declaration, set_address, getter = _branch_templates[kind]
         # We need both a pointer to the TBranch, and
         # an owned C++ type (int, float, etc) that the TBranch
         # will point too.
-        branchblock.write(
-'''
-    cdef TBranch* {branchname}_branch
-    cdef {branchtype} {branchname}_value
-'''.format(branchname=branch_name, branchtype=branch_type)
-        )
+        branchblock.write(declaration.format(**format_args))
 
         # Initialize the branch members.  The branch pointer
         # is loaded from the tree, and the branch address
         # is set to the owned value object.
-        setbranchesblock.write(
-'''
-        #print "making {branchname}"
-        self.{branchname}_branch = the_tree.GetBranch("{branchname}")
-        #if not self.{branchname}_branch and "{branchname}" not in self.complained:
-        if not self.{branchname}_branch and "{branchname}":
-            warnings.warn( "{TreeName}: Expected branch {branchname} does not exist!" \
-               " It will crash if you try and use it!",Warning)
-            #self.complained.add("{branchname}")
-        else:
-            self.{branchname}_branch.SetAddress(<void*>&self.{branchname}_value)
-'''.format(branchname=branch_name, branchtype=branch_type, TreeName=name)
-        )
+        setbranchesblock.write(_missing_branch_template.format(**format_args))
+        setbranchesblock.write(set_address.format(**format_args))
+
         # Define a property for each branch.
         # When the attribute is gotten, it will call
         # GetEntry on the branch to load the information
         # into the value, and then return the value.
         # Note that the entry number is available/set via
         # the class member ientry.
-        getbranchesblock.write(
-'''
-    property {branchname}:
-        def __get__(self):
-            self.{branchname}_branch.GetEntry(self.localentry, 0)
-            return self.{branchname}_value
-'''.format(branchname=branch_name, branchtype=branch_type)
-        )
+        getbranchesblock.write(getter.format(**format_args))
+
+        # Keep track of which branches are used.  For variable length
+        # arrays, the branch with the size is needed as well.
+        touchedblock.write(
+            '''        if self.{branchname}_touched:\n'''
+            '''            touched.append("{branchname}")\n'''.format(
+                **format_args))
+        if kind == 'variable':
+            touchedblock.write(
+                '''            touched.append("{size}")\n'''.format(
+                    **format_args))
+
+        # Memory management for arrays and vectors
+        if kind == 'variable':
+            initblock.write(
+                '''        self.{branchname}_value = NULL\n'''
+                '''        self.{branchname}_size = 0\n'''.format(
+                    **format_args))
+            deallocblock.write(
+                '''        free(self.{branchname}_value)\n'''.format(
+                    **format_args))
+        elif kind == 'vector':
+            initblock.write(
+                '''        self.{branchname}_value = new vector[{branchtype}]()\n'''.format(
+                    **format_args))
+            deallocblock.write(
+                '''        del self.{branchname}_value\n'''.format(
+                    **format_args))
+
+        # Bulk reading of scalars
+        if kind == 'scalar':
+            index = len(scalar_indices)
+            scalar_indices[branch_name] = index
+            readscalarblock.write(
+                '''        {keyword} index == {index}:\n'''
+                '''{touch}'''
+                '''            self.{branchname}_branch.GetEntry(self.localentry, 0)\n'''
+                '''            return self.{branchname}_value\n'''.format(
+                    keyword='if' if not index else 'elif', index=index,
+                    **format_args))
+
     return _pyx_template.format(
         TreeName=name,
         branchblock=branchblock.getvalue(),
         setbranchesblock=setbranchesblock.getvalue(),
-        getbranchesblock=getbranchesblock.getvalue()
+        getbranchesblock=getbranchesblock.getvalue(),
+        initblock=initblock.getvalue(),
+        deallocblock=deallocblock.getvalue(),
+        touchedblock=touchedblock.getvalue(),
+        readscalarblock=readscalarblock.getvalue(),
+        scalarindices=repr(scalar_indices),
     )
 
 if __name__ == "__main__":
@@ -17,6 +17,8 @@ import sys
 from FinalStateAnalysis.PlotTools.ChainProcessor import ChainProcessor
 from FinalStateAnalysis.PlotTools.Dispatcher import MegaDispatcher
 from FinalStateAnalysis.PlotTools.MegaPath import find_input_files
+from FinalStateAnalysis.PlotTools import proxycache
+from FinalStateAnalysis.PlotTools import megaio
 
 log = multiprocessing.log_to_stderr()
 log.setLevel(logging.WARNING)
@@ -59,6 +61,67 @@ if __name__ == "__main__":
     parser.add_argument('--chain', type=int, required=False,
                         default=1, help='Number of files to chain together')
 
+    parser.add_argument('--shard-size', type=int, required=False,
+                        dest='shard_size', default=0,
+                        help='Split the input files into shards of this many '
+                        'entries.  The selector must loop over entry_range().'
+                        ' Overrides --chain. (def: 0 - whole files)')
+
+    parser.add_argument('--merge-fanin', type=int, required=False,
+                        dest='merge_fanin', default=0,
+                        help='Merge the outputs as a tree, this many files at '
+                        'a time (def: 0 - serial merging)')
+
+    parser.add_argument('--mergers', type=int, required=False, default=2,
+                        help='Number of merge processes when using '
+                        '--merge-fanin (def: 2)')
+
+    parser.add_argument('--histos-only', action='store_true',
+                        dest='histos_only',
+                        help='The outputs contain only histograms, sum them '
+                        'in memory when using --merge-fanin')
+
+    parser.add_argument('--accumulate', action='store_true',
+                        help='Sum the booked histograms in memory in each '
+                        'worker, instead of writing and merging a file for '
+                        'each input.  Only MegaBase.book-ed histograms are '
+                        'kept.')
+
+    parser.add_argument('--proxy', metavar='ClassName', type=str, default='',
+                        help='Use (and build if needed) the Cython proxy '
+                        'ClassName matching the schema of the input tree.  '
+                        'Requires --tree.')
+
+    parser.add_argument('--proxy-cache', dest='proxy_cache', type=str,
+                        default=proxycache.DEFAULT_CACHE,
+                        help='Directory where the compiled proxies are '
+                        'cached (def: $MEGA_PROXY_CACHE or %(default)s)')
+
+    parser.add_argument('--prefetch', action='store_true', default=False,
+                        help="Read ahead asynchronously, and open the next "
+                        "file of a chain in advance (experimental)")
+
+    parser.add_argument('--simulate-latency', dest='latency', type=float,
+                        default=0, metavar='ms',
+                        help='Read local input files with [ms] milliseconds '
+                        'of latency per read call, to test I/O tuning')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='Measure the time, I/O and memory used for each '
+                        'input, and print a summary at the end')
+
+    parser.add_argument('--profile-json', dest='profile_json', type=str,
+                        default=None, metavar='file.json',
+                        help='Write the profile measurements to a JSON file '
+                        '(implies --profile)')
+
+    parser.add_argument('--sample-profile', dest='sample_interval',
+                        type=float, default=0, metavar='ms',
+                        help='Sample the python stack of the workers every '
+                        '[ms] of CPU time (implies --profile).  With '
+                        '--profile-json, the stacks are also written in the '
+                        'flamegraph.pl format')
+
     parser.add_argument('--single-mode', action='store_true', dest='single',
                         help="Run as a single job.")
 
@@ -85,10 +148,24 @@ if __name__ == "__main__":
 
     log.info("Dataset has %i files", len(file_list))
 
+    if args.latency:
+        log.info("Simulating %g ms read latency", args.latency)
+        file_list = megaio.simulate_latency(file_list, args.latency)
+
     path_to_selector = os.path.dirname(os.path.abspath(args.selector))
     sys.path = [path_to_selector] + sys.path
     module_name = os.path.basename(args.selector)
     class_name = module_name.replace('.py', '')
+
+    if args.proxy:
+        if not args.tree:
+            log.error("--proxy requires the tree path to be given by --tree")
+            sys.exit(1)
+        log.info("Getting proxy %s for tree %s", args.proxy, args.tree)
+        proxy_dir = proxycache.use_proxy(args.proxy, file_list[0], args.tree,
+                                         args.proxy_cache)
+        log.info("Using proxy in %s", proxy_dir)
+
     log.info("Importing class %s from %s", class_name, path_to_selector)
 
     module = __import__(class_name, fromlist=[class_name])
@@ -105,12 +182,21 @@ if __name__ == "__main__":
     if not args.single:
         log.info("Dispatching jobs")
         dispatch = MegaDispatcher(file_list, tree_name, args.output, selector,
-                                  args.workers, nchain=args.chain)
+                                  args.workers, nchain=args.chain,
+                                  shard_size=args.shard_size,
+                                  merge_fanin=args.merge_fanin,
+                                  nmergers=args.mergers,
+                                  histos_only=args.histos_only,
+                                  accumulate=args.accumulate,
+                                  prefetch=args.prefetch,
+                                  profile=args.profile,
+                                  profile_json=args.profile_json,
+                                  sample_interval=args.sample_interval / 1000.)
         dispatch.run()
     else:
         log.info("Running job as single process")
         print args.output
         processor = ChainProcessor(file_list, tree_name, selector,
-                                   args.output, log)
+                                   args.output, log, prefetch=args.prefetch)
         result = processor.process()
     log.info("Mega2 job is complete")
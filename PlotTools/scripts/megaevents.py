@@ -50,6 +50,11 @@ if __name__ == "__main__":
     parser.add_argument('--branches', default=[], metavar="branch", nargs='*',
                         help="Store the values of the branches in the output")
 
+    parser.add_argument('--native', action='store_true',
+                        help="Evaluate the selections as compiled "
+                        "TTreeFormulas in a single pass, and print the cut "
+                        "flow.  The selections must be built with megautil.")
+
     args = parser.parse_args(args[1:])
 
     log.info("Checking inputs file %s exists..." % args.inputs)
@@ -116,12 +121,26 @@ if __name__ == "__main__":
     passed_events = []
 
     nrows = chain.GetEntries()
+
+    rows_to_check = xrange(nrows)
+    if args.native:
+        from FinalStateAnalysis.PlotTools import megaformula
+        log.info("Evaluating the selections natively")
+        flow, mask = megaformula.cut_flow(
+            [selection for name, selection in selections], chain,
+            with_mask=True)
+        for (name, selection), (cut, npassed) in zip(selections, flow):
+            log.warning("Cut flow: %s passed %i/%i", name, npassed, nrows)
+        rows_to_check = mask.nonzero()[0]
+        # We already know these pass
+        selections = []
+
     pbar = ProgressBar(widgets=[
         FormatLabel('Processed %(value)i/' + str(nrows) + ' rows. '),
         ETA(), Bar('>')], maxval=nrows).start()
     pbar.update(0)
 
-    for row in xrange(nrows):
+    for row in rows_to_check:
         pbar.update(row)
         chain.GetEntry(row)
         all_passed = True
@@ -4,8 +4,10 @@ import ROOT
 from optparse import OptionParser
 import sys
 import os
+import hashlib
 import logging
 from pdb import set_trace
+from FinalStateAnalysis.PlotTools.shapestore import ShapeStore
 
 logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
 
@@ -36,6 +38,46 @@ def parse_cgs(cgs_filename):
                 raise ValueError('cannot parse line: %s \nIn file %s' % (line, cgs_filename))
     return ret
 
+def cgs_paths(cgs, mass_point):
+    ''' Get the list of (category, histogram path) of each kind of shape '''
+    paths = {'backgrounds': [], 'signals': [], 'data': []}
+    for category in cgs['categories']:
+        for bkg in cgs['backgrounds']:
+            paths['backgrounds'].append(
+                (category, os.path.join(category, bkg)))
+        for sig in cgs['signals']:
+            paths['signals'].append(
+                (category, os.path.join(category, sig)+mass_point))
+        for dat in cgs['data']:
+            paths['data'].append((category, os.path.join(category, dat)))
+    return paths
+
+def inputs_signature(stores, categories, paths, mass_point):
+    ''' Hash of the content of the inputs used to make the output '''
+    hash = hashlib.md5(mass_point)
+    for store in stores:
+        for category in sorted(categories):
+            if category in store.categories():
+                hash.update(store.category_hash(category))
+    for path in sorted(paths):
+        hash.update(path)
+    return hash.hexdigest()
+
+def sum_shapes(sources, paths, name, current=None):
+    ''' Sum the histograms at [paths] in all the [sources] '''
+    for category, path in paths:
+        for source in sources:
+            tmp_h = source.Get(path)
+            logging.info( 'getting %s' % path )
+            if tmp_h:
+                if not current:
+                    current = tmp_h.Clone(name)
+                else:
+                    current.Add(tmp_h)
+            else:
+                logging.warning( 'skipping %s' % path )
+    return current
+
 def normalize(hist):
     for i in range(0, hist.GetNbinsX()+2): #scale underflow/overflow too                                                                                                                              
         content = hist.GetBinContent(i)
@@ -57,6 +99,10 @@ if __name__ == '__main__':
     parser.add_option("-q", "--quiet",
                   action="store_true", dest="quiet", default=False,
                   help="less printout")
+    parser.add_option("-s", "--store",
+                  action="store_true", dest="store", default=False,
+                  help="read the shapes through a persistent ShapeStore, and "
+                  "skip remaking the output if its inputs didn't change")
     parser.add_option("-v", "--verbose",
                   action="store_true", dest="verbose", default=False,
                   help="more printout")
@@ -83,55 +129,43 @@ if __name__ == '__main__':
 
     root_files = []
     for i in root_names:
-        logging.info('opening %s' % i)
-        root_files.append( ROOT.TFile.Open(i) )
+        if args.store:
+            logging.info('updating shape store of %s' % i)
+            store = ShapeStore(i)
+            store.update()
+            root_files.append( store )
+        else:
+            logging.info('opening %s' % i)
+            root_files.append( ROOT.TFile.Open(i) )
+
+    all_paths = [cgs_paths(cgs, mass_point) for cgs in parsed_cgs]
+
+    signature_file = args.ofile_name + '.inputs'
+    if args.store:
+        categories = set()
+        used_paths = []
+        for cgs, paths in zip(parsed_cgs, all_paths):
+            categories.update(cgs['categories'])
+            for kind_paths in paths.itervalues():
+                used_paths.extend(path for category, path in kind_paths)
+        signature = inputs_signature(
+            root_files, categories, used_paths, mass_point)
+        if os.path.exists(args.ofile_name) and \
+                os.path.exists(signature_file):
+            with open(signature_file) as infile:
+                if infile.read().strip() == signature:
+                    logging.warning('inputs of %s did not change, skipping'
+                                    % args.ofile_name)
+                    sys.exit(0)
 
     ofile      = ROOT.TFile(args.ofile_name, 'recreate')
 
-    for cgs in parsed_cgs:
-        for category in cgs['categories']:
-            #fill background
-            for bkg in cgs['backgrounds']:
-                path = os.path.join(category, bkg)
-                for tfile in root_files:
-                    tmp_h = tfile.Get(path)
-                    logging.info( 'getting %s' % path )
-                    if tmp_h:
-                        if not h_bkg:
-                            h_bkg = tmp_h.Clone('Ztt')
-                            #h_bkg.SetTitle('Ztt')
-                        else:
-                            h_bkg.Add(tmp_h)
-                    else:
-                        logging.warning( 'skipping %s' % path )
-
-            #fill signal
-            for sig in cgs['signals']:
-                path = os.path.join(category, sig)+mass_point
-                for tfile in root_files:
-                    tmp_h = tfile.Get(path)
-                    logging.info( 'getting %s' % path )
-                    if tmp_h:
-                        if not h_signal:
-                            h_signal = tmp_h.Clone('ggH')
-                            #h_signal.SetTitle('ggH')
-                        else:
-                            h_signal.Add(tmp_h)
-                    else:
-                        logging.warning( 'skipping %s' % path )
-
-            for dat in cgs['data']:
-                path = os.path.join(category, dat) 
-                for tfile in root_files:
-                    tmp_h = tfile.Get(path)
-                    logging.info( 'getting %s' % path )
-                    if tmp_h:
-                        if not h_data:
-                            h_data = tmp_h.Clone('data_obs')
-                        else:
-                            h_data.Add(tmp_h)
-                    else:
-                        logging.warning( 'skipping %s' % path )
+    for paths in all_paths:
+        #fill background
+        h_bkg = sum_shapes(root_files, paths['backgrounds'], 'Ztt', h_bkg)
+        #fill signal
+        h_signal = sum_shapes(root_files, paths['signals'], 'ggH', h_signal)
+        h_data = sum_shapes(root_files, paths['data'], 'data_obs', h_data)
 
     #signal is signal + bkg
     h_signal.Add(h_bkg)
@@ -149,6 +183,13 @@ if __name__ == '__main__':
     h_bkg.Write()
     error.Write()
     ofile.Close()
-    
+
+    if args.store:
+        with open(signature_file, 'w') as outfile:
+            outfile.write(signature)
+
     for i in root_files:
-        i.Close()
+        if hasattr(i, 'close'):
+            i.close()
+        else:
+            i.Close()
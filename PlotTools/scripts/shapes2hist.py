@@ -5,8 +5,9 @@ import sys
 import rootpy.plotting.views as views
 import rootpy.plotting as plotting
 from rootpy import io
-from FinalStateAnalysis.MetaData.data_styles import data_styles
+from FinalStateAnalysis.MetaData.style_matcher import get_best_style
 from FinalStateAnalysis.PlotTools.DifferentialView import DifferentialView
+from FinalStateAnalysis.PlotTools.shapestore import ShapeStore
 from fnmatch import fnmatch
 from optparse import OptionParser
 import logging
@@ -20,18 +21,7 @@ usage   = "shape2hist.py [rootfile] [categories] [options]"
 
 
 def match_to_style(sample):
-    best_pattern = ''
-    for pattern, style_dict in data_styles.iteritems():
-        logging.debug("Checking pattern: %s against %s", pattern, sample)
-        if fnmatch(sample, pattern):
-            logging.debug("-> it matches!")
-            if len(pattern) > len(best_pattern):
-                best_pattern = pattern
-                logging.info("Found new best style for %s: %s", sample, pattern)
-    if best_pattern:
-        return data_styles[best_pattern]
-    else:
-        return {}
+    return get_best_style(sample) or {}
 
 def remove_name_entry(dictionary):
     return dict( [ i for i in dictionary.iteritems() if i[0] != 'name'] )
@@ -58,17 +48,25 @@ if __name__ == '__main__':
     parser.add_option('-d','--differential', type=int, default = 0,
                      help='makes a differential plot',dest='differential')
     parser.add_option('--show-errors', dest='show_errors', action='store_true')
+    parser.add_option('--store', dest='store', action='store_true',
+                     help='read the shapes through a persistent ShapeStore')
 
     (options,arguments) = parser.parse_args()
     
     tfile_name = arguments.pop(0)
     categories = arguments
 
-    tfile = io.open(tfile_name)
-    logging.info("Opened file %s" % tfile_name)
-    
-    #get a directory and look into that
-    keys = [i.GetName() for i in tfile.Get(categories[0]).GetListOfKeys() if not fnmatch(i.GetName(), options.nuisances)]
+    if options.store:
+        tfile = ShapeStore(tfile_name)
+        tfile.update()
+        logging.info("Opened shape store of %s" % tfile_name)
+        keys = tfile.keys(categories[0])
+    else:
+        tfile = io.open(tfile_name)
+        logging.info("Opened file %s" % tfile_name)
+        #get a directory and look into that
+        keys = [i.GetName() for i in tfile.Get(categories[0]).GetListOfKeys()]
+    keys = [i for i in keys if not fnmatch(i, options.nuisances)]
     if options.excluded:
         keys = [ i for i in keys if not fnmatch(i, options.excluded)]
     data = [i for i in keys if i.startswith('data')][0]
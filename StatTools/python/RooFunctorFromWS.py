@@ -4,7 +4,8 @@ RooFunctorFromWS
 
 Builds a functor from a function in a RooWorkspace.
 
-This could be improved with cython.
+The functor calls RooFit for each value.  compile() gives a NumPy version of
+the function, which can also evaluate arrays and be pickled (see formula.py).
 
 Author: Evan K. Friis, UW Madison
 
@@ -16,13 +17,22 @@ Author: Evan K. Friis, UW Madison
 '0.0244'
 >>> '%0.4f' % functor(140)
 '0.0138'
+>>> compiled = functor.compile()
+>>> '%0.4f' % compiled(60)
+'0.0244'
+>>> ['%0.4f' % y for y in functor.evaluate([60, 140])]
+['0.0244', '0.0138']
 
 '''
 
 from FinalStateAnalysis.Utilities.rootbindings import ROOT
 import array
+import numpy
 from pdb import set_trace
 from FinalStateAnalysis.PlotTools.decorators import memo_last
+from FinalStateAnalysis.Utilities.lookups import BinnedLookup
+from FinalStateAnalysis.StatTools.knn import KNNEvaluator
+from FinalStateAnalysis.StatTools.formula import compile_function
 
 #ROOT.gSystem.Load("libFinalStateAnalysisStatTools")
 
@@ -35,12 +45,29 @@ class RooFunctorFromWS(ROOT.RooFunctor):
         # Get the ind. var and the parameters
         #self.x = workspace.var(var)
         self.x = self.function.getParameter(var) if hasattr(self.function, 'getParameter') else self.function.getVariables().find(var)
+        # The range of the fit, where the function is sampled if needed
+        self.xrange = (self.x.getMin(), self.x.getMax())
         self.x.setRange(0, 1e99)
+        self.compiled = None
 
     def __call__(self, x):
         self.x.setVal(x)
         return self.function.getVal()
 
+    def compile(self, npoints=1000):
+        ''' A NumPy version of the function, with the current parameters
+
+        RooFormulaVars are translated, other functions are sampled in
+        [npoints] points of the fit range.
+        '''
+        return compile_function(self.function, self.x, self.xrange, npoints)
+
+    def evaluate(self, x):
+        ''' Evaluate for an array of values '''
+        if self.compiled is None:
+            self.compiled = self.compile()
+        return self.compiled.evaluate(x)
+
 class FunctorFromTF1(object):
     def __init__(self, tfile_name, path):
         # Get the RooFormulaVar
@@ -68,28 +95,43 @@ class MultiFunctorFromTF1(object):
         raise ValueError("MultiFunctorFromTF1: y range aoutside boundaries!")
 
 class FunctorFromMVA(object):
+    ''' Evaluate a TMVA method booked from its weights file
+
+    With native=True, a kNN trained by train_kNN.py is evaluated with NumPy
+    (see knn.KNNEvaluator) instead of TMVA.
+    '''
     def __init__(self, name, xml_filename, *variables, **kwargs):
-        self.reader    = ROOT.TMVA.Reader( "!Color:Silent=%s:Verbose=%s" % (kwargs.get('silent','T'), kwargs.get('verbose','F')))
         self.var_map   = {}
         self.name      = name
-        self.variables = variables
+        self.variables = tuple(variables)
+        self.variable_set = frozenset(variables)
         self.xml_filename = xml_filename
+        self.native = None
+        if kwargs.get('native', False):
+            self.native = KNNEvaluator.from_xml(
+                xml_filename, kwargs.get('training_ntuple', 'training_ntuple'))
+            self._check_columns(self.native.variables)
+            return
+        self.reader    = ROOT.TMVA.Reader( "!Color:Silent=%s:Verbose=%s" % (kwargs.get('silent','T'), kwargs.get('verbose','F')))
         for var in variables:
             self.var_map[var] = array.array('f',[0]) 
             self.reader.AddVariable(var, self.var_map[var])
         self.reader.BookMVA(name, xml_filename)
 
+    def _check_columns(self, columns):
+        if len(columns) != len(self.variables) or \
+                self.variable_set.symmetric_difference(columns):
+            raise Exception("Wrong variable names. Available variables: %s" % self.variables.__repr__())
+
     def evaluate_(self): #so I can profile the time needed
         return self.reader.EvaluateMVA(self.name)
 
     @memo_last
     def __call__(self, **kvars):
         #kvars enforces that we use the proper vars
-        if not ( 
-                 all(name in self.variables for name in kvars.keys()) and \
-                 all(name in kvars.keys() for name in self.variables)
-                ):
-            raise Exception("Wrong variable names. Available variables: %s" % self.variables.__repr__())
+        self._check_columns(kvars)
+        if self.native is not None:
+            return self.native(**kvars)
         for name, val in kvars.iteritems():
             self.var_map[name][0] = val
         retval = self.evaluate_() #reader.EvaluateMVA(self.name)
@@ -97,6 +139,43 @@ class FunctorFromMVA(object):
         #    print "returning 1 in %s, kvars: %s" % (self.xml_filename, kvars.items()) 
         return retval
 
+    def bind(self, *columns):
+        ''' Get a function of the variables in the order of [columns]
+
+        The names are only checked here, not at each call.
+        '''
+        columns = columns or self.variables
+        self._check_columns(columns)
+        if self.native is not None:
+            order = [columns.index(x) for x in self.native.variables]
+            native = self.native
+            return lambda *values: native.evaluate(
+                [[values[i] for i in order]])[0]
+        slots = [self.var_map[x] for x in columns]
+        reader = self.reader
+        name = self.name
+        def _evaluate(*values):
+            for slot, value in zip(slots, values):
+                slot[0] = value
+            return reader.EvaluateMVA(name)
+        return _evaluate
+
+    def evaluate(self, features, columns=None):
+        ''' Evaluate an array of features[event, column]
+
+        The columns are in the order of the variables, unless given.
+        '''
+        columns = tuple(columns or self.variables)
+        features = numpy.atleast_2d(numpy.asarray(features, numpy.float64))
+        self._check_columns(columns)
+        if self.native is not None:
+            order = [columns.index(x) for x in self.native.variables]
+            return self.native.evaluate(features[:, order])
+        function = self.bind(*columns)
+        return numpy.fromiter(
+            (function(*row) for row in features.tolist()),
+            dtype=numpy.float64, count=len(features))
+
 
 class MultiFunctorFromMVA(object):
     '''Phil's diboson subtraction implementation'''
@@ -135,36 +214,56 @@ class MultiFunctorFromMVA(object):
             weight*functor(**kvars) for functor, weight in self.functors_and_weights
             )
 
+    def bind(self, *columns):
+        ''' Get a function of the variables in the order of [columns] '''
+        bound = [(functor.bind(*columns), weight)
+                 for functor, weight in self.functors_and_weights]
+        def _evaluate(*values):
+            return sum(weight*function(*values) for function, weight in bound)
+        return _evaluate
 
-def build_roofunctor(filename, wsname, functionname, var='x'):
-    ''' Build a functor from a filename '''
+    def evaluate(self, features, columns=None):
+        ''' Evaluate an array of features[event, column] '''
+        return sum(
+            weight*functor.evaluate(features, columns)
+            for functor, weight in self.functors_and_weights
+            )
+
+
+def build_roofunctor(filename, wsname, functionname, var='x', compiled=False):
+    ''' Build a functor from a filename
+
+    If [compiled], returns the (picklable) NumPy version of the function,
+    and closes the file.
+    '''
     file = ROOT.TFile.Open(filename)
     if not file:
         raise IOError("Can't open file: %s" % filename)
     ws = file.Get(wsname)
-    return RooFunctorFromWS(ws, functionname, var)
+    functor = RooFunctorFromWS(ws, functionname, var)
+    if not compiled:
+        return functor
+    result = functor.compile()
+    file.Close()
+    return result
 
 def make_corrector_from_th2(filename, path):
+    ''' Build a BinnedLookup(x, y) from a TH2 in a file
+
+    The under- and overflows get the first and last bins.  Empty bins give
+    10**-8 instead of 0.
+    '''
     tfile = ROOT.TFile.Open(filename)
     if not tfile:
         raise IOError("Can't open file: %s" % filename)
-    hist  = tfile.Get(path).Clone()
-    #print hist
-    binsx = hist.GetNbinsX()
-    binsy = hist.GetNbinsY()
-    def refFun(xval,yval):
-        #print hist
-        xbin = hist.GetXaxis().FindFixBin(xval) #Faster than FindBin
-        xbin = (xbin if xbin <= binsx else binsx ) if xbin >= 1 else 1 #Compute underflow and overflow as first and last bin
-        ybin = hist.GetYaxis().FindFixBin(yval)
-        ybin = (ybin if ybin <= binsy else binsy ) if ybin >= 1 else 1 #Compute underflow and overflow as first and last bin
-        prob = hist.GetBinContent(xbin,ybin)
-        if prob:
-            return prob
-        else:
-            return 10**-8
-           # raise ZeroDivisionError(" catched trying to return weight for (%.3f,%.3f) ==> (%i,%i) bin out of (%i,%i). Prob: %.3f. Hist: %s : %s. " % (xval, yval, xbin, ybin, binsx, binsy , prob, filename, path))
-    return refFun
+    hist = tfile.Get(path)
+    if not hist:
+        raise IOError("Can't find %s in file: %s" % (path, filename))
+    lookup = BinnedLookup.from_histogram(hist)
+    tfile.Close()
+    values = lookup.values
+    values[values == 0] = 10**-8
+    return BinnedLookup(lookup.edges, values)
 
 def build_uncorr_2Droofunctor(functor_x, functor_y, filename, num='numerator', den='denominator'):
     ''' Build a functor from a filename '''
@@ -0,0 +1,329 @@
+'''
+
+Evaluate RooFit functions of one variable without RooFit.
+
+The efficiency fits of fit_efficiency.py are RooFormulaVars built with
+expr::efficiency('<formula>', x, <parameters>).  The formula is translated to
+a python expression, with the parameters fixed to their fitted values, which
+can be evaluated for a single value or a NumPy array:
+
+>>> efficiency = CompiledFormula('a*exp(-x/b)+@3', ['x', 'a', 'b', 'c'],
+...                              'x', {'a': 2., 'b': 10., 'c': 0.5})
+>>> efficiency(0)
+2.5
+>>> ['%0.3f' % y for y in efficiency.evaluate([0., 10., 1e3])]
+['2.500', '1.236', '0.500']
+
+Formulas using functions which aren't supported raise UnsupportedFormula:
+
+>>> CompiledFormula('TMath::Landau(x, a, b)', ['x', 'a', 'b'], 'x',
+...                 {'a': 1., 'b': 1.})
+Traceback (most recent call last):
+    ...
+UnsupportedFormula: Unsupported function TMath::Landau in TMath::Landau(x, a, b)
+
+Chained comparisons mean something else in TFormula ((a < x) < b) and in
+python, so they must be grouped with parentheses:
+
+>>> CompiledFormula('0 < x < a', ['x', 'a'], 'x', {'a': 1.})
+Traceback (most recent call last):
+    ...
+UnsupportedFormula: Chained comparison in 0 < x < a
+>>> CompiledFormula('(0 < x) < a', ['x', 'a'], 'x', {'a': 2.})(0.5)
+1.0
+
+As in TFormula, comparisons give 1 or 0, which can be used in arithmetic:
+
+>>> window = CompiledFormula('(x < a) + (x > b) - (x < c)',
+...                          ['x', 'a', 'b', 'c'], 'x',
+...                          {'a': 1., 'b': 2., 'c': 0.})
+>>> [window(y) for y in [-1., 0.5, 1.5, 3.]]
+[0.0, 1.0, 0.0, 1.0]
+>>> window.evaluate([-1., 0.5, 1.5, 3.]).tolist()
+[0.0, 1.0, 0.0, 1.0]
+
+compile_function() uses them when it can, and samples any other function of x
+into a GraphLookup (see Utilities/python/lookups.py) otherwise.  The samples
+are only taken in the fit range of x, and their end values are used outside
+of it, instead of extrapolating.  Both can be pickled, i.e. to be sent to the
+mega workers.
+
+'''
+
+import logging
+import math
+import numpy
+import re
+from FinalStateAnalysis.Utilities.lookups import GraphLookup
+
+try:
+    from scipy.special import erf as _array_erf, erfc as _array_erfc
+except ImportError:
+    _array_erf = numpy.vectorize(math.erf, otypes=[numpy.float64])
+    _array_erfc = numpy.vectorize(math.erfc, otypes=[numpy.float64])
+
+log = logging.getLogger("formula")
+
+
+class UnsupportedFormula(ValueError):
+    pass
+
+
+def _gaus(exp):
+    def gaus(x, mean=0., sigma=1., norm=False):
+        ''' TMath::Gaus '''
+        if sigma == 0:
+            return 1.e30
+        result = exp(-0.5 * ((x - mean) / sigma) ** 2)
+        if norm:
+            result = result / (math.sqrt(2 * math.pi) * sigma)
+        return result
+    return gaus
+
+# Formula function => (scalar version, array version)
+_FUNCTIONS = {
+    'exp': (math.exp, numpy.exp),
+    'log': (math.log, numpy.log),
+    'log10': (math.log10, numpy.log10),
+    'sqrt': (math.sqrt, numpy.sqrt),
+    'sin': (math.sin, numpy.sin),
+    'cos': (math.cos, numpy.cos),
+    'tan': (math.tan, numpy.tan),
+    'asin': (math.asin, numpy.arcsin),
+    'acos': (math.acos, numpy.arccos),
+    'atan': (math.atan, numpy.arctan),
+    'atan2': (math.atan2, numpy.arctan2),
+    'sinh': (math.sinh, numpy.sinh),
+    'cosh': (math.cosh, numpy.cosh),
+    'tanh': (math.tanh, numpy.tanh),
+    'abs': (abs, numpy.abs),
+    'pow': (math.pow, numpy.power),
+    'min': (min, numpy.minimum),
+    'max': (max, numpy.maximum),
+    'erf': (math.erf, _array_erf),
+    'erfc': (math.erfc, _array_erfc),
+    'gaus': (_gaus(math.exp), _gaus(numpy.exp)),
+    'pi': (lambda: math.pi, lambda: numpy.pi),
+    'e': (lambda: math.e, lambda: numpy.e),
+}
+
+# Converts the result of a comparison to a number
+_COMPARISON = (float, lambda x: numpy.asarray(x, dtype=numpy.float64))
+
+_ALIASES = {
+    'fabs': 'abs',
+    'TMath::Exp': 'exp',
+    'TMath::Log': 'log',
+    'TMath::Log10': 'log10',
+    'TMath::Sqrt': 'sqrt',
+    'TMath::Sin': 'sin',
+    'TMath::Cos': 'cos',
+    'TMath::Tan': 'tan',
+    'TMath::ASin': 'asin',
+    'TMath::ACos': 'acos',
+    'TMath::ATan': 'atan',
+    'TMath::ATan2': 'atan2',
+    'TMath::SinH': 'sinh',
+    'TMath::CosH': 'cosh',
+    'TMath::TanH': 'tanh',
+    'TMath::Abs': 'abs',
+    'TMath::Power': 'pow',
+    'TMath::Min': 'min',
+    'TMath::Max': 'max',
+    'TMath::Erf': 'erf',
+    'TMath::Erfc': 'erfc',
+    'TMath::Gaus': 'gaus',
+    'TMath::Pi': 'pi',
+    'TMath::E': 'e',
+}
+
+_TOKENS = re.compile(r'''
+    \s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+    (?P<name>[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*) |
+    (?P<index>@\d+) |
+    (?P<operator>\*\*|==|!=|<=|>=|[-+*/^(),<>])
+    )''', re.VERBOSE)
+
+
+def translate(expression, names):
+    ''' Translate a RooFormula [expression] of [names] to python
+
+    The variables become _0, _1, ... in the order of [names], and the
+    functions _f_<name>.  The results of comparisons are converted to
+    numbers with _cmp, so booleans (or arrays of them) are never added or
+    subtracted.
+    '''
+    result = []
+    position = 0
+    expression = expression.rstrip()
+    # [number of comparisons, start in result] at each level of parentheses.
+    # Comparisons have the lowest precedence, so a level with a comparison
+    # is converted to a number as a whole.
+    levels = [[0, 0]]
+
+    def close_level():
+        count, start = levels[-1]
+        if count:
+            result[start:] = ['_cmp('] + result[start:] + [')']
+    while position < len(expression):
+        match = _TOKENS.match(expression, position)
+        if not match:
+            raise UnsupportedFormula("Can't parse '%s' in %s" % (
+                expression[position:], expression))
+        position = match.end()
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == 'number':
+            # All the numbers are doubles, i.e. 1/2 == 0.5
+            result.append(repr(float(token)))
+        elif kind == 'index':
+            index = int(token[1:])
+            if index >= len(names):
+                raise UnsupportedFormula("No variable %s in %s" % (
+                    token, expression))
+            result.append('_%i' % index)
+        elif kind == 'name':
+            is_call = expression[position:].lstrip().startswith('(')
+            if not is_call and token in names:
+                result.append('_%i' % names.index(token))
+            elif _ALIASES.get(token, token) in _FUNCTIONS:
+                function = '_f_' + _ALIASES.get(token, token)
+                # pi and e can be used as constants
+                result.append(function if is_call else function + '()')
+            elif is_call:
+                raise UnsupportedFormula("Unsupported function %s in %s" % (
+                    token, expression))
+            else:
+                raise UnsupportedFormula("Unknown variable %s in %s" % (
+                    token, expression))
+        elif token == '^':
+            result.append('**')
+        else:
+            if token in ('<', '>', '<=', '>=', '==', '!='):
+                levels[-1][0] += 1
+                if levels[-1][0] > 1:
+                    raise UnsupportedFormula("Chained comparison in %s" %
+                                             expression)
+            elif token == ')' and len(levels) > 1:
+                close_level()
+                levels.pop()
+            elif token == ',':
+                close_level()
+                levels[-1] = [0, len(result) + 1]
+            result.append(token)
+            if token == '(':
+                levels.append([0, len(result)])
+    while levels:
+        close_level()
+        levels.pop()
+    return ' '.join(result)
+
+
+class CompiledFormula(object):
+    ''' A formula of [variable], with fixed values of the other [names] '''
+    __slots__ = ['expression', 'names', 'variable', 'values', 'source',
+                 '_scalar', '_array']
+
+    def __init__(self, expression, names, variable, values):
+        self.expression = expression
+        self.names = list(names)
+        self.variable = variable
+        self.values = dict(values)
+        if variable not in self.names:
+            raise UnsupportedFormula("%s doesn't depend on %s" % (
+                expression, variable))
+        self.source = translate(expression, self.names)
+        # The fixed parameters are globals of the function
+        constants = dict(('_%i' % i, float(self.values[name]))
+                         for i, name in enumerate(self.names)
+                         if name != variable)
+        code = 'lambda _%i: %s' % (self.names.index(variable), self.source)
+        self._scalar = eval(code, self._namespace(0, constants))
+        self._array = eval(code, self._namespace(1, constants))
+
+    @staticmethod
+    def _namespace(version, constants):
+        namespace = dict(constants)
+        for name, functions in _FUNCTIONS.iteritems():
+            namespace['_f_' + name] = functions[version]
+        namespace['_cmp'] = _COMPARISON[version]
+        return namespace
+
+    @classmethod
+    def from_roofit(cls, function, x):
+        ''' Read the formula and current parameter values of a RooFormulaVar
+
+        [x] is the variable (RooRealVar) of the function.
+        '''
+        if not function.InheritsFrom('RooFormulaVar'):
+            raise UnsupportedFormula("%s is a %s, not a RooFormulaVar" % (
+                function.GetName(), function.ClassName()))
+        if hasattr(function, 'expression'):
+            expression = function.expression()
+        else:
+            expression = function.GetTitle()
+        names = []
+        values = {}
+        while True:
+            parameter = function.getParameter(len(names))
+            if not parameter:
+                break
+            name = parameter.GetName()
+            names.append(name)
+            if name == x.GetName():
+                continue
+            if parameter.dependsOn(x):
+                raise UnsupportedFormula("Parameter %s of %s depends on %s" % (
+                    name, function.GetName(), x.GetName()))
+            values[name] = parameter.getVal()
+        return cls(expression, names, x.GetName(), values)
+
+    def __getstate__(self):
+        return (self.expression, self.names, self.variable, self.values)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __call__(self, x):
+        return float(self._scalar(x))
+
+    def evaluate(self, x):
+        ''' Evaluate for an array of values '''
+        x = numpy.asarray(x, dtype=numpy.float64)
+        # Also gives an array if the result doesn't depend on x
+        return self._array(x) + numpy.zeros(x.shape)
+
+
+def sample_function(function, x, xrange, npoints=1000):
+    ''' Sample [function] of [x] in npoints points of [xrange]
+
+    Returns a GraphLookup, interpolating linearly between the points, and
+    giving the first (last) value outside of [xrange].
+    '''
+    initial = x.getVal()
+    points = numpy.linspace(xrange[0], xrange[1], npoints)
+    values = []
+    for point in points:
+        x.setVal(point)
+        values.append(function.getVal())
+    x.setVal(initial)
+    return GraphLookup(points, values, clamp=True)
+
+
+def compile_function(function, x, xrange, npoints=1000):
+    ''' Build a picklable NumPy version of a RooAbsReal [function] of [x]
+
+    RooFormulaVars are translated if possible, otherwise the function is
+    sampled in [xrange].
+    '''
+    try:
+        return CompiledFormula.from_roofit(function, x)
+    except UnsupportedFormula, e:
+        log.info("Sampling %s in [%g, %g]: %s", function.GetName(),
+                 xrange[0], xrange[1], e)
+        return sample_function(function, x, xrange, npoints)
+
+
+if __name__ == "__main__":
+    import doctest; doctest.testmod()
@@ -0,0 +1,233 @@
+'''
+
+k-nearest-neighbour fake rate weights, without TMVA.
+
+train_kNN.py trains a TMVA kNN on a "training_ntuple" of events passing or
+failing a cut, and the weights are evaluated through a TMVA.Reader one event
+at a time (see RooFunctorFromWS.FunctorFromMVA).  The KNNEvaluator does the
+same computation with NumPy, from the training ntuple itself:
+
+    * each variable is divided by the width of the range holding the central
+      ScaleFrac of its values
+    * the k nearest training events are found with a KD-tree
+    * the result is the sum of the weights of the neighbours passing the cut,
+      over the sum of the weights of all of them
+
+as TMVA does with the options used by train_kNN.py (UseWeight=T,
+UseKernel=F).  The quantiles used for the scaling are not computed exactly
+the same way as in TMVA, so the results can differ slightly.
+
+    evaluator = KNNEvaluator.from_xml('fakerate.kNN.weights.xml')
+    weights = evaluator.evaluate(features) # features[event, variable]
+    weight = evaluator(muonPt=25., muonJetPt=40.)
+
+The KD-tree is scipy.spatial.cKDTree if scipy is available, otherwise a
+NumPy implementation.
+
+>>> evaluator = KNNEvaluator(['x'], [[0.], [1.], [2.], [10.], [11.]],
+...                          [True, True, False, False, False],
+...                          [1., 1., 2., 1., 1.], k=3)
+>>> evaluator.evaluate([[0.5], [10.5]]).tolist()
+[0.5, 0.0]
+>>> KDTree([[0.], [1.], [2.], [10.]]).query([[9.]], 2).tolist()
+[[3, 2]]
+
+'''
+
+import heapq
+import numpy
+import xml.etree.ElementTree as ElementTree
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class KDTree(object):
+    ''' A KD-tree of points, to find their k nearest neighbours '''
+    def __init__(self, points, leafsize=32):
+        self.points = numpy.asarray(points, dtype=numpy.float64)
+        self.leafsize = leafsize
+        # The points of each node are order[start:end]
+        self.order = numpy.arange(len(self.points))
+        # Nodes as [start, end, dimension, split value, left, right], with
+        # left = right = -1 for the leaves.
+        self.nodes = []
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        node = len(self.nodes)
+        self.nodes.append([start, end, -1, 0., -1, -1])
+        if end - start <= self.leafsize:
+            return node
+        points = self.points[self.order[start:end]]
+        spread = points.max(axis=0) - points.min(axis=0)
+        dimension = int(numpy.argmax(spread))
+        if spread[dimension] == 0:
+            return node
+        middle = (end - start) // 2
+        partition = numpy.argpartition(points[:, dimension], middle)
+        self.order[start:end] = self.order[start:end][partition]
+        split = self.points[self.order[start + middle], dimension]
+        left = self._build(start, start + middle)
+        right = self._build(start + middle, end)
+        self.nodes[node][2:] = [dimension, split, left, right]
+        return node
+
+    def _query_one(self, point, k):
+        # Max-heap of the k best (-distance2, index)
+        best = []
+        # Min-heap of (distance2 lower bound, node) still to visit
+        to_visit = [(0., 0)]
+        while to_visit:
+            bound, node = heapq.heappop(to_visit)
+            if len(best) == k and bound >= -best[0][0]:
+                break
+            start, end, dimension, split, left, right = self.nodes[node]
+            if left < 0:
+                indices = self.order[start:end]
+                distances = ((self.points[indices] - point) ** 2).sum(axis=1)
+                for distance, index in zip(distances.tolist(),
+                                           indices.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, index))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, index))
+                continue
+            offset = point[dimension] - split
+            near, far = (left, right) if offset < 0 else (right, left)
+            heapq.heappush(to_visit, (bound, near))
+            heapq.heappush(to_visit, (max(bound, offset * offset), far))
+        return [index for distance, index in sorted(best, reverse=True)]
+
+    def query(self, points, k):
+        ''' Get the indices of the [k] nearest points, as an (n, k) array '''
+        points = numpy.atleast_2d(numpy.asarray(points, dtype=numpy.float64))
+        k = min(k, len(self.points))
+        return numpy.array([self._query_one(point, k) for point in points],
+                           dtype=numpy.int64).reshape(len(points), k)
+
+
+def quantile_scale(features, fraction):
+    ''' The width of the central [fraction] of the values of each variable '''
+    tail = 50. * (1. - fraction)
+    low, high = numpy.percentile(features, [tail, 100. - tail], axis=0)
+    scale = high - low
+    scale[scale <= 0] = 1.
+    return scale
+
+
+class KNNEvaluator(object):
+    ''' kNN probability for an event to pass the cut '''
+    def __init__(self, variables, features, passed, weights, k=100,
+                 scale_frac=0.8):
+        self.variables = tuple(variables)
+        self.features = numpy.asarray(features, dtype=numpy.float64)
+        self.passed = numpy.asarray(passed, dtype=bool)
+        self.weights = numpy.asarray(weights, dtype=numpy.float64)
+        self.k = k
+        self.scale_frac = scale_frac
+        if self.features.shape != (len(self.weights), len(self.variables)):
+            raise ValueError("Expected features of shape %s, got %s" % (
+                (len(self.weights), len(self.variables)),
+                self.features.shape))
+        if scale_frac > 0:
+            self.scale = quantile_scale(self.features, scale_frac)
+        else:
+            self.scale = numpy.ones(len(self.variables))
+        self._build_tree()
+
+    def _build_tree(self):
+        scaled = self.features / self.scale
+        if cKDTree is not None:
+            self.tree = cKDTree(scaled)
+        else:
+            self.tree = KDTree(scaled)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['tree']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_tree()
+
+    @classmethod
+    def from_arrays(cls, columns, variables, cut, k=100, scale_frac=0.8):
+        ''' Build from a {name : array} of the training ntuple columns '''
+        features = numpy.column_stack([columns[x] for x in variables])
+        return cls(variables, features, columns[cut] != 0,
+                   columns['weight'], k, scale_frac)
+
+    @classmethod
+    def from_ntuple(cls, filename, variables, cut=None, k=100,
+                    scale_frac=0.8, ntuple='training_ntuple'):
+        ''' Read the training ntuple written by train_kNN.py
+
+        Its columns are the variables, the cut and the weight: if [cut] is
+        not given, it is the column after the variables.
+        '''
+        from FinalStateAnalysis.Utilities.rootbindings import ROOT
+        tfile = ROOT.TFile.Open(filename)
+        if not tfile:
+            raise IOError("Can't open file: %s" % filename)
+        training = tfile.Get(ntuple)
+        if not training:
+            raise IOError("Can't find %s in %s" % (ntuple, filename))
+        names = [x.GetName() for x in training.GetListOfBranches()]
+        nentries = training.GetEntries()
+        values = numpy.empty((nentries, len(names)))
+        for entry in xrange(nentries):
+            training.GetEntry(entry)
+            args = training.GetArgs()
+            values[entry] = [args[i] for i in xrange(len(names))]
+        tfile.Close()
+        if cut is None:
+            cut = names[len(variables)]
+        columns = dict((name, values[:, i]) for i, name in enumerate(names))
+        return cls.from_arrays(columns, variables, cut, k, scale_frac)
+
+    @classmethod
+    def from_xml(cls, xml_filename, ntuple='training_ntuple'):
+        ''' Use the variables and options of a TMVA kNN weights file
+
+        The training ntuple is read from the .root file next to it, where
+        train_kNN.py writes it.
+        '''
+        root = ElementTree.parse(xml_filename).getroot()
+        options = dict((option.get('name'), option.text)
+                       for option in root.iter('Option'))
+        variables = [variable.get('Expression') for variable in
+                     sorted(root.iter('Variable'),
+                            key=lambda x: int(x.get('VarIndex')))]
+        return cls.from_ntuple(
+            xml_filename.replace('weights.xml', 'root'), variables,
+            k=int(options.get('nkNN', 20)),
+            scale_frac=float(options.get('ScaleFrac', 0.8)), ntuple=ntuple)
+
+    def evaluate(self, features):
+        ''' Evaluate an array of features[event, variable]
+
+        The columns are in the order of self.variables.
+        '''
+        features = numpy.atleast_2d(numpy.asarray(features, numpy.float64))
+        k = min(self.k, len(self.weights))
+        scaled = features / self.scale
+        if cKDTree is not None:
+            distances, neighbours = self.tree.query(scaled, k)
+            neighbours = neighbours.reshape(len(features), k)
+        else:
+            neighbours = self.tree.query(scaled, k)
+        weights = self.weights[neighbours]
+        return (weights * self.passed[neighbours]).sum(axis=1) / \
+            weights.sum(axis=1)
+
+    def __call__(self, **kvars):
+        return self.evaluate([[kvars[x] for x in self.variables]])[0]
+
+
+if __name__ == "__main__":
+    import doctest; doctest.testmod()
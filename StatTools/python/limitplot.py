@@ -14,6 +14,7 @@ Author: Evan K. Friis, UW Madison
 
 '''
 
+from collections import OrderedDict
 import copy
 from FinalStateAnalysis.Utilities.graphsmoother import \
         smooth_graph as smoother
@@ -112,3 +113,19 @@ def build_obs_line(result, key):
 
 def build_exp_line(result, key):
     return build_line(result, key, 'exp', 2)
+
+def export_limits(result, key, smooth=-1, observed=True):
+    ''' Export the bands and lines of a limit plot as numbers
+
+    Returns a plot (see PlotTools.plotexport) with the 'twosig', 'onesig',
+    'exp' and (if [observed]) 'obs' graphs.
+    '''
+    from FinalStateAnalysis.PlotTools import plotexport
+    exp, onesig, twosig = build_expected_band(result, key, smooth)
+    graphs = [('twosig', twosig), ('onesig', onesig), ('exp', exp)]
+    if observed:
+        graphs.append(('obs', build_obs_line(result, key)))
+    plot = OrderedDict()
+    for name, graph in graphs:
+        plotexport.add_object(plot, graph, name)
+    return plot
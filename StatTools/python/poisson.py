@@ -23,6 +23,11 @@ Code taken from:
    }
 
 
+For drawing many histograms, poisson_errors_array() looks the intervals up in
+a table precomputed for N = 0...TABLE_MAX, and convert_bulk() sets all the
+points of the graph at once.  poisson_errors() and convert() are kept as the
+reference implementation.
+
 Command line usage:
 
    python poisson.py N
@@ -31,8 +36,15 @@ prints the upper and lower confidence interval to stdout.
 
 '''
 import sys
+import numpy
 import ROOT
 
+# The intervals are tabulated for N up to this value
+TABLE_MAX = 1000
+
+# (coverage, nmax) => (lower, upper) arrays for N = 0...nmax
+_tables = {}
+
 def poisson_errors(N, coverage=0.6827):
     alpha = 1.0-coverage
     L, U = 0, 0
@@ -47,6 +59,81 @@ def poisson_errors(N, coverage=0.6827):
     return L, U
 
 
+def poisson_table(coverage=0.6827, nmax=TABLE_MAX):
+    ''' Get arrays of the (lower, upper) intervals for N = 0...nmax '''
+    key = (coverage, nmax)
+    if key not in _tables:
+        lower = numpy.empty(nmax + 1)
+        upper = numpy.empty(nmax + 1)
+        for N in xrange(nmax + 1):
+            lower[N], upper[N] = poisson_errors(N, coverage)
+        _tables[key] = (lower, upper)
+    return _tables[key]
+
+
+def poisson_errors_array(N_array, coverage=0.6827, nmax=TABLE_MAX):
+    ''' Vectorized poisson_errors: get the (lower, upper) arrays for N_array
+
+    Values outside the table are computed with poisson_errors.
+    '''
+    N_array = numpy.asarray(N_array, dtype=numpy.int64)
+    lower_table, upper_table = poisson_table(coverage, nmax)
+    in_table = (N_array >= 0) & (N_array <= nmax)
+    index = numpy.where(in_table, N_array, 0)
+    lower = lower_table[index]
+    upper = upper_table[index]
+    for N in numpy.unique(N_array[~in_table]):
+        L, U = poisson_errors(int(N), coverage)
+        outside = N_array == N
+        lower[outside] = L
+        upper[outside] = U
+    return lower, upper
+
+
+def _graph_array(buffer, n):
+    ''' A writable view of the [n] points of a TGraph array '''
+    buffer.SetSize(n)
+    return numpy.frombuffer(buffer, dtype=numpy.float64, count=n)
+
+
+def convert_bulk(histogram, x_err=True, set_zero_bins=None, is_scaled=False,
+                 coverage=0.6827):
+    ''' Same as convert, with the errors computed for all points at once '''
+    output = ROOT.TGraphAsymmErrors(histogram)
+    n = output.GetN()
+    if not n:
+        return output
+    y = _graph_array(output.GetY(), n)
+    exl = _graph_array(output.GetEXlow(), n)
+    exh = _graph_array(output.GetEXhigh(), n)
+    eyl = _graph_array(output.GetEYlow(), n)
+    eyh = _graph_array(output.GetEYhigh(), n)
+
+    multiplier = numpy.ones(n)
+    if is_scaled:
+        multiplier = exh + exl
+    yields = y * multiplier
+    # Rounds to even, like TMath::Nint
+    N = numpy.rint(yields)
+    not_integer = numpy.flatnonzero(numpy.abs(yields - N) > 1e-4)
+    if len(not_integer):
+        i = not_integer[0]
+        raise ValueError("Bin %i has non-integer value %0.5f" %
+                         (i, yields[i]))
+    N = N.astype(numpy.int64)
+
+    if set_zero_bins is not None:
+        y[N == 0] = set_zero_bins
+
+    L, U = poisson_errors_array(N, coverage)
+    eyl[:] = (N - L) / multiplier
+    eyh[:] = (U - N) / multiplier
+    if not x_err:
+        exl[:] = 0
+        exh[:] = 0
+    return output
+
+
 def convert(histogram, x_err=True, set_zero_bins=None, is_scaled=False):
     ''' Convert a histogram into a TGraphAsymmErrors with Poisson errors '''
     output = ROOT.TGraphAsymmErrors(histogram)
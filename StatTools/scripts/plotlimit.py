@@ -24,7 +24,9 @@ if __name__ == "__main__":
 
     input_grp.add_argument('-o', '--output', dest="output",
                         type=str, required=True,
-                        help="Output plot file")
+                        help="Output plot file.  If it ends with .plot.json"
+                        " or .plot.npz, the limits are exported as numbers"
+                        " instead (see PlotTools/python/plotexport.py)")
 
     blurb_grp = parser.add_argument_group('blurb')
     blurb_grp.add_argument('--blurb', type=str, default='',
@@ -92,6 +94,12 @@ if __name__ == "__main__":
 
     key = (args.method, args.label)
 
+    from FinalStateAnalysis.PlotTools import plotexport
+    if plotexport.is_export(args.output):
+        plotexport.write_plot(limitplot.export_limits(
+            limit_data, key, args.smooth, not args.noobs), args.output)
+        sys.exit(0)
+
     canvas = ROOT.TCanvas("c", "c", args.cx, args.cy)
     canvas.SetRightMargin(0.05)
     canvas.SetLeftMargin(1.1*canvas.GetLeftMargin())
@@ -0,0 +1,48 @@
+'''
+
+Check the tabulated Poisson intervals against the reference implementation.
+
+'''
+
+from FinalStateAnalysis.StatTools.poisson import poisson_errors, \
+        poisson_errors_array, convert, convert_bulk
+import ROOT
+import unittest
+
+class TestPoisson(unittest.TestCase):
+    def test_table(self):
+        N = [0, 1, 2, 5, 17, 100, 999, 1000, 1001, 2500]
+        lower, upper = poisson_errors_array(N)
+        for i, n in enumerate(N):
+            L, U = poisson_errors(n)
+            self.assertAlmostEqual(lower[i], L)
+            self.assertAlmostEqual(upper[i], U)
+
+    def test_convert(self):
+        histo = ROOT.TH1F('test_poisson', 'test', 5, 0, 10)
+        for i, content in enumerate([0, 1, 4, 0, 25]):
+            histo.SetBinContent(i + 1, content)
+        for options in [(True, None, False), (False, 1e-3, False),
+                        (True, None, True)]:
+            if options[2]:
+                histo.Scale(0.5)
+            reference = convert(histo, *options)
+            bulk = convert_bulk(histo, *options)
+            self.assertEqual(reference.GetN(), bulk.GetN())
+            for i in range(reference.GetN()):
+                self.assertAlmostEqual(reference.GetY()[i], bulk.GetY()[i])
+                self.assertAlmostEqual(reference.GetErrorYlow(i),
+                                       bulk.GetErrorYlow(i))
+                self.assertAlmostEqual(reference.GetErrorYhigh(i),
+                                       bulk.GetErrorYhigh(i))
+                self.assertAlmostEqual(reference.GetErrorXlow(i),
+                                       bulk.GetErrorXlow(i))
+
+    def test_non_integer(self):
+        histo = ROOT.TH1F('test_poisson_bad', 'test', 2, 0, 2)
+        histo.SetBinContent(1, 0.5)
+        self.assertRaises(ValueError, convert_bulk, histo)
+
+
+if __name__ == '__main__':
+    unittest.main()
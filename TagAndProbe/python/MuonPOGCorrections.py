@@ -22,9 +22,14 @@ make_muon_pog_Mu17Mu8_Mu17_2012()
 make_muon_pog_Mu17Mu8_Mu8_2012()
 
 which do what they say on the tin. Each of these returns a corrector object
-that has a method "correction(pt, eta)". Note that the Mu17_Mu8 corrections are
+which is called as corrector(pt, eta). Note that the Mu17_Mu8 corrections are
 only available for 2012.
 
+The graphs are copied into GraphLookups (see Utilities/python/lookups.py)
+when the corrector is built, and the files are closed, so the correctors
+don't call ROOT and can be pickled.  They can also evaluate arrays of muons
+at once with corrector.evaluate(pt_array, eta_array).
+
 The trigger efficiencies for 2011 are encoded in a C++ file::
 interface/MuonPOG2011HLTEfficiencies.h
 
@@ -35,9 +40,11 @@ muon_pog_Mu13Mu8_eta_eta_2011(eta1, eta2)
 
 '''
 
+import numpy
 import os
 import re
 from FinalStateAnalysis.Utilities.rootbindings import ROOT
+from FinalStateAnalysis.Utilities.lookups import GraphLookup
 
 _DATA_DIR = os.path.join(os.environ['CMSSW_BASE'], 'src',
                          "FinalStateAnalysis", "TagAndProbe", "data")
@@ -203,6 +210,31 @@ def make_muon_pog_IsoMu24eta2p1_2012():
     )
 
 
+def load_graph_lookups(filename, *names):
+    ''' Load the graphs with the given names from a file, as GraphLookups
+
+    The file is closed before returning.
+    '''
+    file = ROOT.TFile.Open(filename)
+    if not file:
+        raise IOError("Can't open file: %s" % filename)
+    lookups = []
+    try:
+        for name in names:
+            key = file.GetKey(name)
+            if not key:
+                raise IOError("Object with name %s d.n.e. in file %s" %
+                              (name, filename))
+            obj = key.ReadObj()
+            if not obj:
+                raise IOError("Object with key name %s d.n.e. can't be read"
+                              % name)
+            lookups.append(GraphLookup.from_graph(obj))
+    finally:
+        file.Close()
+    return lookups
+
+
 class MuonPOGCorrection(object):
     '''
 
@@ -213,25 +245,13 @@ and pt dependent for pt < 20, split by barrel and endcap.
 
     def __init__(self, file, pt_barrel, pt_endcap, eta_pt20, abs_eta=False, pt_thr=20):
         self.filename = file
-        self.file = ROOT.TFile.Open(file)
         self.abs_eta = abs_eta
         self.pt_thr = pt_thr
 
         # Map the functions to the appropriate TGraphAsymmErrors
-        self.correct_by_pt_barrel = self.load_graph_eval_func(pt_barrel)
-        self.correct_by_pt_endcap = self.load_graph_eval_func(pt_endcap)
-        self.correct_by_eta_pt20 = self.load_graph_eval_func(eta_pt20)
-
-    def load_graph_eval_func(self, name):
-        ''' Load a graph with a given name form the file '''
-        key = self.file.GetKey(name)
-        if not key:
-            raise IOError("Object with name %s d.n.e. in file %s" %
-                          (name, self.filename))
-        obj = key.ReadObj()
-        if not obj:
-            raise IOError("Object with key name %s d.n.e. can't be read" % name)
-        return obj.Eval
+        (self.correct_by_pt_barrel, self.correct_by_pt_endcap,
+         self.correct_by_eta_pt20) = load_graph_lookups(
+             file, pt_barrel, pt_endcap, eta_pt20)
 
     def __call__(self, pt, eta):
         if pt < self.pt_thr:
@@ -244,6 +264,18 @@ and pt dependent for pt < 20, split by barrel and endcap.
                 eta = abs(eta)
             return self.correct_by_eta_pt20(eta)
 
+    def evaluate(self, pt, eta):
+        ''' Get the corrections for arrays of pt and eta '''
+        pt = numpy.asarray(pt, dtype=numpy.float64)
+        eta = numpy.asarray(eta, dtype=numpy.float64)
+        abseta = numpy.abs(eta)
+        by_pt = numpy.where(abseta < 1.2,
+                            self.correct_by_pt_barrel.evaluate(pt),
+                            self.correct_by_pt_endcap.evaluate(pt))
+        by_eta = self.correct_by_eta_pt20.evaluate(
+            abseta if self.abs_eta else eta)
+        return numpy.where(pt < self.pt_thr, by_pt, by_eta)
+
 
 class BetterMuonPOGCorrection(object):
     '''
@@ -255,25 +287,16 @@ and pt dependent for pt < 20, split by barrel and endcap. Accepts any number of
 
     def __init__(self, file, pt_corections, eta_correction, pt_thr=20, abs_eta=False):
         self.filename = file
-        self.file = ROOT.TFile.Open(file)
         self.abs_eta = abs_eta
         self.pt_thr = pt_thr
 
         # Map the functions to the appropriate TGraphAsymmErrors
-        self.correct_by_pt = [(thr, self.load_graph_eval_func(graph_name)) 
-                              for thr, graph_name in pt_corections]
-        self.correct_by_eta= self.load_graph_eval_func(eta_correction)
-
-    def load_graph_eval_func(self, name):
-        ''' Load a graph with a given name form the file '''
-        key = self.file.GetKey(name)
-        if not key:
-            raise IOError("Object with name %s d.n.e. in file %s" %
-                          (name, self.filename))
-        obj = key.ReadObj()
-        if not obj:
-            raise IOError("Object with key name %s d.n.e. can't be read" % name)
-        return obj.Eval
+        lookups = load_graph_lookups(
+            file, *([graph_name for thr, graph_name in pt_corections]
+                    + [eta_correction]))
+        self.correct_by_pt = [(thr, lookup) for (thr, graph_name), lookup
+                              in zip(pt_corections, lookups)]
+        self.correct_by_eta = lookups[-1]
 
     def __call__(self, pt, eta):
         if pt < self.pt_thr:
@@ -286,6 +309,22 @@ and pt dependent for pt < 20, split by barrel and endcap. Accepts any number of
                 compute_eta = abs(eta)
             return self.correct_by_eta(compute_eta)
 
+    def evaluate(self, pt, eta):
+        ''' Get the corrections for arrays of pt and eta
+
+        Muons with pt below threshold, outside of all the eta ranges, get NaN.
+        '''
+        pt = numpy.asarray(pt, dtype=numpy.float64)
+        eta = numpy.asarray(eta, dtype=numpy.float64)
+        abseta = numpy.abs(eta)
+        # The first matching eta range is used
+        by_pt = numpy.select(
+            [abseta < thr for thr, correction in self.correct_by_pt],
+            [correction.evaluate(pt) for thr, correction in self.correct_by_pt],
+            numpy.nan)
+        by_eta = self.correct_by_eta.evaluate(abseta if self.abs_eta else eta)
+        return numpy.where(pt < self.pt_thr, by_pt, by_eta)
+
 
 
 class MuonPOGCorrection3R(object):
@@ -298,25 +337,13 @@ class MuonPOGCorrection3R(object):
 
     def __init__(self, file, pt_barrel, pt_overlap, pt_endcap, eta_pt20, pt_thr=20):
         self.filename = file
-        self.file = ROOT.TFile.Open(file)
         self.pt_thr  = pt_thr
 
         # Map the functions to the appropriate TGraphAsymmErrors
-        self.correct_by_pt_barrel = self.load_graph_eval_func(pt_barrel)
-        self.correct_by_pt_overlap = self.load_graph_eval_func(pt_overlap)
-        self.correct_by_pt_endcap = self.load_graph_eval_func(pt_endcap)
-        self.correct_by_eta_pt20 = self.load_graph_eval_func(eta_pt20)
-
-    def load_graph_eval_func(self, name):
-        ''' Load a graph with a given name form the file '''
-        key = self.file.GetKey(name)
-        if not key:
-            raise IOError("Object with name %s d.n.e. in file %s" %
-                          (name, self.filename))
-        obj = key.ReadObj()
-        if not obj:
-            raise IOError("Object with key name %s d.n.e. can't be read" % name)
-        return obj.Eval
+        (self.correct_by_pt_barrel, self.correct_by_pt_overlap,
+         self.correct_by_pt_endcap, self.correct_by_eta_pt20) = \
+            load_graph_lookups(file, pt_barrel, pt_overlap, pt_endcap,
+                               eta_pt20)
 
     def __call__(self, pt, eta):
 
@@ -330,6 +357,20 @@ class MuonPOGCorrection3R(object):
         else:
             return self.correct_by_eta_pt20(eta)
 
+    def evaluate(self, pt, eta):
+        ''' Get the corrections for arrays of pt and eta '''
+        pt = numpy.asarray(pt, dtype=numpy.float64)
+        eta = numpy.asarray(eta, dtype=numpy.float64)
+        abseta = numpy.abs(eta)
+        by_pt = numpy.select(
+            [abseta < 0.9, abseta < 1.2, abseta >= 1.2],
+            [self.correct_by_pt_barrel.evaluate(pt),
+             self.correct_by_pt_overlap.evaluate(pt),
+             self.correct_by_pt_endcap.evaluate(pt)],
+            numpy.nan)
+        return numpy.where(pt < self.pt_thr, by_pt,
+                           self.correct_by_eta_pt20.evaluate(eta))
+
 
 
 
@@ -345,6 +386,10 @@ class MuonPOG2011Combiner(object):
         return self.corrA(pt, eta)*(2.1/4.6) + \
                 self.corrB(pt, eta)*(2.5/4.6)
 
+    def evaluate(self, pt, eta):
+        return self.corrA.evaluate(pt, eta)*(2.1/4.6) + \
+                self.corrB.evaluate(pt, eta)*(2.5/4.6)
+
 
 
 class MuonPOG2012Combiner(object):
@@ -360,6 +405,12 @@ class MuonPOG2012Combiner(object):
         return self.corrA(pt, eta)*(1./19.) + self.corrB(pt, eta)*(4./19.) + self.corrC(pt, eta)*(6./19.) + self.corrD(pt, eta)*(8./19.)
                 # CHECK THE NUMBERS!!! - Lumi split by ranges just a guess right now
 
+    def evaluate(self, pt, eta):
+        return self.corrA.evaluate(pt, eta)*(1./19.) + \
+                self.corrB.evaluate(pt, eta)*(4./19.) + \
+                self.corrC.evaluate(pt, eta)*(6./19.) + \
+                self.corrD.evaluate(pt, eta)*(8./19.)
+
 
 
 if __name__ == "__main__":
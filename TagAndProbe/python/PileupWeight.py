@@ -6,19 +6,144 @@ pileup distributions (generated by pileupCalc.py [1])
 
 [1] https://twiki.cern.ch/twiki/bin/view/CMS/PileupJSONFileforData
 
+The weights of each bin are computed once, and looked up without ROOT (see
+Utilities/python/lookups.py).  They are cached on disk, keyed by the MC tag
+and the contents of the MC and data files, so the jobs (and mega workers)
+after the first one don't open the ROOT files at all.  The cache is in
+$CMSSW_BASE/tmp/pu_weights, or in $PU_WEIGHT_CACHE if it is set.
+
+Several run eras can be combined, weighted by their integrated luminosity:
+
+    weight = PileupWeight('S10', eras=[
+        (5.3, ['pu_2012A.root']),
+        (14.3, ['pu_2012B.root', 'pu_2012C.root']),
+    ])
+
 Author: Evan K. Friis, UW
 
 '''
 
-import array
+import hashlib
+import logging
+import numpy
+import os
+import tempfile
 from FinalStateAnalysis.Utilities.FileInPath import FileInPath
+from FinalStateAnalysis.Utilities.lookups import BinnedLookup
 import ROOT
 
+log = logging.getLogger("PileupWeight")
+
 # MC distributions (built at bottom of file)
 _MC_PU_DISTRIBUTIONS = {}
 
+
+def cache_directory():
+    ''' Where the weights are cached '''
+    if 'PU_WEIGHT_CACHE' in os.environ:
+        return os.environ['PU_WEIGHT_CACHE']
+    base = os.environ.get('CMSSW_BASE', tempfile.gettempdir())
+    return os.path.join(base, 'tmp', 'pu_weights')
+
+
+def _update_hash(hash, filename):
+    with open(filename, 'rb') as input:
+        for block in iter(lambda: input.read(1 << 20), ''):
+            hash.update(block)
+
+
+def weights_key(mctag, eras):
+    ''' Hash of the inputs of the weights of [eras] for [mctag] '''
+    hash = hashlib.md5(mctag)
+    _update_hash(hash, _MC_PU_DISTRIBUTIONS[mctag])
+    for fraction, datafiles in eras:
+        hash.update(repr(fraction))
+        for filename in datafiles:
+            _update_hash(hash, filename)
+    return hash.hexdigest()
+
+
+def pileup_distribution(filenames):
+    ''' Sum the pileup histograms in [filenames], normalized to 1
+
+    Returns a BinnedLookup, including the under/overflows.
+    '''
+    total = None
+    for filename in filenames:
+        file = ROOT.TFile.Open(filename)
+        if not file:
+            raise IOError("Can't open PU file: %s" % filename)
+        pu = file.Get('pileup')
+        if total is None:
+            total = pu.Clone()
+            total.SetDirectory(0)
+        else:
+            total.Add(pu)
+        file.Close()
+    distribution = BinnedLookup.from_histogram(total, flow=True)
+    # Normalize to the integral without the under/overflows, as TH1::Integral
+    values = distribution.values / distribution.values[1:-1].sum()
+    return BinnedLookup(distribution.edges, values)
+
+
+def _check_binning(mctag, mc, data):
+    ''' Make sure the data and MC have the same binning '''
+    mc_edges = mc.edges[0][1:-1]
+    data_edges = data.edges[0][1:-1]
+    if len(mc_edges) == len(data_edges) and numpy.allclose(
+            mc_edges, data_edges):
+        return
+    error = "Data and MC PU histograms do not have the same binning!\n"
+    def print_bins(tag, x):
+        return "%s: (%i, %0.1f, %0.1f)" % (tag, len(x) - 1, x[0], x[-1])
+    error += print_bins(mctag, mc_edges)
+    error += "\n"
+    error += print_bins('data', data_edges)
+    raise ValueError(error)
+
+
+def compute_weights(mctag, eras):
+    ''' Compute the data/MC ratio for a list of (fraction, datafiles)
+
+    The weight is 1 where there is no MC.
+    '''
+    mc = pileup_distribution([_MC_PU_DISTRIBUTIONS[mctag]])
+    data = numpy.zeros(mc.values.shape)
+    for fraction, datafiles in eras:
+        era = pileup_distribution(datafiles)
+        _check_binning(mctag, mc, era)
+        data += fraction * era.values
+    weights = numpy.ones(mc.values.shape)
+    filled = mc.values != 0
+    weights[filled] = data[filled] / mc.values[filled]
+    return BinnedLookup(mc.edges, weights)
+
+
+def cached_weights(mctag, eras):
+    ''' Get the weights from the cache, or compute and cache them '''
+    filename = os.path.join(cache_directory(),
+                            weights_key(mctag, eras) + '.json')
+    if os.path.exists(filename):
+        try:
+            return BinnedLookup.load(filename)
+        except (IOError, ValueError), e:
+            log.warning("Can't read cached PU weights %s: %s", filename, e)
+    weights = compute_weights(mctag, eras)
+    try:
+        if not os.path.isdir(cache_directory()):
+            os.makedirs(cache_directory())
+        # Write and rename, as other jobs may be reading it
+        fd, tmp = tempfile.mkstemp(dir=cache_directory())
+        os.close(fd)
+        weights.save(tmp)
+        os.rename(tmp, filename)
+    except (IOError, OSError), e:
+        log.warning("Can't cache PU weights in %s: %s", filename, e)
+    return weights
+
+
 class PileupWeight(object):
-    def __init__(self, mctag, *datafiles):
+    def __init__(self, mctag, *datafiles, **kwargs):
         '''
         Build a PU weight object.
 
@@ -32,58 +157,47 @@ class PileupWeight(object):
         Note that for 7TeV data there must be 500 bins (0-50) and for 8TeV there
         should 600 bins (0-60)
 
+        Instead of [datafiles], eras=[(lumi, datafiles), ...] combines the
+        (normalized) data distributions of several eras, weighted by their
+        int. lumi.
+
+        With cache=False, the weights are always computed from the files.
+
         '''
-        self.data = None
-        for filename in datafiles:
-            file = ROOT.TFile.Open(filename)
-            pu = file.Get('pileup')
-            if self.data is None:
-                self.data = pu.Clone()
-                self.data.SetDirectory(0)
-            else:
-                self.data.Add(pu)
-            file.Close()
-
-        # Normalize
-        self.data.Scale(1./self.data.Integral())
+        eras = kwargs.pop('eras', None)
+        cache = kwargs.pop('cache', True)
+        if kwargs:
+            raise TypeError("Unknown arguments: %s" % ", ".join(kwargs))
+        if eras is None:
+            eras = [(1., datafiles)]
+        elif datafiles:
+            raise ValueError("Give either the data files or the eras")
+        total_lumi = float(sum(lumi for lumi, files in eras))
+        self.eras = [(lumi / total_lumi, list(files)) for lumi, files in eras]
 
         if not mctag in _MC_PU_DISTRIBUTIONS:
             raise KeyError("Unknown PU distribution %s, allowed: %s" %
                            (mctag, " ".join(_MC_PU_DISTRIBUTIONS.keys())))
-
-        mc_file = ROOT.TFile.Open(_MC_PU_DISTRIBUTIONS[mctag])
-        if not mc_file:
+        if not os.path.exists(_MC_PU_DISTRIBUTIONS[mctag]):
             raise IOError("Can't open %s MC file: %s" % (mctag, _MC_PU_DISTRIBUTIONS[mctag]))
+        self.mctag = mctag
 
-        mc_base = mc_file.Get('pileup')
-        self.mc = mc_base.Clone()
-
-        # Make sure bins are consistent
-        if not ROOT.TEfficiency.CheckBinning(self.mc, self.data):
-            error = "Data and MC PU histograms do not have the same binning!\n"
-            def print_bins(tag, x):
-                return "%s: (%i, %0.1f, %0.1f)" % (
-                    tag, x.GetNbinsX(), x.GetXaxis().GetXmin(),
-                    x.GetXaxis().GetXmax())
-            error += print_bins(mctag, self.mc)
-            error += "\n"
-            error += print_bins('data', self.data)
-            raise ValueError(error)
-
-        # Normalize MC
-        self.mc.Scale(1./self.mc.Integral())
+        if cache:
+            self.lookup = cached_weights(mctag, self.eras)
+        else:
+            self.lookup = compute_weights(mctag, self.eras)
 
     def __call__(self, ntruepu):
         '''
         Get the PU weight given the true number of interactions
         '''
-        bin = self.data.FindBin(ntruepu)
-        data = self.data.GetBinContent(bin)
-        mc = self.mc.GetBinContent(bin)
-        if mc:
-            return data/mc
-        else:
-            return 1.0
+        return self.lookup(ntruepu)
+
+    def weights(self, ntruepu):
+        '''
+        Get the PU weights for an array of true numbers of interactions
+        '''
+        return self.lookup.evaluate(ntruepu)
 
 _MC_PU_DISTRIBUTIONS['S10'] = FileInPath("FinalStateAnalysis/TagAndProbe/data/MC_Summer12_PU_S10-600bins.root").full_path()
 _MC_PU_DISTRIBUTIONS['S7'] = 'fixme'
@@ -0,0 +1,45 @@
+/*
+ * LatencyFile
+ *
+ * A local TFile which sleeps for a fixed time on every read call, to
+ * simulate reading over a high latency network (i.e. xrootd) when testing
+ * I/O tuning.
+ *
+ * Files are opened through TFile::Open with a "latency://" prefix:
+ *
+ *   LatencyFile::SetLatency(20000); // 20 ms per read call
+ *   LatencyFile::RegisterPlugin();
+ *   TFile* file = TFile::Open("latency:///path/to/file.root");
+ *
+ */
+
+#ifndef LATENCYFILE_P7D3NRZA
+#define LATENCYFILE_P7D3NRZA
+
+#include "TFile.h"
+
+class LatencyFile : public TFile {
+  public:
+    LatencyFile(const char* url, Option_t* option="",
+        const char* ftitle="", Int_t compress=1);
+    virtual ~LatencyFile() {}
+
+    virtual Bool_t ReadBuffer(char* buf, Int_t len);
+    virtual Bool_t ReadBuffer(char* buf, Long64_t pos, Int_t len);
+    virtual Bool_t ReadBuffers(char* buf, Long64_t* pos, Int_t* len,
+        Int_t nbuf);
+
+    // Set the simulated latency (in microseconds) for all files
+    static void SetLatency(UInt_t microseconds);
+    static UInt_t GetLatency();
+    // Register the "latency://" prefix with the TFile plugin manager
+    static void RegisterPlugin();
+
+  private:
+    void wait() const;
+    static UInt_t latency_;
+
+    ClassDef(LatencyFile, 0)
+};
+
+#endif
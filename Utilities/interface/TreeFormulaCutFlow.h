@@ -0,0 +1,53 @@
+/*
+ * TreeFormulaCutFlow
+ *
+ * Evaluates a list of cut expressions (TTreeFormulas) on a range of TTree
+ * entries in a single native loop.  For each entry, the cuts are applied in
+ * order, and the number of entries passing each successive cut is counted.
+ *
+ * The per-entry result of the full AND of the cuts can be copied into an
+ * integer buffer (i.e. a numpy int32 array) with fillMask.
+ *
+ */
+
+#ifndef TREEFORMULACUTFLOW_K2W8XQ4T
+#define TREEFORMULACUTFLOW_K2W8XQ4T
+
+#include <vector>
+#include <string>
+#include "Rtypes.h"
+
+class TTree;
+class TTreeFormula;
+
+class TreeFormulaCutFlow {
+  public:
+    TreeFormulaCutFlow(TTree* tree, const std::vector<std::string>& cuts);
+    ~TreeFormulaCutFlow();
+
+    // Process [nentries] entries starting at [firstEntry].  If nentries is
+    // negative, process until the end of the tree.  Returns the number of
+    // entries processed.  The counts and mask are those of the last call.
+    Long64_t process(Long64_t firstEntry=0, Long64_t nentries=-1);
+
+    size_t nCuts() const { return formulas_.size(); }
+    // Number of entries passing cuts 0...i in the last call to process
+    Long64_t passed(size_t i) const { return passed_.at(i); }
+    // Number of entries passing cut i, irrespective of the others
+    Long64_t passedIndividually(size_t i) const {
+      return passedIndividually_.at(i); }
+    // Number of entries in the last call to process
+    Long64_t nProcessed() const { return mask_.size(); }
+    // Copy the mask (1 if the entry passed all cuts) of the last call to
+    // process into [output], which must hold nProcessed() entries.
+    void fillMask(Int_t* output) const;
+
+  private:
+    TTree* tree_;
+    std::vector<TTreeFormula*> formulas_;
+    std::vector<Long64_t> passed_;
+    std::vector<Long64_t> passedIndividually_;
+    std::vector<Int_t> mask_;
+};
+
+#endif
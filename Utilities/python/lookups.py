@@ -0,0 +1,209 @@
+'''
+
+Lookup tables which don't need ROOT once they are built.
+
+Corrections are often stored as TGraphs or histograms, and evaluated through
+PyROOT for every object of every event.  The lookups here copy the points (or
+bins) once into plain python lists and NumPy arrays.  They can be called with
+a single value, or evaluated for whole arrays at once, and can be pickled
+(i.e. to send them to the mega workers).
+
+GraphLookup reproduces TGraph::Eval: linear interpolation between the points,
+and linear extrapolation from the first (last) two points outside of them.
+With clamp=True, the first (last) value is used outside of them instead.
+
+>>> lookup = GraphLookup([1., 2., 4.], [1., 3., 4.])
+>>> lookup(1.5)
+2.0
+>>> lookup(3.)
+3.5
+>>> lookup(0.)
+-1.0
+>>> lookup.evaluate([1., 1.5, 5.]).tolist()
+[1.0, 2.0, 4.5]
+>>> clamped = GraphLookup([1., 2., 4.], [1., 3., 4.], clamp=True)
+>>> clamped(0.), clamped.evaluate([1.5, 5.]).tolist()
+(1.0, [2.0, 4.0])
+
+BinnedLookup gives the contents of the bin of a 1, 2 or 3D histogram where the
+values fall.  Values outside of the axes get the first (last) bin, unless the
+under/overflow bins are kept:
+
+>>> weights = BinnedLookup([[0., 10., 20.], [0., 1.5, 2.5]],
+...                        [[1.1, 1.2], [0.9, 0.8]])
+>>> weights(15., 0.5)
+0.9
+>>> weights(-5., 3.)
+1.2
+>>> weights.evaluate([5., 15., 25.], [2., 2., 0.]).tolist()
+[1.2, 0.8, 0.9]
+
+They can be saved to (and loaded from) JSON files, which don't need ROOT to
+be read:
+
+>>> BinnedLookup.from_dict(weights.to_dict())(15., 0.5)
+0.9
+
+'''
+
+import bisect
+import json
+import numpy
+
+
+class GraphLookup(object):
+    ''' Piecewise linear function through the points of a TGraph '''
+    __slots__ = ['x', 'y', 'clamp', '_x', '_y']
+
+    def __init__(self, x, y, clamp=False):
+        order = numpy.argsort(x, kind='mergesort')
+        self.x = numpy.asarray(x, dtype=numpy.float64)[order]
+        self.y = numpy.asarray(y, dtype=numpy.float64)[order]
+        # Don't extrapolate outside of the points
+        self.clamp = clamp
+        # Python lists are faster than arrays for single values
+        self._x = self.x.tolist()
+        self._y = self.y.tolist()
+
+    @classmethod
+    def from_graph(cls, graph):
+        ''' Copy the points of a TGraph '''
+        n = graph.GetN()
+        x = graph.GetX()
+        y = graph.GetY()
+        return cls([x[i] for i in xrange(n)], [y[i] for i in xrange(n)])
+
+    def __getstate__(self):
+        return (self.x, self.y, self.clamp)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __call__(self, x):
+        xs = self._x
+        ys = self._y
+        n = len(xs)
+        if n < 2:
+            return ys[0] if n else 0.
+        if self.clamp:
+            x = min(max(x, xs[0]), xs[-1])
+        up = bisect.bisect_right(xs, x)
+        low = min(max(up - 1, 0), n - 2)
+        up = low + 1
+        if xs[low] == x:
+            return ys[low]
+        if xs[low] == xs[up]:
+            return ys[low]
+        # Same expression as in TGraph::Eval
+        return ys[up] + (x - xs[up]) * (ys[low] - ys[up]) / (xs[low] - xs[up])
+
+    def evaluate(self, x):
+        ''' Evaluate for an array of values '''
+        x = numpy.asarray(x, dtype=numpy.float64)
+        n = len(self.x)
+        if n < 2:
+            return numpy.full(x.shape, self.y[0] if n else 0.)
+        if self.clamp:
+            x = numpy.clip(x, self.x[0], self.x[-1])
+        low = numpy.clip(
+            numpy.searchsorted(self.x, x, side='right') - 1, 0, n - 2)
+        up = low + 1
+        x_low, x_up = self.x[low], self.x[up]
+        y_low, y_up = self.y[low], self.y[up]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            result = y_up + (x - x_up) * (y_low - y_up) / (x_low - x_up)
+        return numpy.where((x_low == x) | (x_low == x_up), y_low, result)
+
+
+class BinnedLookup(object):
+    ''' The bin contents of a 1-3D histogram, as NumPy arrays
+
+    [edges] is a list with the bin edges of each axis, and [values] an
+    array of the bin contents indexed as [x][y][z].
+
+    '''
+    __slots__ = ['edges', 'values', '_edges', '_values']
+
+    def __init__(self, edges, values):
+        self.edges = [numpy.asarray(x, dtype=numpy.float64) for x in edges]
+        self.values = numpy.array(values, dtype=numpy.float64)
+        if not 1 <= len(self.edges) <= 3:
+            raise ValueError("Only 1 to 3 dimensions are supported")
+        expected = tuple(len(x) - 1 for x in self.edges)
+        if self.values.shape != expected:
+            raise ValueError("Expected values of shape %s, got %s" % (
+                expected, self.values.shape))
+        self._edges = [x.tolist() for x in self.edges]
+        self._values = self.values.tolist()
+
+    @classmethod
+    def from_histogram(cls, histo, flow=False):
+        ''' Copy the bins of a TH1, TH2 or TH3
+
+        If [flow] is True, the under/overflow bins are kept, so values
+        outside of the axes get their contents, as with TH1::FindBin.
+        '''
+        from FinalStateAnalysis.PlotTools import histarrays
+        edges = histarrays.all_edges(histo)
+        # [z, y, x] => [x, y, z]
+        values = histarrays.get_contents(histo).reshape(
+            histarrays.shape(histo)).transpose()
+        if flow:
+            edges = [numpy.concatenate([[-numpy.inf], x, [numpy.inf]])
+                     for x in edges]
+        else:
+            values = values[tuple(slice(1, -1) for x in edges)]
+        return cls(edges, values)
+
+    def __getstate__(self):
+        return (self.edges, self.values)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def to_dict(self):
+        ''' A JSON-able representation '''
+        # JSON has no infinities, they are stored as None
+        edges = [[x if numpy.isfinite(x) else None for x in axis]
+                 for axis in self._edges]
+        return {'edges': edges, 'values': self._values}
+
+    @classmethod
+    def from_dict(cls, data):
+        edges = [[x if x is not None else (-numpy.inf if i == 0 else numpy.inf)
+                  for i, x in enumerate(axis)] for axis in data['edges']]
+        return cls(edges, data['values'])
+
+    def save(self, filename):
+        with open(filename, 'w') as output:
+            json.dump(self.to_dict(), output)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as input:
+            return cls.from_dict(json.load(input))
+
+    def _bin(self, axis, x):
+        index = bisect.bisect_right(self._edges[axis], x) - 1
+        last = len(self._edges[axis]) - 2
+        return index if 0 <= index <= last else (0 if index < 0 else last)
+
+    def __call__(self, *x):
+        values = self._values
+        for axis, value in enumerate(x):
+            values = values[self._bin(axis, value)]
+        return values
+
+    def bins(self, *x):
+        ''' Get the (clamped) bin indices of arrays of values on each axis '''
+        indices = []
+        for edges, values in zip(self.edges, x):
+            index = numpy.searchsorted(
+                edges, numpy.asarray(values, dtype=numpy.float64),
+                side='right') - 1
+            indices.append(numpy.clip(index, 0, len(edges) - 2))
+        return tuple(indices)
+
+    def evaluate(self, *x):
+        ''' Look up arrays of values on each axis '''
+        return self.values[self.bins(*x)]
@@ -2,72 +2,265 @@
 """
 Enables running hadd on a large number of files w/out crashing hadd.
 
+The input files are merged n_files at a time into intermediate files, by a
+pool of processes.  The intermediate files are merged again in groups of
+n_files, and so on, until a single file is left, which is moved to the output.
+
+The intermediate files are kept in a work directory next to the output file
+(by default <outfile>.merge/), along with a manifest of the merges which are
+done.  If the merge is interrupted, running the same command again resumes it
+where it stopped.  A lock in the work directory prevents two merges of the
+same output from running at once.
+
+With --histos-only, the histograms are summed as arrays in memory instead of
+running hadd.  This is much faster for files with many histograms, but
+doesn't work for files containing trees, profiles or histograms with bin
+labels.
+
 Author: D. Austin Belknap, UW-Madison
 """
 
 import sys
 import os
 import argparse
-
-from Queue import Queue
-from threading import Thread
+import errno
+import hashlib
+import json
+import multiprocessing
+import shutil
+import signal
+import subprocess
 
 
 def hadd(outfile, infiles):
     """This makes a simple call to hadd"""
-    cmd = "hadd " + outfile + " " + " ".join(infiles)
-    os.system(cmd)
+    cmd = ["hadd", "-f", outfile] + list(infiles)
+    status = subprocess.call(cmd)
+    if status:
+        raise RuntimeError("hadd into %s failed with status %i"
+                           % (outfile, status))
 
 
-def worker(q):
+def read_histogram_arrays(directory, histos, path=''):
     """
-    Runs a single instance of hadd from the job queue.
+    Add the bins of all the histograms in a ROOT directory into [histos], a
+    dictionary of {path : histarrays.to_arrays(histo)}.
+
+    As in hadd, only the highest cycle of each key is used.
     """
-    while True:
-        outfile, infiles = q.get()
-        print outfile
-        hadd(outfile, infiles)
-        q.task_done()
+    import ROOT
+    from FinalStateAnalysis.PlotTools import histarrays
+    seen = set()
+    for key in directory.GetListOfKeys():
+        name = key.GetName()
+        # The keys are sorted by decreasing cycle
+        if name in seen:
+            continue
+        seen.add(name)
+        full_path = os.path.join(path, name)
+        obj = key.ReadObj()
+        if isinstance(obj, ROOT.TDirectory):
+            read_histogram_arrays(obj, histos, full_path)
+        elif isinstance(obj, ROOT.TH1):
+            # Not owned by the file (AddDirectory is off), so delete it here
+            ROOT.SetOwnership(obj, True)
+            try:
+                arrays = histarrays.to_arrays(obj)
+            except TypeError, e:
+                raise TypeError("%s: can't merge with --histos-only, use "
+                                "plain hadd (%s)" % (full_path, e))
+            if full_path in histos:
+                histarrays.add_arrays(histos[full_path], arrays)
+            else:
+                histos[full_path] = arrays
+            del obj
+        else:
+            raise TypeError("%s is a %s, not a histogram: can't merge "
+                            "with --histos-only" % (full_path, obj.ClassName()))
 
 
-def batch_hadd(outfile, infiles, n_files=200, n_threads=1):
+def sum_histograms(outfile, infiles):
+    """Sum the histograms of [infiles] in memory and write them to [outfile]"""
+    import ROOT
+    from FinalStateAnalysis.PlotTools import histarrays
+    from FinalStateAnalysis.PlotTools.MegaTreeMerger import write_histograms
+    ROOT.TH1.AddDirectory(False)
+    histos = {}
+    for infile in infiles:
+        tfile = ROOT.TFile.Open(infile, 'READ')
+        if not tfile:
+            raise IOError("Can't open ROOT file: %s" % infile)
+        read_histogram_arrays(tfile, histos)
+        tfile.Close()
+    write_histograms(dict(
+        (path, histarrays.from_arrays(arrays))
+        for path, arrays in histos.iteritems()), outfile)
+
+
+def init_worker():
+    """Let the parent take care of Ctrl-c"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def merge(job):
     """
-    This runs hadd on smaller chunks of files and merges them into intermediate
-    files. Then hadd is run to merge the intermidate files into the final file.
+    Merge the inputs of a job into its output.  The output is written under a
+    temporary name, so a crash never leaves a partial output behind.
     """
+    outfile, infiles, histos_only = job
+    partial = outfile + ".part"
+    if histos_only:
+        sum_histograms(partial, infiles)
+    else:
+        hadd(partial, infiles)
+    os.rename(partial, outfile)
+    return outfile
 
-    # split the list of input files into sublists
-    split_infiles = [infiles[x:x+n_files]
-                     for x in xrange(0, len(infiles), n_files)]
 
-    intermediate_files = []
+class Manifest(object):
+    """
+    The record of the merges done in a work directory, for a given output and
+    list of inputs.
+    """
+    def __init__(self, work_dir, outfile, infiles):
+        self.filename = os.path.join(work_dir, "manifest.json")
+        hash = hashlib.md5(outfile)
+        for infile in infiles:
+            hash.update(infile)
+        self.key = hash.hexdigest()
+        # intermediate file => its input files
+        self.done = {}
+        try:
+            with open(self.filename) as manifest:
+                data = json.load(manifest)
+        except (IOError, ValueError):
+            return
+        if data.get('key') == self.key:
+            self.done = data['done']
+
+    def is_done(self, outfile):
+        """
+        True if [outfile] was merged, and either still exists or was merged
+        into a file which is done.
+        """
+        if outfile not in self.done:
+            return False
+        if os.path.exists(outfile):
+            return True
+        return any(outfile in infiles and self.is_done(merged)
+                   for merged, infiles in self.done.iteritems())
 
-    user_name = os.environ['USER']
+    def add(self, outfile, infiles):
+        self.done[outfile] = infiles
+        # Write and rename, so the manifest is never half written
+        with open(self.filename + ".tmp", "w") as manifest:
+            json.dump({'key': self.key, 'done': self.done}, manifest)
+        os.rename(self.filename + ".tmp", self.filename)
 
-    q = Queue()
 
-    # Create worker threads
-    for i in range(n_threads):
-        t = Thread(target=worker, args=(q,))
-        t.daemon = True
-        t.start()
+def lock_work_dir(work_dir):
+    """
+    Take the lock of a work directory, failing if another (running) process
+    holds it.  Returns the name of the lock file.
+    """
+    lock = os.path.join(work_dir, "lock")
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            with open(lock) as lock_file:
+                pid = lock_file.read().strip()
+            try:
+                os.kill(int(pid), 0)
+            except (OSError, ValueError):
+                # Left behind by a merge which died
+                os.remove(lock)
+                continue
+            raise RuntimeError("%s is being merged by process %s" %
+                               (work_dir, pid))
+        os.write(fd, str(os.getpid()))
+        os.close(fd)
+        return lock
 
-    # Queue up the individual hadd jobs
-    for i, file_list in enumerate(split_infiles):
-        # Use unique names for the intermediate files to avoid collisions
-        intm_file = ("/tmp/tmp_" + user_name + "_" + str(i) + "_" +
-                     os.path.basename(outfile))
-        intermediate_files.append(intm_file)
-        q.put((intm_file, file_list))
 
-    # Block until all hadd threads have completed
-    q.join()
+def intermediate_name(work_dir, level, infiles):
+    """A unique name for the merge of [infiles] at a level of the tree"""
+    hash = hashlib.md5()
+    for infile in infiles:
+        hash.update(infile)
+    return os.path.join(work_dir, "L%i_%s.root" % (level, hash.hexdigest()))
+
+
+def batch_hadd(outfile, infiles, n_files=200, n_jobs=1, histos_only=False,
+               work_dir=None, keep_work_dir=False):
+    """
+    This runs hadd on smaller chunks of files and merges them into intermediate
+    files. The intermediate files are then merged the same way, until there is
+    a single file left.
+    """
+    infiles = [os.path.abspath(x) for x in infiles]
+    outfile = os.path.abspath(outfile)
+    if work_dir is None:
+        work_dir = outfile + ".merge"
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    lock = lock_work_dir(work_dir)
+    manifest = Manifest(work_dir, outfile, infiles)
+    n_files = max(n_files, 2)
 
-    # merge the intermediate files together
-    hadd(outfile, intermediate_files)
+    pool = None
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, init_worker)
+    try:
+        level = 0
+        current = infiles
+        while True:
+            groups = [current[x:x+n_files]
+                      for x in xrange(0, len(current), n_files)]
+            jobs = []
+            outputs = []
+            for group in groups:
+                intermediate = intermediate_name(work_dir, level, group)
+                outputs.append(intermediate)
+                if manifest.is_done(intermediate):
+                    continue
+                jobs.append((intermediate, group, histos_only))
+            print "Level %i: merging %i files into %i (%i already done)" % (
+                level, len(current), len(groups), len(groups) - len(jobs))
+            job_inputs = dict((job[0], job[1]) for job in jobs)
+            if pool is not None:
+                results = pool.imap_unordered(merge, jobs)
+            else:
+                results = (merge(job) for job in jobs)
+            for done in results:
+                print done
+                manifest.add(done, job_inputs[done])
+            # The inputs of this level are not needed anymore, except the
+            # original ones.
+            if level > 0:
+                for intermediate in current:
+                    if os.path.exists(intermediate):
+                        os.remove(intermediate)
+            current = outputs
+            level += 1
+            if len(current) == 1:
+                break
+    except:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        os.remove(lock)
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    # remove the intermediate files
-    os.system("rm " + " ".join(intermediate_files))
+    shutil.move(current[0], outfile)
+    os.remove(lock)
+    if not keep_work_dir:
+        shutil.rmtree(work_dir)
 
 
 def parse_command_line(argv):
@@ -80,9 +273,20 @@ def parse_command_line(argv):
     parser.add_argument('--files-per-job', type=int, default=200,
                         help='Number of files to merge with hadd at one time. '
                              'Default is 200.')
-    parser.add_argument('--n-threads', type=int, default=1,
-                        help='Number of instances of hadd to run at one time. '
-                             'Default is 1.')
+    parser.add_argument('--n-jobs', '--n-threads', dest='n_jobs', type=int,
+                        default=1,
+                        help='Number of merges to run at one time, in '
+                             'separate processes. Default is 1.')
+    parser.add_argument('--histos-only', action='store_true',
+                        help='Sum the histograms in memory instead of '
+                             'running hadd. The files must only contain '
+                             'histograms, without profiles or bin labels.')
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='Directory for the intermediate files and the '
+                             'checkpoint manifest. Default is '
+                             '<outfile>.merge')
+    parser.add_argument('--keep-work-dir', action='store_true',
+                        help="Don't remove the work directory at the end.")
     args = parser.parse_args(argv)
 
     return args
@@ -94,7 +298,8 @@ def main(argv=None):
 
     args = parse_command_line(argv)
 
-    batch_hadd(args.outfile, args.infiles, args.files_per_job, args.n_threads)
+    batch_hadd(args.outfile, args.infiles, args.files_per_job, args.n_jobs,
+               args.histos_only, args.work_dir, args.keep_work_dir)
 
     return 0
 
@@ -9,6 +9,7 @@ Author: Evan K. Friis
 '''
 
 from RecoLuminosity.LumiDB import argparse
+import fnmatch
 import json
 import os
 import sys
@@ -28,22 +29,32 @@ if __name__ == "__main__":
     parser.add_argument('file', help="ROOT file")
     parser.add_argument('--json', action='store_true',
                         help="Write output in JSON format")
+    parser.add_argument('--no-index', action='store_true', dest='no_index',
+                        help="Walk the file, instead of using its key "
+                        "index")
 
     args = parser.parse_args()
 
-    # Import after, so ROOT can't mess with sys.argv
-    import rootpy.io as io
+    results = {}
 
-    file = io.open(args.file)
+    if not args.no_index:
+        from FinalStateAnalysis.PlotTools import keyindex
+        index = keyindex.get_index(args.file)
+        for full_path, info in index['objects'].iteritems():
+            if fnmatch.fnmatch(info['class'], 'TH1*'):
+                results[full_path] = (info['integral'], info['error'])
+    else:
+        # Import after, so ROOT can't mess with sys.argv
+        import rootpy.io as io
 
-    results = {}
+        file = io.open(args.file)
 
-    for path, dirs, histonames in file.walk(class_pattern='TH1*'):
-        for histoname in histonames:
-            full_path = os.path.join(path, histoname)
-            histo = file.Get(full_path)
-            int, err = get_integral(histo)
-            results[full_path] = (int, err)
+        for path, dirs, histonames in file.walk(class_pattern='TH1*'):
+            for histoname in histonames:
+                full_path = os.path.join(path, histoname)
+                histo = file.Get(full_path)
+                int, err = get_integral(histo)
+                results[full_path] = (int, err)
 
     if not args.json:
         for full_path, (int, err) in results.iteritems():
@@ -0,0 +1,60 @@
+#include "FinalStateAnalysis/Utilities/interface/LatencyFile.h"
+#include "TROOT.h"
+#include "TPluginManager.h"
+#include <string>
+#include <unistd.h>
+
+ClassImp(LatencyFile)
+
+UInt_t LatencyFile::latency_ = 0;
+
+namespace {
+  // Strip the latency:// prefix to get the local file name
+  std::string localPath(const char* url) {
+    std::string path(url);
+    const std::string prefix("latency://");
+    if (path.compare(0, prefix.size(), prefix) == 0)
+      path = path.substr(prefix.size());
+    return path;
+  }
+}
+
+LatencyFile::LatencyFile(const char* url, Option_t* option,
+    const char* ftitle, Int_t compress):
+  TFile(localPath(url).c_str(), option, ftitle, compress) {}
+
+void LatencyFile::wait() const {
+  if (latency_)
+    usleep(latency_);
+}
+
+Bool_t LatencyFile::ReadBuffer(char* buf, Int_t len) {
+  wait();
+  return TFile::ReadBuffer(buf, len);
+}
+
+Bool_t LatencyFile::ReadBuffer(char* buf, Long64_t pos, Int_t len) {
+  wait();
+  return TFile::ReadBuffer(buf, pos, len);
+}
+
+Bool_t LatencyFile::ReadBuffers(char* buf, Long64_t* pos, Int_t* len,
+    Int_t nbuf) {
+  // A vector read is a single round trip
+  wait();
+  return TFile::ReadBuffers(buf, pos, len, nbuf);
+}
+
+void LatencyFile::SetLatency(UInt_t microseconds) {
+  latency_ = microseconds;
+}
+
+UInt_t LatencyFile::GetLatency() {
+  return latency_;
+}
+
+void LatencyFile::RegisterPlugin() {
+  gROOT->GetPluginManager()->AddHandler("TFile", "^latency:", "LatencyFile",
+      "FinalStateAnalysisUtilities",
+      "LatencyFile(const char*,Option_t*,const char*,Int_t)");
+}
@@ -1,4 +1,6 @@
 #include "FinalStateAnalysis/Utilities/interface/GraphSmoother.h"
+#include "FinalStateAnalysis/Utilities/interface/TreeFormulaCutFlow.h"
+#include "FinalStateAnalysis/Utilities/interface/LatencyFile.h"
 
 //From FinalStateAnalysis/StatTools
 #include "FinalStateAnalysis/StatTools/interface/RooDataHistEffBuilder.h"
@@ -23,6 +25,9 @@
 #pragma link C++ function smoothBandUtils;
 #pragma link C++ function smoothBandUtilsWithErrors;
 
+#pragma link C++ class TreeFormulaCutFlow;
+#pragma link C++ class LatencyFile;
+
 //From FinalStateAnalysis/StatTools
 #pragma link C++ class RooDataHistEffBuilder;
 #pragma link C++ class RooCruijff;
@@ -0,0 +1,71 @@
+#include "FinalStateAnalysis/Utilities/interface/TreeFormulaCutFlow.h"
+#include "TTree.h"
+#include "TTreeFormula.h"
+#include <sstream>
+#include <stdexcept>
+
+TreeFormulaCutFlow::TreeFormulaCutFlow(TTree* tree,
+    const std::vector<std::string>& cuts):tree_(tree) {
+  for (size_t i = 0; i < cuts.size(); ++i) {
+    std::stringstream name;
+    name << "cutflow" << i;
+    TTreeFormula* formula = new TTreeFormula(
+        name.str().c_str(), cuts[i].c_str(), tree_);
+    if (!formula->GetNdim()) {
+      delete formula;
+      throw std::invalid_argument("Can't compile cut: " + cuts[i]);
+    }
+    formulas_.push_back(formula);
+  }
+  passed_.resize(cuts.size(), 0);
+  passedIndividually_.resize(cuts.size(), 0);
+}
+
+TreeFormulaCutFlow::~TreeFormulaCutFlow() {
+  for (size_t i = 0; i < formulas_.size(); ++i) {
+    delete formulas_[i];
+  }
+}
+
+Long64_t TreeFormulaCutFlow::process(Long64_t firstEntry, Long64_t nentries) {
+  Long64_t lastEntry = tree_->GetEntries();
+  if (nentries >= 0 && firstEntry + nentries < lastEntry)
+    lastEntry = firstEntry + nentries;
+  mask_.clear();
+  passed_.assign(formulas_.size(), 0);
+  passedIndividually_.assign(formulas_.size(), 0);
+  if (lastEntry > firstEntry)
+    mask_.reserve(lastEntry - firstEntry);
+  int currentTree = -1;
+  for (Long64_t entry = firstEntry; entry < lastEntry; ++entry) {
+    if (tree_->LoadTree(entry) < 0)
+      break;
+    // Moved to a new file in a chain, so the leaves need to be updated.
+    if (tree_->GetTreeNumber() != currentTree) {
+      currentTree = tree_->GetTreeNumber();
+      for (size_t i = 0; i < formulas_.size(); ++i) {
+        formulas_[i]->UpdateFormulaLeaves();
+      }
+    }
+    bool passedAll = true;
+    for (size_t i = 0; i < formulas_.size(); ++i) {
+      TTreeFormula* formula = formulas_[i];
+      bool result = formula->GetNdata() > 0 && formula->EvalInstance(0);
+      if (result) {
+        ++passedIndividually_[i];
+        if (passedAll)
+          ++passed_[i];
+      } else {
+        passedAll = false;
+      }
+    }
+    mask_.push_back(passedAll);
+  }
+  return mask_.size();
+}
+
+void TreeFormulaCutFlow::fillMask(Int_t* output) const {
+  for (size_t i = 0; i < mask_.size(); ++i) {
+    output[i] = mask_[i];
+  }
+}